@@ -0,0 +1,258 @@
+# Measures how long the app takes to start from cold: the import time of each
+# module, the time to build the app, and the time until the API is listening
+# and ready against a stand-in NetworkManager. Fails if a budget is exceeded
+# so CI can catch slow imports creeping back in.
+import argparse
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from run_benchmarks import BENCHMARKS
+from run_benchmarks import call
+from run_benchmarks import SRC
+from run_benchmarks import start_bus
+from run_benchmarks import start_networkmanager
+from run_benchmarks import wait_for
+
+IMPORT_TIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+# Imports the app and builds it, printing the seconds each step took
+BUILD_APP = """
+import time
+started = time.perf_counter()
+import run
+imported = time.perf_counter()
+run.create_app()
+built = time.perf_counter()
+print(imported - started, built - imported)
+"""
+
+# Modules that must not be imported until the app starts talking to
+# NetworkManager.
+LAZY_MODULES = ("NetworkManager", "gi.repository.GLib")
+
+
+def import_profile(workdir, env):
+    # Returns the seconds taken to import and build the app, and the import
+    # time of each module.
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", BUILD_APP],
+        cwd=workdir,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    modules = {}
+    for line in process.stderr.splitlines():
+        match = IMPORT_TIME.match(line)
+        if match:
+            own, cumulative, _, name = match.groups()
+            modules[name] = {
+                "self_ms": round(int(own) / 1000, 2),
+                "cumulative_ms": round(int(cumulative) / 1000, 2),
+            }
+
+    imported, built = process.stdout.split()
+    return float(imported), float(built), modules
+
+
+def time_to_listening(args, workdir, env, run_number):
+    # Returns the seconds until the API answered and until it was ready
+    base = f"http://127.0.0.1:{args.port}"
+    app_env = dict(
+        env,
+        PATH=os.path.join(BENCHMARKS, "bin") + os.pathsep + env["PATH"],
+        PWC_HOST="127.0.0.1",
+        PWC_PORT=str(args.port),
+        PWC_EVENTS_PORT=str(args.port + 1),
+        PWC_LED="off",
+        FLASK_ENV="production",
+        FAKE_IW_SCAN_DELAY=str(args.scan_delay),
+    )
+
+    started = time.perf_counter()
+    with open(os.path.join(workdir, f"app-{run_number}.log"), "w") as log:
+        app = subprocess.Popen(
+            [sys.executable, os.path.join(SRC, "run.py")],
+            cwd=workdir,
+            env=app_env,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+
+    try:
+        wait_for(lambda: call(base, "GET", "/v1/readiness"), args.timeout)
+        listening = time.perf_counter() - started
+        wait_for(
+            lambda: call(base, "GET", "/v1/readiness")[2]["state"] == "ready",
+            args.timeout,
+        )
+        ready = time.perf_counter() - started
+    finally:
+        app.terminate()
+        app.wait()
+
+    return listening, ready
+
+
+def run(args, workdir):
+    env = dict(
+        os.environ,
+        PYTHONPATH=SRC + os.pathsep + os.environ.get("PYTHONPATH", ""),
+    )
+
+    # Importing must not need NetworkManager, so it is measured without it
+    imports = [import_profile(workdir, env) for _ in range(args.runs)]
+    modules = imports[-1][2]
+
+    results = {
+        "config": vars(args),
+        "import": {
+            "import_s": round(statistics.median(i[0] for i in imports), 3),
+            "create_app_s": round(statistics.median(i[1] for i in imports), 3),
+            "lazy_modules_loaded": sorted(
+                name for name in LAZY_MODULES if name in modules
+            ),
+            "slowest_modules": dict(
+                sorted(
+                    modules.items(),
+                    key=lambda item: item[1]["self_ms"],
+                    reverse=True,
+                )[: args.top]
+            ),
+        },
+    }
+
+    if args.skip_listening:
+        return results
+
+    # Each run starts against a fresh NetworkManager, so none finds the
+    # hotspot left running by the one before.
+    timings = []
+    for run_number in range(args.runs):
+        bus, address = start_bus(workdir)
+        processes = [bus]
+        try:
+            run_env = dict(env, DBUS_SYSTEM_BUS_ADDRESS=address)
+            processes.append(start_networkmanager(args, run_env))
+            timings.append(
+                time_to_listening(args, workdir, run_env, run_number)
+            )
+        finally:
+            for process in reversed(processes):
+                process.terminate()
+                process.wait()
+
+    results["startup"] = {
+        "listening_s": round(statistics.median(t[0] for t in timings), 3),
+        "listening_max_s": round(max(t[0] for t in timings), 3),
+        "ready_s": round(statistics.median(t[1] for t in timings), 3),
+    }
+
+    return results
+
+
+def check_budgets(results, args):
+    # Returns a list of the budgets exceeded
+    exceeded = []
+
+    if results["import"]["lazy_modules_loaded"]:
+        exceeded.append(
+            "importing the app loaded "
+            + ", ".join(results["import"]["lazy_modules_loaded"])
+        )
+
+    build = results["import"]["import_s"] + results["import"]["create_app_s"]
+    if build > args.import_budget:
+        exceeded.append(
+            f"import and create_app: {round(build, 3)} s, "
+            f"budget {args.import_budget} s"
+        )
+
+    if "startup" in results:
+        listening = results["startup"]["listening_s"]
+        if listening > args.listening_budget:
+            exceeded.append(
+                f"time to listening: {listening} s, "
+                f"budget {args.listening_budget} s"
+            )
+
+    return exceeded
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure how long the app takes to start from cold."
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--top", type=int, default=15, help="Slowest modules to report."
+    )
+    parser.add_argument(
+        "--import-budget",
+        type=float,
+        default=1.0,
+        help="Seconds allowed to import run.py and build the app.",
+    )
+    parser.add_argument(
+        "--listening-budget",
+        type=float,
+        default=2.0,
+        help="Seconds allowed from starting run.py until it answers.",
+    )
+    parser.add_argument(
+        "--skip-listening",
+        action="store_true",
+        help="Only measure imports, without a stand-in NetworkManager.",
+    )
+    parser.add_argument("--access-points", type=int, default=30)
+    parser.add_argument("--saved-connections", type=int, default=10)
+    parser.add_argument("--activation-delay", type=float, default=0.5)
+    parser.add_argument("--scan-delay", type=float, default=1.0)
+    parser.add_argument("--port", type=int, default=19090)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output", help="Write the results as JSON.")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="pwc-cold-start-")
+    try:
+        results = run(args, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(
+        f"import: {results['import']['import_s']} s, "
+        f"create_app: {results['import']['create_app_s']} s"
+    )
+    for name, timing in results["import"]["slowest_modules"].items():
+        print(
+            f"  {name}: {timing['self_ms']} ms "
+            f"({timing['cumulative_ms']} ms with its imports)"
+        )
+    if "startup" in results:
+        print(
+            f"startup: listening {results['startup']['listening_s']} s "
+            f"(max {results['startup']['listening_max_s']} s), "
+            f"ready {results['startup']['ready_s']} s"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    exceeded = check_budgets(results, args)
+    for budget in exceeded:
+        print(f"Over budget: {budget}", file=sys.stderr)
+    if exceeded:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,829 @@
+# Scriptable stand-in for the NetworkManager D-Bus service. Implements the
+# subset of the NetworkManager D-Bus API that Python Wi-Fi Connect uses, on
+# whichever bus DBUS_SYSTEM_BUS_ADDRESS points at. The benchmark runner starts
+# it on a private bus so the app can be driven without a real radio.
+import argparse
+import collections
+import dbus
+import dbus.mainloop.glib
+import dbus.service
+import random
+import sys
+import xml.etree.ElementTree as ET
+from gi.repository import GLib
+
+NM = "org.freedesktop.NetworkManager"
+NM_PATH = "/org/freedesktop/NetworkManager"
+SETTINGS = NM + ".Settings"
+SETTINGS_PATH = NM_PATH + "/Settings"
+CONNECTION = SETTINGS + ".Connection"
+DEVICE = NM + ".Device"
+WIRELESS = DEVICE + ".Wireless"
+ACCESS_POINT = NM + ".AccessPoint"
+ACTIVE_CONNECTION = NM + ".Connection.Active"
+PROPERTIES = "org.freedesktop.DBus.Properties"
+OBJECT_MANAGER = "org.freedesktop.DBus.ObjectManager"
+OBJECT_MANAGER_PATH = "/org/freedesktop"
+
+# Control interface used by the benchmark runner
+BENCHMARK = "io.balena.PythonWifiConnect.Benchmark"
+
+# NetworkManager enum values used by the stand-in
+NM_STATE_DISCONNECTED = 20
+NM_STATE_CONNECTED_GLOBAL = 70
+CONNECTIVITY_FULL = 4
+DEVICE_TYPE_WIFI = 2
+DEVICE_STATE_DISCONNECTED = 30
+DEVICE_STATE_PREPARE = 40
+DEVICE_STATE_ACTIVATED = 100
+DEVICE_STATE_FAILED = 120
+DEVICE_REASON_NONE = 0
+DEVICE_REASON_NO_SECRETS = 7
+DEVICE_REASON_SSID_NOT_FOUND = 53
+AC_STATE_ACTIVATING = 1
+AC_STATE_ACTIVATED = 2
+AC_STATE_DEACTIVATED = 4
+AC_REASON_NONE = 1
+AC_REASON_NO_SECRETS = 9
+MODE_INFRA = 2
+MODE_AP = 3
+
+INTROSPECT_DOCTYPE = (
+    '<!DOCTYPE node PUBLIC "-//freedesktop//DTD D-BUS Object Introspection '
+    '1.0//EN"\n"http://www.freedesktop.org/standards/dbus/1.0/'
+    'introspect.dtd">\n'
+)
+
+# Names NetworkManager gives the values its methods return. dbus-python leaves
+# return values unnamed in the introspection data, and python-networkmanager
+# needs the names to build its method proxies.
+OUT_ARGS = {
+    "ActivateConnection": ("active_connection",),
+    "AddAndActivateConnection": ("path", "active_connection"),
+    "AddConnection": ("path",),
+    "AddConnectionUnsaved": ("path",),
+    "Get": ("value",),
+    "GetAccessPoints": ("access_points",),
+    "GetAll": ("properties",),
+    "GetAllAccessPoints": ("access_points",),
+    "GetAllDevices": ("devices",),
+    "GetConnectionByUuid": ("connection",),
+    "GetDevices": ("devices",),
+    "GetManagedObjects": ("objects",),
+    "GetSecrets": ("secrets",),
+    "GetSettings": ("settings",),
+    "Introspect": ("xml_data",),
+    "ListConnections": ("connections",),
+}
+
+# Settings NetworkManager fills in on every profile it returns, as
+# {section: {name: signature}}. python-networkmanager reads these keys when
+# converting a profile.
+DEFAULT_SETTINGS = {
+    "ipv4": {
+        "method": "s",
+        "addresses": "aau",
+        "address-data": "aa{sv}",
+        "dns": "au",
+        "dns-search": "as",
+        "routes": "aau",
+        "route-data": "aa{sv}",
+    },
+    "ipv6": {
+        "method": "s",
+        "addresses": "a(ayuay)",
+        "address-data": "aa{sv}",
+        "dns": "aay",
+        "dns-search": "as",
+        "routes": "a(ayuayu)",
+        "route-data": "aa{sv}",
+    },
+    "proxy": {},
+}
+
+# Settings holding secrets, returned by GetSecrets rather than GetSettings
+SECRETS = {
+    "802-11-wireless-security": ("psk",),
+    "802-1x": ("password",),
+}
+
+# Password that the stand-in always rejects, to exercise failed connects
+WRONG_PASSWORD = "wrong-password"
+
+# Number of D-Bus calls received, keyed by interface and member
+calls = collections.Counter()
+
+# Every exported object with properties, by path, for GetManagedObjects
+objects = {}
+
+_TYPES = {
+    "b": dbus.Boolean,
+    "i": dbus.Int32,
+    "o": dbus.ObjectPath,
+    "s": dbus.String,
+    "u": dbus.UInt32,
+    "x": dbus.Int64,
+    "y": dbus.Byte,
+}
+
+
+def typed(signature, value):
+    # Wraps a value in the D-Bus type for its signature
+    if signature in _TYPES:
+        return _TYPES[signature](value)
+    if signature.startswith("a{"):
+        return dbus.Dictionary(value, signature=signature[2:-1])
+    if signature.startswith("a"):
+        return dbus.Array(
+            [typed(signature[1:], item) for item in value],
+            signature=signature[1:],
+        )
+    if signature.startswith("("):
+        return dbus.Struct(
+            [typed(s, v) for s, v in zip(signature[1:-1], value)],
+            signature=signature[1:-1],
+        )
+    return value
+
+
+class FakeObject(dbus.service.Object):
+    # Serves org.freedesktop.DBus.Properties from self.props, which maps each
+    # interface to {name: (signature, value)}, and lists the properties in
+    # the introspection data so python-networkmanager can find them.
+
+    def __init__(self, bus, path):
+        self.path = path
+        self.props = {}
+        super().__init__(bus, path)
+        objects[path] = self
+
+    def remove_from_connection(self, *args, **kwargs):
+        objects.pop(self.path, None)
+        super().remove_from_connection(*args, **kwargs)
+
+    def all_props(self, interface):
+        return dbus.Dictionary(
+            {
+                name: typed(signature, value)
+                for name, (signature, value) in self.props.get(
+                    interface, {}
+                ).items()
+            },
+            signature="sv",
+        )
+
+    def set_props(self, interface, **changes):
+        for name, value in changes.items():
+            signature = self.props[interface][name][0]
+            self.props[interface][name] = (signature, value)
+
+        self.PropertiesChanged(
+            interface,
+            dbus.Dictionary(
+                {
+                    name: typed(self.props[interface][name][0], value)
+                    for name, value in changes.items()
+                },
+                signature="sv",
+            ),
+            dbus.Array([], signature="s"),
+        )
+
+    def prop(self, interface, name):
+        return self.props[interface][name][1]
+
+    @dbus.service.method(PROPERTIES, in_signature="ss", out_signature="v")
+    def Get(self, interface, name):
+        calls[f"{PROPERTIES}.Get"] += 1
+        signature, value = self.props[interface][name]
+        return typed(signature, value)
+
+    @dbus.service.method(PROPERTIES, in_signature="s", out_signature="a{sv}")
+    def GetAll(self, interface):
+        calls[f"{PROPERTIES}.GetAll"] += 1
+        return self.all_props(interface)
+
+    @dbus.service.method(PROPERTIES, in_signature="ssv")
+    def Set(self, interface, name, value):
+        calls[f"{PROPERTIES}.Set"] += 1
+        self.set_props(interface, **{name: value})
+
+    @dbus.service.signal(PROPERTIES, signature="sa{sv}as")
+    def PropertiesChanged(self, interface, changed, invalidated):
+        pass
+
+    @dbus.service.method(
+        dbus.INTROSPECTABLE_IFACE,
+        in_signature="",
+        out_signature="s",
+        path_keyword="object_path",
+        connection_keyword="connection",
+    )
+    def Introspect(self, object_path, connection):
+        data = super().Introspect(object_path, connection)
+        root = ET.fromstring(data)
+
+        for interface, props in self.props.items():
+            node = root.find(f"interface[@name='{interface}']")
+            if node is None:
+                node = ET.SubElement(root, "interface", name=interface)
+            for name, (signature, _) in props.items():
+                ET.SubElement(
+                    node, "property", name=name, type=signature, access="read"
+                )
+
+        for method in root.iter("method"):
+            names = OUT_ARGS.get(method.get("name"), ())
+            outputs = [arg for arg in method if arg.get("direction") == "out"]
+            for index, arg in enumerate(outputs):
+                if "name" not in arg.attrib:
+                    arg.set(
+                        "name",
+                        names[index] if index < len(names) else f"out{index}",
+                    )
+
+        return INTROSPECT_DOCTYPE + ET.tostring(root, "unicode")
+
+
+def with_defaults(settings):
+    # Returns the settings as NetworkManager would: without secrets and with
+    # the values it fills in. The stored profile is left unchanged.
+    merged = dbus.Dictionary(
+        {
+            section: dbus.Dictionary(
+                {
+                    name: value
+                    for name, value in values.items()
+                    if name not in SECRETS.get(section, ())
+                },
+                signature="sv",
+            )
+            for section, values in settings.items()
+        },
+        signature="sa{sv}",
+    )
+
+    for section, defaults in DEFAULT_SETTINGS.items():
+        values = merged.setdefault(
+            section, dbus.Dictionary({}, signature="sv")
+        )
+        for name, signature in defaults.items():
+            if name in values:
+                continue
+            if name == "method":
+                values[name] = dbus.String("auto")
+            else:
+                values[name] = dbus.Array([], signature=signature[1:])
+
+    return merged
+
+
+class AccessPoint(FakeObject):
+    def __init__(self, bus, index, ssid, frequency, strength, security):
+        super().__init__(bus, f"{NM_PATH}/AccessPoint/{index}")
+
+        flags, wpa_flags, rsn_flags = security
+        self.ssid = ssid
+        self.props[ACCESS_POINT] = {
+            "Flags": ("u", flags),
+            "WpaFlags": ("u", wpa_flags),
+            "RsnFlags": ("u", rsn_flags),
+            "Ssid": ("ay", ssid.encode()),
+            "Frequency": ("u", frequency),
+            "HwAddress": (
+                "s",
+                "02:00:00:%02x:%02x:%02x" % tuple(index.to_bytes(3, "big")),
+            ),
+            "Mode": ("u", MODE_INFRA),
+            "MaxBitrate": ("u", 54000 if frequency < 5000 else 866700),
+            "Strength": ("y", strength),
+            "LastSeen": ("i", 100),
+        }
+
+
+class Connection(FakeObject):
+    def __init__(self, nm, index, settings):
+        super().__init__(nm.bus, f"{SETTINGS_PATH}/{index}")
+        self.nm = nm
+        self.settings = settings
+        self.props[CONNECTION] = {
+            "Unsaved": ("b", False),
+            "Flags": ("u", 0),
+            "Filename": ("s", f"/etc/NetworkManager/{index}.nmconnection"),
+        }
+
+    @dbus.service.method(CONNECTION, out_signature="a{sa{sv}}")
+    def GetSettings(self):
+        calls[f"{CONNECTION}.GetSettings"] += 1
+        return with_defaults(self.settings)
+
+    @dbus.service.method(
+        CONNECTION, in_signature="s", out_signature="a{sa{sv}}"
+    )
+    def GetSecrets(self, setting_name):
+        calls[f"{CONNECTION}.GetSecrets"] += 1
+        values = self.settings.get(setting_name, {})
+        return dbus.Dictionary(
+            {
+                setting_name: dbus.Dictionary(
+                    {
+                        name: values[name]
+                        for name in SECRETS.get(setting_name, ())
+                        if name in values
+                    },
+                    signature="sv",
+                )
+            },
+            signature="sa{sv}",
+        )
+
+    @dbus.service.method(CONNECTION, in_signature="a{sa{sv}}")
+    def Update(self, properties):
+        calls[f"{CONNECTION}.Update"] += 1
+        self.settings = properties
+        self.Updated()
+
+    @dbus.service.method(CONNECTION, in_signature="a{sa{sv}}")
+    def UpdateUnsaved(self, properties):
+        calls[f"{CONNECTION}.UpdateUnsaved"] += 1
+        self.settings = properties
+        self.Updated()
+
+    @dbus.service.method(CONNECTION)
+    def Save(self):
+        calls[f"{CONNECTION}.Save"] += 1
+
+    @dbus.service.method(CONNECTION)
+    def Delete(self):
+        calls[f"{CONNECTION}.Delete"] += 1
+        self.nm.settings.remove(self)
+
+    @dbus.service.signal(CONNECTION)
+    def Updated(self):
+        pass
+
+    @dbus.service.signal(CONNECTION)
+    def Removed(self):
+        pass
+
+
+class Settings(FakeObject):
+    def __init__(self, nm):
+        super().__init__(nm.bus, SETTINGS_PATH)
+        self.nm = nm
+        self.connections = []
+        self.next_index = 1
+        self.props[SETTINGS] = {
+            "Connections": ("ao", []),
+            "Hostname": ("s", "benchmark"),
+            "CanModify": ("b", True),
+        }
+
+    def add(self, settings):
+        connection = Connection(self.nm, self.next_index, settings)
+        self.next_index += 1
+        self.connections.append(connection)
+        self.props[SETTINGS]["Connections"] = (
+            "ao",
+            [c.path for c in self.connections],
+        )
+        self.NewConnection(connection.path)
+        return connection
+
+    def remove(self, connection):
+        self.connections.remove(connection)
+        self.props[SETTINGS]["Connections"] = (
+            "ao",
+            [c.path for c in self.connections],
+        )
+        self.nm.device.connection_removed(connection)
+        connection.Removed()
+        self.ConnectionRemoved(connection.path)
+        connection.remove_from_connection()
+
+    def find(self, path):
+        for connection in self.connections:
+            if connection.path == path:
+                return connection
+
+    @dbus.service.method(SETTINGS, out_signature="ao")
+    def ListConnections(self):
+        calls[f"{SETTINGS}.ListConnections"] += 1
+        return dbus.Array([c.path for c in self.connections], signature="o")
+
+    @dbus.service.method(SETTINGS, in_signature="s", out_signature="o")
+    def GetConnectionByUuid(self, uuid):
+        calls[f"{SETTINGS}.GetConnectionByUuid"] += 1
+        for connection in self.connections:
+            if connection.settings["connection"]["uuid"] == uuid:
+                return connection.path
+        raise dbus.exceptions.DBusException(
+            "No connection with that uuid",
+            name=SETTINGS + ".InvalidConnection",
+        )
+
+    @dbus.service.method(SETTINGS, in_signature="a{sa{sv}}", out_signature="o")
+    def AddConnection(self, connection):
+        calls[f"{SETTINGS}.AddConnection"] += 1
+        return self.add(connection).path
+
+    @dbus.service.method(SETTINGS, in_signature="a{sa{sv}}", out_signature="o")
+    def AddConnectionUnsaved(self, connection):
+        calls[f"{SETTINGS}.AddConnectionUnsaved"] += 1
+        return self.add(connection).path
+
+    @dbus.service.signal(SETTINGS, signature="o")
+    def NewConnection(self, path):
+        pass
+
+    @dbus.service.signal(SETTINGS, signature="o")
+    def ConnectionRemoved(self, path):
+        pass
+
+
+class ActiveConnection(FakeObject):
+    def __init__(self, nm, index, connection):
+        super().__init__(nm.bus, f"{NM_PATH}/ActiveConnection/{index}")
+        # dbus.service.Object has a read-only connection property
+        self.settings_connection = connection
+        settings = connection.settings["connection"]
+        self.props[ACTIVE_CONNECTION] = {
+            "Connection": ("o", connection.path),
+            "SpecificObject": ("o", "/"),
+            "Id": ("s", settings["id"]),
+            "Uuid": ("s", settings["uuid"]),
+            "Type": ("s", settings["type"]),
+            "Devices": ("ao", [nm.device.path]),
+            "State": ("u", AC_STATE_ACTIVATING),
+            "StateFlags": ("u", 0),
+            "Default": ("b", False),
+            "Default6": ("b", False),
+            "Vpn": ("b", False),
+            "Ip4Config": ("o", "/"),
+            "Ip6Config": ("o", "/"),
+            "Dhcp4Config": ("o", "/"),
+            "Dhcp6Config": ("o", "/"),
+            "Master": ("o", "/"),
+        }
+
+    def set_state(self, state, reason):
+        self.set_props(ACTIVE_CONNECTION, State=state)
+        self.StateChanged(state, reason)
+
+    @dbus.service.signal(ACTIVE_CONNECTION, signature="uu")
+    def StateChanged(self, state, reason):
+        pass
+
+
+class WifiDevice(FakeObject):
+    def __init__(self, nm, access_points, activation_delay):
+        super().__init__(nm.bus, f"{NM_PATH}/Devices/1")
+        self.nm = nm
+        self.access_points = access_points
+        self.activation_delay = activation_delay
+        self.active = None
+        self.props[DEVICE] = {
+            "Udi": ("s", "/sys/devices/virtual/net/wlan0"),
+            "Interface": ("s", "wlan0"),
+            "IpInterface": ("s", "wlan0"),
+            "Driver": ("s", "fake"),
+            "DeviceType": ("u", DEVICE_TYPE_WIFI),
+            "State": ("u", DEVICE_STATE_DISCONNECTED),
+            "StateReason": ("(uu)", (DEVICE_STATE_DISCONNECTED, 0)),
+            "ActiveConnection": ("o", "/"),
+            "AvailableConnections": ("ao", []),
+            "Managed": ("b", True),
+            "Autoconnect": ("b", True),
+            "Ip4Config": ("o", "/"),
+            "Ip6Config": ("o", "/"),
+            "Dhcp4Config": ("o", "/"),
+            "Dhcp6Config": ("o", "/"),
+        }
+        self.props[WIRELESS] = {
+            "HwAddress": ("s", "02:00:00:00:00:01"),
+            "PermHwAddress": ("s", "02:00:00:00:00:01"),
+            "Mode": ("u", MODE_INFRA),
+            "Bitrate": ("u", 0),
+            "AccessPoints": ("ao", [ap.path for ap in access_points]),
+            "ActiveAccessPoint": ("o", "/"),
+            "WirelessCapabilities": ("u", 0x7FF),
+            "LastScan": ("x", 0),
+        }
+
+    def set_state(self, state, reason):
+        old_state = self.prop(DEVICE, "State")
+        self.set_props(DEVICE, State=state, StateReason=(state, reason))
+        self.StateChanged(state, old_state, reason)
+
+    def activate(self, connection, active):
+        self.active = active
+        self.set_props(DEVICE, ActiveConnection=active.path)
+        self.set_state(DEVICE_STATE_PREPARE, DEVICE_REASON_NONE)
+        GLib.timeout_add(
+            int(self.activation_delay * 1000), self.finish_activation, active
+        )
+
+    def finish_activation(self, active):
+        if active is not self.active:
+            return False
+
+        settings = active.settings_connection.settings
+        wireless = settings.get("802-11-wireless", {})
+        mode = MODE_AP if wireless.get("mode") == "ap" else MODE_INFRA
+        ssid = bytes(wireless.get("ssid", b"")).decode(errors="replace")
+        psk = settings.get("802-11-wireless-security", {}).get("psk")
+
+        if mode == MODE_INFRA and ssid not in {
+            ap.ssid for ap in self.access_points
+        }:
+            self.fail(DEVICE_REASON_SSID_NOT_FOUND, AC_REASON_NONE)
+        elif psk == WRONG_PASSWORD:
+            self.fail(DEVICE_REASON_NO_SECRETS, AC_REASON_NO_SECRETS)
+        else:
+            self.set_props(WIRELESS, Mode=mode)
+            self.set_state(DEVICE_STATE_ACTIVATED, DEVICE_REASON_NONE)
+            active.set_state(AC_STATE_ACTIVATED, AC_REASON_NONE)
+            self.nm.set_state(NM_STATE_CONNECTED_GLOBAL)
+
+        return False
+
+    def fail(self, device_reason, active_reason):
+        self.set_state(DEVICE_STATE_FAILED, device_reason)
+        self.deactivate(active_reason)
+
+    def deactivate(self, reason=AC_REASON_NONE):
+        active = self.active
+        self.active = None
+        if active is None:
+            return
+
+        self.set_props(DEVICE, ActiveConnection="/")
+        self.set_props(WIRELESS, Mode=MODE_INFRA)
+        self.set_state(DEVICE_STATE_DISCONNECTED, DEVICE_REASON_NONE)
+        active.set_state(AC_STATE_DEACTIVATED, reason)
+        self.nm.set_props(NM, ActiveConnections=[])
+        self.nm.set_state(NM_STATE_DISCONNECTED)
+        active.remove_from_connection()
+
+    def connection_removed(self, connection):
+        if self.active and self.active.settings_connection is connection:
+            self.deactivate()
+
+    @dbus.service.method(DEVICE)
+    def Disconnect(self):
+        calls[f"{DEVICE}.Disconnect"] += 1
+        self.deactivate()
+
+    @dbus.service.method(WIRELESS, out_signature="ao")
+    def GetAccessPoints(self):
+        calls[f"{WIRELESS}.GetAccessPoints"] += 1
+        return dbus.Array(
+            [ap.path for ap in self.access_points], signature="o"
+        )
+
+    @dbus.service.method(WIRELESS, out_signature="ao")
+    def GetAllAccessPoints(self):
+        calls[f"{WIRELESS}.GetAllAccessPoints"] += 1
+        return dbus.Array(
+            [ap.path for ap in self.access_points], signature="o"
+        )
+
+    @dbus.service.method(WIRELESS, in_signature="a{sv}")
+    def RequestScan(self, options):
+        calls[f"{WIRELESS}.RequestScan"] += 1
+        GLib.timeout_add(int(self.nm.scan_delay * 1000), self.finish_scan)
+
+    def finish_scan(self):
+        self.set_props(
+            WIRELESS, LastScan=int(GLib.get_monotonic_time() / 1000)
+        )
+        return False
+
+    @dbus.service.signal(DEVICE, signature="uuu")
+    def StateChanged(self, new_state, old_state, reason):
+        pass
+
+    @dbus.service.signal(WIRELESS, signature="o")
+    def AccessPointAdded(self, path):
+        pass
+
+    @dbus.service.signal(WIRELESS, signature="o")
+    def AccessPointRemoved(self, path):
+        pass
+
+
+class ObjectManager(dbus.service.Object):
+    def __init__(self, bus):
+        super().__init__(bus, OBJECT_MANAGER_PATH)
+
+    @dbus.service.method(OBJECT_MANAGER, out_signature="a{oa{sa{sv}}}")
+    def GetManagedObjects(self):
+        calls[f"{OBJECT_MANAGER}.GetManagedObjects"] += 1
+        return dbus.Dictionary(
+            {
+                path: dbus.Dictionary(
+                    {
+                        interface: obj.all_props(interface)
+                        for interface in obj.props
+                    },
+                    signature="sa{sv}",
+                )
+                for path, obj in objects.items()
+            },
+            signature="oa{sa{sv}}",
+        )
+
+
+class Placeholder(FakeObject):
+    # Objects python-networkmanager creates at import but the app never uses
+    pass
+
+
+class NetworkManager(FakeObject):
+    def __init__(self, bus, args):
+        super().__init__(bus, NM_PATH)
+        self.bus = bus
+        self.scan_delay = args.scan_delay
+        self.next_active = 1
+
+        rng = random.Random(args.seed)
+        securities = [
+            (1, 0, 0x188),  # WPA2
+            (0, 0, 0),  # Open
+            (1, 0x188, 0),  # WPA
+            (1, 0, 0x200),  # Enterprise
+            (1, 0, 0),  # WEP
+        ]
+        access_points = [
+            AccessPoint(
+                bus,
+                index + 1,
+                # Two BSSIDs per SSID, as with dual band routers
+                f"network-{index // 2}",
+                2412 + 5 * (index % 13) if index % 2 == 0 else 5180,
+                rng.randint(10, 100),
+                securities[(index // 2) % len(securities)],
+            )
+            for index in range(args.access_points)
+        ]
+
+        self.object_manager = ObjectManager(bus)
+        self.settings = Settings(self)
+        self.device = WifiDevice(self, access_points, args.activation_delay)
+        self.placeholders = [
+            Placeholder(bus, NM_PATH + "/AgentManager"),
+            Placeholder(bus, NM_PATH + "/DnsManager"),
+        ]
+
+        for index in range(args.saved_connections):
+            self.settings.add(
+                dbus.Dictionary(
+                    {
+                        "connection": dbus.Dictionary(
+                            {
+                                "id": f"saved-{index}",
+                                "uuid": f"00000000-0000-0000-0000-{index:012}",
+                                "type": "802-11-wireless",
+                                "autoconnect": dbus.Boolean(False),
+                            },
+                            signature="sv",
+                        ),
+                        "802-11-wireless": dbus.Dictionary(
+                            {
+                                "mode": "infrastructure",
+                                "ssid": dbus.ByteArray(
+                                    f"saved-{index}".encode()
+                                ),
+                            },
+                            signature="sv",
+                        ),
+                    },
+                    signature="sa{sv}",
+                )
+            )
+
+        self.props[NM] = {
+            "Devices": ("ao", [self.device.path]),
+            "AllDevices": ("ao", [self.device.path]),
+            "ActiveConnections": ("ao", []),
+            "PrimaryConnection": ("o", "/"),
+            "NetworkingEnabled": ("b", True),
+            "WirelessEnabled": ("b", True),
+            "WirelessHardwareEnabled": ("b", True),
+            "Startup": ("b", False),
+            "Version": ("s", "1.30.0"),
+            "State": ("u", NM_STATE_DISCONNECTED),
+            "Connectivity": ("u", CONNECTIVITY_FULL),
+            "Metered": ("u", 0),
+        }
+
+    def set_state(self, state):
+        self.set_props(NM, State=state)
+        self.StateChanged(state)
+
+    def activate(self, connection_path, device_path):
+        connection = self.settings.find(connection_path)
+        if connection is None:
+            raise dbus.exceptions.DBusException(
+                "Unknown connection", name=NM + ".UnknownConnection"
+            )
+
+        self.device.deactivate()
+        active = ActiveConnection(self, self.next_active, connection)
+        self.next_active += 1
+        self.set_props(NM, ActiveConnections=[active.path])
+        self.device.activate(connection, active)
+        return active
+
+    @dbus.service.method(NM, out_signature="ao")
+    def GetDevices(self):
+        calls[f"{NM}.GetDevices"] += 1
+        return dbus.Array([self.device.path], signature="o")
+
+    @dbus.service.method(NM, out_signature="ao")
+    def GetAllDevices(self):
+        calls[f"{NM}.GetAllDevices"] += 1
+        return dbus.Array([self.device.path], signature="o")
+
+    @dbus.service.method(NM, in_signature="ooo", out_signature="o")
+    def ActivateConnection(self, connection, device, specific_object):
+        calls[f"{NM}.ActivateConnection"] += 1
+        return self.activate(connection, device).path
+
+    @dbus.service.method(NM, in_signature="a{sa{sv}}oo", out_signature="oo")
+    def AddAndActivateConnection(self, connection, device, specific_object):
+        calls[f"{NM}.AddAndActivateConnection"] += 1
+        saved = self.settings.add(connection)
+        active = self.activate(saved.path, device)
+        return saved.path, active.path
+
+    @dbus.service.method(NM, in_signature="o")
+    def DeactivateConnection(self, active_connection):
+        calls[f"{NM}.DeactivateConnection"] += 1
+        self.device.deactivate()
+
+    @dbus.service.signal(NM, signature="u")
+    def StateChanged(self, state):
+        pass
+
+    @dbus.service.signal(NM, signature="o")
+    def DeviceAdded(self, path):
+        pass
+
+    @dbus.service.signal(NM, signature="o")
+    def DeviceRemoved(self, path):
+        pass
+
+    @dbus.service.method(BENCHMARK, out_signature="a{su}")
+    def GetCallCounts(self):
+        return dbus.Dictionary(dict(calls), signature="su")
+
+    @dbus.service.method(BENCHMARK)
+    def ResetCallCounts(self):
+        calls.clear()
+
+    @dbus.service.method(BENCHMARK, out_signature="uu")
+    def GetDeviceState(self):
+        return (
+            self.device.prop(DEVICE, "State"),
+            self.device.prop(WIRELESS, "Mode"),
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Stand-in for the NetworkManager D-Bus service."
+    )
+    parser.add_argument("--access-points", type=int, default=30)
+    parser.add_argument("--saved-connections", type=int, default=10)
+    parser.add_argument(
+        "--activation-delay",
+        type=float,
+        default=0.5,
+        help="Seconds a connection takes to activate.",
+    )
+    parser.add_argument(
+        "--scan-delay",
+        type=float,
+        default=1.0,
+        help="Seconds a RequestScan takes to complete.",
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    bus = dbus.SystemBus()
+    nm = NetworkManager(bus, args)
+    name = dbus.service.BusName(NM, bus)
+
+    # Tell the benchmark runner the service is ready
+    print("ready", flush=True)
+
+    try:
+        GLib.MainLoop().run()
+    finally:
+        del name, nm
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,483 @@
+# Benchmarks the API against a stand-in NetworkManager on a private D-Bus bus
+# and a stand-in iw. Reports p50/p99 latency and throughput for each endpoint,
+# and can write the results as JSON or compare them with a baseline so CI can
+# catch regressions.
+import argparse
+import dbus
+import dbus.bus
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(os.path.dirname(BENCHMARKS), "src")
+
+NM = "org.freedesktop.NetworkManager"
+NM_PATH = "/org/freedesktop/NetworkManager"
+BENCHMARK = "io.balena.PythonWifiConnect.Benchmark"
+WIRELESS = NM + ".Device.Wireless"
+ACCESS_POINT = NM + ".AccessPoint"
+PROPERTIES = "org.freedesktop.DBus.Properties"
+OBJECT_MANAGER = "org.freedesktop.DBus.ObjectManager"
+
+# Access point properties the app reads
+AP_PROPERTIES = ("Flags", "WpaFlags", "RsnFlags", "Ssid", "Strength")
+# Paths fetched by phones and laptops to check for a captive portal
+PORTAL_PROBES = (
+    ("android", "/generate_204"),
+    ("apple", "/hotspot-detect.html"),
+    ("windows", "/connecttest.txt"),
+)
+
+DEVICE_STATE_ACTIVATED = 100
+MODE_INFRA = 2
+MODE_AP = 3
+
+BUS_CONFIG = """<!DOCTYPE busconfig PUBLIC
+ "-//freedesktop//DTD D-Bus Bus Configuration 1.0//EN"
+ "http://www.freedesktop.org/standards/dbus/1.0/busconfig.dtd">
+<busconfig>
+  <type>session</type>
+  <listen>unix:tmpdir={tmpdir}</listen>
+  <auth>EXTERNAL</auth>
+  <policy context="default">
+    <allow send_destination="*" eavesdrop="true"/>
+    <allow eavesdrop="true"/>
+    <allow own="*"/>
+  </policy>
+</busconfig>
+"""
+
+
+def start_bus(workdir):
+    # Starts a private bus and returns the process and its address
+    config_path = os.path.join(workdir, "bus.conf")
+    with open(config_path, "w") as f:
+        f.write(BUS_CONFIG.format(tmpdir=workdir))
+
+    process = subprocess.Popen(
+        [
+            "dbus-daemon",
+            f"--config-file={config_path}",
+            "--nofork",
+            "--nopidfile",
+            "--print-address",
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+
+    return process, process.stdout.readline().strip()
+
+
+def start_networkmanager(args, env):
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(BENCHMARKS, "fake_networkmanager.py"),
+            f"--access-points={args.access_points}",
+            f"--saved-connections={args.saved_connections}",
+            f"--activation-delay={args.activation_delay}",
+            f"--scan-delay={args.scan_delay}",
+        ],
+        stdout=subprocess.PIPE,
+        env=env,
+        text=True,
+    )
+
+    if process.stdout.readline().strip() != "ready":
+        raise RuntimeError("The stand-in NetworkManager failed to start.")
+
+    return process
+
+
+def call(base, method, path, body=None):
+    # Returns the seconds taken, the status code and the decoded response
+    request = urllib.request.Request(
+        base + path,
+        data=None if body is None else json.dumps(body).encode(),
+        method=method,
+        headers={"Content-Type": "application/json"},
+    )
+
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=120) as response:
+            status = response.status
+            content = response.read()
+    except urllib.error.HTTPError as e:
+        status = e.code
+        content = e.read()
+
+    elapsed = time.perf_counter() - started
+    try:
+        return elapsed, status, json.loads(content or b"null")
+    except ValueError:
+        return elapsed, status, None
+
+
+def wait_for(predicate, timeout, interval=0.01):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if predicate():
+                return True
+        except (OSError, dbus.exceptions.DBusException):
+            pass
+        time.sleep(interval)
+
+    raise TimeoutError("Timed out waiting for the benchmark to progress.")
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile
+    values = sorted(values)
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def summarise(latencies, errors, wall):
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3),
+        "throughput_rps": round(len(latencies) / wall, 1),
+    }
+
+
+def load(base, method, path, requests, concurrency, body=None):
+    # Sends requests from several clients at once
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        started = time.perf_counter()
+        results = list(
+            pool.map(lambda _: call(base, method, path, body), range(requests))
+        )
+        wall = time.perf_counter() - started
+
+    return summarise(
+        [elapsed for elapsed, _, _ in results],
+        sum(1 for _, status, _ in results if status >= 400),
+        wall,
+    )
+
+
+def device_in_mode(control, mode):
+    state, current_mode = control.GetDeviceState(dbus_interface=BENCHMARK)
+    return state == DEVICE_STATE_ACTIVATED and current_mode == mode
+
+
+def connect_cycle(base, control, iterations, timeout):
+    # Connects to a network and forgets it again, timing both the response
+    # and how long until the radio is in the expected mode.
+    results = {
+        "connect": [],
+        "connect_complete": [],
+        "forget": [],
+        "forget_complete": [],
+    }
+
+    for _ in range(iterations):
+        wait_for(lambda: device_in_mode(control, MODE_AP), timeout)
+
+        started = time.perf_counter()
+        elapsed, status, _ = call(
+            base,
+            "POST",
+            "/v1/connect",
+            {
+                "ssid": "network-0",
+                "conn_type": "WPA2",
+                "password": "benchmark-password",
+            },
+        )
+        if status != 202:
+            raise RuntimeError(f"Connect returned status {status}.")
+        results["connect"].append(elapsed)
+        wait_for(lambda: device_in_mode(control, MODE_INFRA), timeout)
+        results["connect_complete"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        elapsed, status, _ = call(base, "POST", "/v1/forget", {})
+        if status != 202:
+            raise RuntimeError(f"Forget returned status {status}.")
+        results["forget"].append(elapsed)
+        wait_for(lambda: device_in_mode(control, MODE_AP), timeout)
+        results["forget_complete"].append(time.perf_counter() - started)
+
+    return {
+        name: summarise(latencies, 0, sum(latencies))
+        for name, latencies in results.items()
+    }
+
+
+def portal_probes(base, requests):
+    # Times the captive portal responder's answer to each operating system's
+    # check, one request at a time as a device would send them.
+    results = {}
+
+    for name, path in PORTAL_PROBES:
+        latencies = []
+        errors = 0
+        started = time.perf_counter()
+        for _ in range(requests):
+            elapsed, status, _ = call(base, "GET", path)
+            latencies.append(elapsed)
+            errors += status != 200
+        results[f"portal_{name}"] = summarise(
+            latencies, errors, time.perf_counter() - started
+        )
+
+    return results
+
+
+def access_point_fetch(address, control, repeats):
+    # Compares ways of reading every visible access point: a Get for each
+    # property, a GetAll for each access point, and one GetManagedObjects.
+    # Returns a summary and the D-Bus calls made for each.
+    bus = dbus.bus.BusConnection(address)
+    device_path = bus.get_object(NM, NM_PATH).GetDevices(dbus_interface=NM)[0]
+    device = bus.get_object(NM, device_path)
+
+    def per_property():
+        for path in device.GetAccessPoints(dbus_interface=WIRELESS):
+            ap = bus.get_object(NM, path)
+            for name in AP_PROPERTIES:
+                ap.Get(ACCESS_POINT, name, dbus_interface=PROPERTIES)
+
+    def get_all():
+        for path in device.GetAccessPoints(dbus_interface=WIRELESS):
+            bus.get_object(NM, path).GetAll(
+                ACCESS_POINT, dbus_interface=PROPERTIES
+            )
+
+    def managed_objects():
+        bus.get_object(NM, "/org/freedesktop").GetManagedObjects(
+            dbus_interface=OBJECT_MANAGER
+        )
+
+    summaries = {}
+    calls = {}
+    for name, fetch in (
+        ("ap_fetch_per_property", per_property),
+        ("ap_fetch_get_all", get_all),
+        ("ap_fetch_managed_objects", managed_objects),
+    ):
+        control.ResetCallCounts(dbus_interface=BENCHMARK)
+        latencies = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            fetch()
+            latencies.append(time.perf_counter() - started)
+        calls[name] = dict(control.GetCallCounts(dbus_interface=BENCHMARK))
+        summaries[name] = summarise(latencies, 0, sum(latencies))
+
+    bus.close()
+
+    return summaries, calls
+
+
+def compare(results, baseline, tolerance):
+    # Returns a list of regressions against the baseline results
+    regressions = []
+
+    for name, summary in baseline["endpoints"].items():
+        current = results["endpoints"].get(name)
+        if current is None:
+            continue
+        for metric in ("p50_ms", "p99_ms"):
+            if current[metric] > summary[metric] * (1 + tolerance):
+                regressions.append(
+                    f"{name} {metric}: {current[metric]} ms, "
+                    f"baseline {summary[metric]} ms"
+                )
+
+    ready = results["startup"]["ready_s"]
+    baseline_ready = baseline["startup"]["ready_s"]
+    if ready > baseline_ready * (1 + tolerance):
+        regressions.append(
+            f"startup ready_s: {ready} s, baseline {baseline_ready} s"
+        )
+
+    return regressions
+
+
+def run(args, workdir):
+    bus, address = start_bus(workdir)
+    processes = [bus]
+
+    try:
+        env = dict(os.environ, DBUS_SYSTEM_BUS_ADDRESS=address)
+        processes.append(start_networkmanager(args, env))
+        control = dbus.bus.BusConnection(address).get_object(NM, NM_PATH)
+
+        # Reading the access points, measured before the app is started so
+        # its own calls are not counted.
+        fetch_summaries, fetch_calls = access_point_fetch(
+            address, control, args.fetch_repeats
+        )
+
+        base = f"http://127.0.0.1:{args.port}"
+        app_env = dict(
+            env,
+            PATH=os.path.join(BENCHMARKS, "bin") + os.pathsep + env["PATH"],
+            PWC_HOST="127.0.0.1",
+            PWC_PORT=str(args.port),
+            PWC_PORTAL_HOST="127.0.0.1",
+            PWC_PORTAL_PORT=str(args.port + 2),
+            PWC_LED="off",
+            FLASK_ENV="production",
+            FAKE_IW_SCAN_DELAY=str(args.scan_delay),
+        )
+
+        # Startup
+        started = time.perf_counter()
+        with open(os.path.join(workdir, "app.log"), "w") as log:
+            processes.append(
+                subprocess.Popen(
+                    [sys.executable, os.path.join(SRC, "run.py")],
+                    cwd=workdir,
+                    env=app_env,
+                    stdout=log,
+                    stderr=subprocess.STDOUT,
+                )
+            )
+
+        wait_for(lambda: call(base, "GET", "/v1/readiness"), args.timeout)
+        listening = time.perf_counter() - started
+        wait_for(
+            lambda: call(base, "GET", "/v1/readiness")[2]["state"] == "ready",
+            args.timeout,
+        )
+        ready = time.perf_counter() - started
+
+        results = {
+            "config": vars(args),
+            "startup": {
+                "listening_s": round(listening, 3),
+                "ready_s": round(ready, 3),
+                "reported": call(base, "GET", "/v1/readiness")[2],
+            },
+            "endpoints": dict(fetch_summaries),
+            "dbus_calls": dict(fetch_calls),
+        }
+
+        def measure(name, benchmark):
+            control.ResetCallCounts(dbus_interface=BENCHMARK)
+            summary = benchmark()
+            results["dbus_calls"][name] = dict(
+                control.GetCallCounts(dbus_interface=BENCHMARK)
+            )
+            return summary
+
+        # Read-only endpoints, from several clients at once
+        for name, path, requests in (
+            ("list_access_points", "/v1/list_access_points", args.requests),
+            (
+                "list_access_points_fresh",
+                "/v1/list_access_points?fresh=1",
+                max(1, args.requests // 10),
+            ),
+            ("connection_status", "/v1/connection_status", args.requests),
+        ):
+            results["endpoints"][name] = measure(
+                name,
+                lambda: load(base, "GET", path, requests, args.concurrency),
+            )
+
+        # Captive portal checks, answered while the hotspot is up
+        wait_for(lambda: device_in_mode(control, MODE_AP), args.timeout)
+        results["endpoints"].update(
+            portal_probes(
+                f"http://127.0.0.1:{args.port + 2}",
+                max(1, args.requests // 10),
+            )
+        )
+
+        # Connect and forget, one at a time as a user would
+        results["endpoints"].update(
+            measure(
+                "connect_cycle",
+                lambda: connect_cycle(
+                    base, control, args.connect_iterations, args.timeout
+                ),
+            )
+        )
+
+        return results
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the API against a stand-in NetworkManager."
+    )
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--connect-iterations", type=int, default=5)
+    parser.add_argument("--fetch-repeats", type=int, default=20)
+    parser.add_argument("--access-points", type=int, default=30)
+    parser.add_argument("--saved-connections", type=int, default=10)
+    parser.add_argument("--activation-delay", type=float, default=0.5)
+    parser.add_argument("--scan-delay", type=float, default=1.0)
+    parser.add_argument("--port", type=int, default=19090)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output", help="Write the results as JSON.")
+    parser.add_argument(
+        "--compare", help="Fail if slower than these JSON results."
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Fraction slower than the baseline allowed by --compare.",
+    )
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="pwc-benchmark-")
+    try:
+        results = run(args, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(
+        f"startup: listening {results['startup']['listening_s']} s, "
+        f"ready {results['startup']['ready_s']} s"
+    )
+    for name, summary in results["endpoints"].items():
+        print(
+            f"{name:28} p50 {summary['p50_ms']:>9} ms  "
+            f"p99 {summary['p99_ms']:>9} ms  "
+            f"{summary['throughput_rps']:>7} req/s  "
+            f"errors {summary['errors']}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
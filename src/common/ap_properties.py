@@ -0,0 +1,151 @@
+import dbus
+from collections import namedtuple
+from common import metrics
+from common import nm_signals
+from common.errors import logger
+
+OBJECT_MANAGER = "org.freedesktop.DBus.ObjectManager"
+OBJECT_MANAGER_PATH = "/org/freedesktop"
+
+# Errors meaning NetworkManager cannot list its objects in one call
+UNSUPPORTED = {
+    "org.freedesktop.DBus.Error.NotSupported",
+    "org.freedesktop.DBus.Error.UnknownInterface",
+    "org.freedesktop.DBus.Error.UnknownMethod",
+    "org.freedesktop.DBus.Error.UnknownObject",
+}
+
+# The properties of an access point that are needed, read in one go rather
+# than with a D-Bus call for each.
+AccessPoint = namedtuple(
+    "AccessPoint",
+    [
+        "path",
+        "ssid",
+        "bssid",
+        "flags",
+        "wpa_flags",
+        "rsn_flags",
+        "strength",
+        "frequency",
+        "max_bitrate",
+        "mode",
+        "last_seen",
+    ],
+)
+
+# Names of NM80211Mode values
+MODES = {1: "adhoc", 2: "infrastructure", 3: "ap", 4: "mesh"}
+
+# Set if this NetworkManager cannot list its objects in one call, in which
+# case each access point is read with its own GetAll.
+_object_manager_unavailable = False
+
+
+def _record(path, properties):
+    return AccessPoint(
+        path=str(path),
+        ssid=bytes(properties.get("Ssid", b"")).decode("utf-8", "replace"),
+        bssid=str(properties.get("HwAddress", "")),
+        flags=int(properties.get("Flags", 0)),
+        wpa_flags=int(properties.get("WpaFlags", 0)),
+        rsn_flags=int(properties.get("RsnFlags", 0)),
+        strength=int(properties.get("Strength", 0)),
+        frequency=int(properties.get("Frequency", 0)),
+        max_bitrate=int(properties.get("MaxBitrate", 0)),
+        mode=MODES.get(int(properties.get("Mode", 0)), "unknown"),
+        last_seen=int(properties.get("LastSeen", -1)),
+    )
+
+
+def band(frequency):
+    # Returns the band a frequency in MHz is in
+    if frequency < 3000:
+        return "2.4GHz"
+    elif frequency < 5925:
+        return "5GHz"
+    else:
+        return "6GHz"
+
+
+def channel(frequency):
+    # Returns the channel number of a frequency in MHz, or None if unknown
+    if frequency == 2484:
+        return 14
+    elif 2412 <= frequency <= 2472:
+        return (frequency - 2407) // 5
+    elif 5150 <= frequency < 5925:
+        return (frequency - 5000) // 5
+    elif 5955 <= frequency <= 7115:
+        return (frequency - 5950) // 5
+    else:
+        return None
+
+
+def _get_object(path):
+    return dbus.SystemBus().get_object(nm_signals.NM_SERVICE, path)
+
+
+def _from_managed_objects(device_path):
+    manager = _get_object(OBJECT_MANAGER_PATH)
+    with metrics.dbus_call("GetManagedObjects"):
+        objects = manager.GetManagedObjects(dbus_interface=OBJECT_MANAGER)
+
+    device = objects.get(dbus.ObjectPath(device_path))
+    if device is None or nm_signals.NM_DEVICE_WIRELESS not in device:
+        raise LookupError(f"{device_path} not listed by GetManagedObjects.")
+
+    return [
+        _record(path, objects[path][nm_signals.NM_ACCESS_POINT])
+        for path in device[nm_signals.NM_DEVICE_WIRELESS]["AccessPoints"]
+        if nm_signals.NM_ACCESS_POINT in objects.get(path, {})
+    ]
+
+
+def get(path):
+    # Reads a single access point
+    with metrics.dbus_call("AccessPoint.GetAll"):
+        properties = _get_object(path).GetAll(
+            nm_signals.NM_ACCESS_POINT,
+            dbus_interface=nm_signals.DBUS_PROPERTIES,
+        )
+
+    return _record(path, properties)
+
+
+def get_all(device_path):
+    # Reads every access point the device can see, with a single call where
+    # NetworkManager supports it.
+    global _object_manager_unavailable
+
+    if not _object_manager_unavailable:
+        try:
+            return _from_managed_objects(str(device_path))
+        except dbus.exceptions.DBusException as e:
+            # Only stop trying when NetworkManager does not support it, and
+            # otherwise fall back for this call alone.
+            if e.get_dbus_name() in UNSUPPORTED:
+                logger.info(
+                    "GetManagedObjects unavailable. Reading access points "
+                    "one at a time."
+                )
+                _object_manager_unavailable = True
+            else:
+                logger.debug(f"GetManagedObjects failed: {e}")
+        except LookupError as e:
+            logger.debug(e)
+
+    with metrics.dbus_call("GetAccessPoints"):
+        paths = _get_object(device_path).GetAccessPoints(
+            dbus_interface=nm_signals.NM_DEVICE_WIRELESS
+        )
+
+    access_points = []
+    for path in paths:
+        try:
+            access_points.append(get(path))
+        except dbus.exceptions.DBusException:
+            # The access point went out of range after it was listed
+            continue
+
+    return access_points
@@ -0,0 +1,52 @@
+import asyncio
+import threading
+
+# The event stream and the captive portal responder answer HTTP from asyncio
+# servers, each with an event loop in a thread of its own, rather than from
+# waitress. Requests to them are simple enough to parse here.
+
+
+def _run(loop):
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+def start_loop(name):
+    # Returns a new event loop running in a daemon thread of the given name
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=_run, args=(loop,), name=name, daemon=True).start()
+
+    return loop
+
+
+def serve(loop, handler, host, port, timeout=5):
+    # Starts a server calling handler(reader, writer) for each client on the
+    # loop, and returns it once listening. Raises if it cannot listen.
+    return asyncio.run_coroutine_threadsafe(
+        asyncio.start_server(handler, host, port), loop
+    ).result(timeout)
+
+
+async def read_request(reader, timeout=10):
+    # Returns the method and path of a request, without the query string.
+    # The method is None if the request line is malformed.
+    request_line = await asyncio.wait_for(reader.readline(), timeout)
+
+    # Headers are not needed, only read past them
+    while await asyncio.wait_for(reader.readline(), timeout) not in (
+        b"\r\n",
+        b"\n",
+        b"",
+    ):
+        pass
+
+    parts = request_line.decode("latin-1").split()
+    if len(parts) < 2:
+        return None, "/"
+
+    path = parts[1].split("?")[0]
+    # Some clients send the full URL
+    if "://" in path:
+        path = "/" + path.split("://", 1)[1].partition("/")[2]
+
+    return parts[0], path
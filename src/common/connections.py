@@ -0,0 +1,154 @@
+import threading
+from common import metrics
+from common import nm_signals
+from common.errors import logger
+from common.nm import Pnm  # Python NetworkManager
+
+NM_SETTINGS = "org.freedesktop.NetworkManager.Settings"
+NM_SETTINGS_CONNECTION = "org.freedesktop.NetworkManager.Settings.Connection"
+
+# Saved connections indexed by object path, id and uuid. Each entry holds the
+# connection object and its settings so lookups need no D-Bus traffic.
+_by_path = {}
+_by_id = {}
+_by_uuid = {}
+_lock = threading.RLock()
+
+# True once the index is built and kept current by NetworkManager signals.
+# If signals are unavailable every lookup reads the settings of every saved
+# connection instead.
+_live = False
+_signals_unavailable = False
+
+
+def _index(connection, settings=None):
+    if settings is None:
+        with metrics.dbus_call("GetSettings"):
+            settings = connection.GetSettings()
+
+    entry = {"connection": connection, "settings": settings}
+    path = str(connection.object_path)
+
+    with _lock:
+        _unindex(path)
+        _by_path[path] = entry
+        _by_id[settings["connection"]["id"]] = entry
+        _by_uuid[settings["connection"]["uuid"]] = entry
+
+    return entry
+
+
+def _unindex(path):
+    with _lock:
+        entry = _by_path.pop(str(path), None)
+        if entry is None:
+            return
+
+        settings = entry["settings"]["connection"]
+        if _by_id.get(settings["id"]) is entry:
+            del _by_id[settings["id"]]
+        if _by_uuid.get(settings["uuid"]) is entry:
+            del _by_uuid[settings["uuid"]]
+
+
+def _on_new_connection(path):
+    try:
+        _index(Pnm.Connection(path))
+    except Exception:
+        # The connection may have been removed again before it was read
+        logger.debug(f"Could not index new connection {path}.")
+
+
+def _on_connection_removed(path):
+    _unindex(path)
+
+
+def _on_connection_updated(path=None):
+    if path is not None and str(path) in _by_path:
+        _on_new_connection(path)
+
+
+def _build():
+    global _live, _signals_unavailable
+
+    with _lock:
+        if _live or _signals_unavailable:
+            return
+
+        # Subscribe before reading the connections so none are missed
+        try:
+            nm_signals.subscribe(
+                _on_new_connection, "NewConnection", NM_SETTINGS
+            )
+            nm_signals.subscribe(
+                _on_connection_removed, "ConnectionRemoved", NM_SETTINGS
+            )
+            nm_signals.subscribe(
+                _on_connection_updated,
+                "Updated",
+                NM_SETTINGS_CONNECTION,
+                path_keyword="path",
+            )
+        except Exception:
+            logger.exception(
+                "NetworkManager signals unavailable. Connection lookups "
+                "will not be cached."
+            )
+            _signals_unavailable = True
+            return
+
+        _by_path.clear()
+        _by_id.clear()
+        _by_uuid.clear()
+        with metrics.dbus_call("ListConnections"):
+            saved = Pnm.Settings.ListConnections()
+        for connection in saved:
+            _index(connection)
+
+        _live = True
+        logger.debug(f"Indexed {len(_by_path)} saved connections.")
+
+
+def _sync():
+    _build()
+
+    if not _live:
+        # Fall back to reading every saved connection
+        with _lock:
+            _by_path.clear()
+            _by_id.clear()
+            _by_uuid.clear()
+            with metrics.dbus_call("ListConnections"):
+                saved = Pnm.Settings.ListConnections()
+            for connection in saved:
+                _index(connection)
+
+
+def add(connection, settings=None):
+    # Record a connection this app has just created without waiting for the
+    # NewConnection signal to arrive.
+    return _index(connection, settings)
+
+
+def remove(connection):
+    # Record a connection this app has just deleted
+    _unindex(connection.object_path)
+
+
+def get_all():
+    # Returns a list of {"connection": ..., "settings": ...}
+    _sync()
+    with _lock:
+        return list(_by_path.values())
+
+
+def get_by_id(connection_id):
+    # Returns {"connection": ..., "settings": ...} or None
+    _sync()
+    return _by_id.get(connection_id)
+
+
+def get_by_uuid(connection_uuid):
+    # Returns {"connection": ..., "settings": ...} or None
+    _sync()
+    return _by_uuid.get(connection_uuid)
@@ -0,0 +1,127 @@
+import config
+import socket
+import threading
+import time
+from common import metrics
+from common.errors import logger
+from common.nm import Pnm  # Python NetworkManager
+from concurrent.futures import as_completed
+from concurrent.futures import ThreadPoolExecutor
+
+# Most recent verdict on internet access, shared by every request.
+_status = {"internet": False, "checked_at": None, "latency": None}
+
+# Set to make the prober check again immediately.
+_wake = threading.Event()
+
+
+def probe(host, port, timeout=3):
+    # Returns the seconds taken to open a TCP connection, or None on failure.
+    # The timeout applies to this socket only.
+    started = time.monotonic()
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return time.monotonic() - started
+    except OSError:
+        return None
+
+
+def probe_targets(targets, timeout=3):
+    # Probes all targets at once and returns the latency of the first to
+    # answer, or None if none of them did.
+    if not targets:
+        return None
+
+    pool = ThreadPoolExecutor(max_workers=len(targets))
+    try:
+        futures = [
+            pool.submit(probe, host, port, timeout) for host, port in targets
+        ]
+        for future in as_completed(futures):
+            if future.result() is not None:
+                return future.result()
+    finally:
+        # Do not wait on slower targets once one has answered
+        pool.shutdown(wait=False)
+
+    return None
+
+
+def check_networkmanager():
+    # Returns NetworkManager's own verdict, or None if its connectivity
+    # checking is disabled.
+    with metrics.dbus_call("NetworkManager.Connectivity"):
+        state = Pnm.NetworkManager.Connectivity
+    if state == Pnm.NM_CONNECTIVITY_UNKNOWN:
+        return None
+
+    return state == Pnm.NM_CONNECTIVITY_FULL
+
+
+def check():
+    internet = None
+    latency = None
+    started = time.monotonic()
+
+    if config.internet_source_nm:
+        try:
+            internet = check_networkmanager()
+            latency = time.monotonic() - started
+        except Exception:
+            logger.exception("Failed reading NetworkManager connectivity.")
+
+    if internet is None:
+        latency = probe_targets(config.internet_targets)
+        internet = latency is not None
+
+    _status.update(
+        internet=internet,
+        checked_at=time.time(),
+        latency=None if latency is None else round(latency, 3),
+    )
+
+    return internet
+
+
+def get_status():
+    # Cached verdict with its age in seconds, checking first if there is none
+    if _status["checked_at"] is None:
+        check()
+
+    status = dict(_status)
+    status["age"] = round(time.time() - status["checked_at"], 3)
+
+    return status
+
+
+def refresh():
+    # Ask the prober to check again without waiting for the result
+    _wake.set()
+
+
+def _run():
+    interval = config.internet_interval
+    last = None
+
+    while True:
+        try:
+            internet = check()
+        except Exception:
+            logger.exception("Internet check failed.")
+            internet = None
+
+        # Check often while the result is changing, less so once it settles
+        if internet == last:
+            interval = min(interval * 2, config.internet_max_interval)
+        else:
+            interval = config.internet_interval
+        last = internet
+
+        # A refresh request restarts the back off
+        if _wake.wait(interval):
+            _wake.clear()
+            last = None
+
+
+def start():
+    threading.Thread(target=_run, name="connectivity", daemon=True).start()
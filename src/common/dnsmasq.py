@@ -0,0 +1,325 @@
+import config
+import ctypes
+import ctypes.util
+import ipaddress
+import os
+import struct
+import subprocess
+import threading
+import time
+from common import metrics
+from common import tracing
+from common.errors import logger
+
+# dnsmasq hands out addresses and answers DNS for devices joining the
+# hotspot. It is only run while the hotspot is up, and a supervisor thread
+# restarts it if it exits, waiting longer after each failure in a row.
+
+# Seconds to wait before restarting dnsmasq, doubled after each failure up to
+# the maximum. A run lasting STABLE_AFTER seconds resets the wait.
+RESTART_DELAY = 1
+MAX_RESTART_DELAY = 30
+STABLE_AFTER = 60
+
+# Seconds dnsmasq is given to exit before it is killed
+STOP_TIMEOUT = 5
+
+# inotify events that mean the lease file was written or replaced
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+EVENT_HEADER = struct.Struct("iIII")
+
+# Seconds between checks of the lease file where inotify is unavailable
+LEASE_POLL_INTERVAL = 2
+
+_state = {
+    "wanted": False,
+    "interface": None,
+    "process": None,
+    "started_at": None,
+    "restart_delay": RESTART_DELAY,
+    "restarts": 0,
+}
+_lock = threading.Lock()
+_wake = threading.Event()
+_supervisor = None
+
+# Current leases by MAC address, updated when the lease file changes
+_leases = {"clients": {}, "updated_at": None, "signature": None}
+_leases_lock = threading.Lock()
+_watcher = None
+
+
+def _args(interface):
+    return [
+        "/usr/sbin/dnsmasq",
+        f"--address=/#/{config.DEFAULT_GATEWAY}",
+        f"--dhcp-range={config.DEFAULT_DHCP_RANGE}",
+        f"--dhcp-option=option:router,{config.DEFAULT_GATEWAY}",
+        f"--dhcp-leasefile={config.dnsmasq_lease_file}",
+        f"--interface={interface}",
+        "--keep-in-foreground",
+        "--bind-dynamic",
+        "--except-interface=lo",
+        "--conf-file",
+        "--no-hosts",
+    ]
+
+
+def start(interface):
+    # Runs dnsmasq on the interface from now on. Safe to call while it is
+    # already running there.
+    global _supervisor
+
+    with _lock:
+        if _state["wanted"] and _state["interface"] == interface:
+            return
+
+        _state.update(wanted=True, interface=interface)
+        _state["restart_delay"] = RESTART_DELAY
+
+        if _supervisor is None:
+            _supervisor = threading.Thread(
+                target=_supervise, name="dnsmasq", daemon=True
+            )
+            _supervisor.start()
+
+    _watch_leases()
+    _wake.set()
+
+
+def stop():
+    with _lock:
+        if not _state["wanted"]:
+            return
+        _state["wanted"] = False
+
+    _wake.set()
+
+
+def rebind(interface):
+    # Moves dnsmasq to another interface if it is running
+    with _lock:
+        wanted = _state["wanted"]
+
+    if wanted:
+        start(interface)
+
+
+def is_wanted():
+    # Returns whether dnsmasq should be running, which is while the hotspot
+    # is up.
+    with _lock:
+        return _state["wanted"]
+
+
+def is_running():
+    with _lock:
+        process = _state["process"]
+        return process is not None and process.poll() is None
+
+
+def _terminate(process):
+    process.terminate()
+    try:
+        process.wait(STOP_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def _supervise():
+    while True:
+        _wake.wait(1)
+        _wake.clear()
+
+        with _lock:
+            process = _state["process"]
+            wanted = _state["wanted"]
+            interface = _state["interface"]
+
+        running = process is not None and process.poll() is None
+
+        # Stop dnsmasq when the hotspot is down or has moved interface
+        if running and (not wanted or process.args != _args(interface)):
+            logger.info("Stopping dnsmasq.")
+            _terminate(process)
+            with _lock:
+                _state["process"] = None
+            process = None
+            running = False
+
+        if running or not wanted:
+            continue
+
+        if process is not None:
+            logger.warning(f"dnsmasq exited with code {process.returncode}.")
+
+            with _lock:
+                if time.monotonic() - _state["started_at"] >= STABLE_AFTER:
+                    _state["restart_delay"] = RESTART_DELAY
+                delay = _state["restart_delay"]
+                _state["restart_delay"] = min(delay * 2, MAX_RESTART_DELAY)
+                _state["process"] = None
+
+            # Wait before restarting, unless told to stop or move meanwhile
+            logger.info(f"Restarting dnsmasq in {delay} seconds.")
+            if _wake.wait(delay):
+                continue
+
+            metrics.inc("pwc_dnsmasq_restarts_total")
+            with _lock:
+                _state["restarts"] += 1
+
+        logger.info(f"Starting dnsmasq on {interface}.")
+        try:
+            with tracing.span("dnsmasq", "subprocess", interface=interface):
+                process = subprocess.Popen(_args(interface))
+        except Exception:
+            logger.exception("Failed to start dnsmasq.")
+            with _lock:
+                delay = _state["restart_delay"]
+                _state["restart_delay"] = min(delay * 2, MAX_RESTART_DELAY)
+            _wake.wait(delay)
+            continue
+
+        with _lock:
+            _state.update(process=process, started_at=time.monotonic())
+
+
+def _read_leases():
+    # Reads the lease file if it changed since it was last read. dnsmasq
+    # rewrites the whole file on every change rather than appending, so
+    # there is no tail to follow.
+    try:
+        status = os.stat(config.dnsmasq_lease_file)
+        signature = (status.st_ino, status.st_size, status.st_mtime_ns)
+    except FileNotFoundError:
+        signature = None
+
+    with _leases_lock:
+        if signature == _leases["signature"]:
+            return
+
+    clients = {}
+    if signature is not None:
+        try:
+            with open(config.dnsmasq_lease_file) as f:
+                for line in f:
+                    # expiry mac ip hostname client-id, with * when unknown
+                    fields = line.split()
+                    if len(fields) < 4 or fields[0] == "duid":
+                        continue
+                    clients[fields[1]] = {
+                        "mac": fields[1],
+                        "ip": fields[2],
+                        "hostname": None if fields[3] == "*" else fields[3],
+                        "expires": int(fields[0]) or None,
+                    }
+        except (OSError, ValueError):
+            logger.exception("Failed reading dnsmasq leases.")
+            return
+
+    with _leases_lock:
+        _leases.update(
+            clients=clients, updated_at=time.time(), signature=signature
+        )
+
+
+def _inotify():
+    # Returns an inotify file descriptor watching the lease file's folder,
+    # or None where inotify is not available.
+    path = ctypes.util.find_library("c")
+    if path is None:
+        return None
+
+    try:
+        libc = ctypes.CDLL(path, use_errno=True)
+        fd = libc.inotify_init()
+    except (AttributeError, OSError):
+        return None
+    if fd < 0:
+        return None
+
+    # The folder is watched as dnsmasq may replace the file
+    folder = os.path.dirname(config.dnsmasq_lease_file) or "."
+    mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    if libc.inotify_add_watch(fd, folder.encode(), mask) < 0:
+        os.close(fd)
+        return None
+
+    return fd
+
+
+def _watch():
+    name = os.path.basename(config.dnsmasq_lease_file)
+    fd = _inotify()
+    if fd is None:
+        logger.info("inotify unavailable. Polling the dnsmasq lease file.")
+
+    _read_leases()
+    while True:
+        if fd is None:
+            time.sleep(LEASE_POLL_INTERVAL)
+            _read_leases()
+            continue
+
+        data = os.read(fd, 4096)
+        offset = 0
+        changed = False
+        while offset < len(data):
+            _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            event_name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            changed = changed or event_name.decode() == name
+
+        if changed:
+            _read_leases()
+
+
+def _watch_leases():
+    global _watcher
+
+    with _leases_lock:
+        if _watcher is not None:
+            return
+        _watcher = threading.Thread(
+            target=_watch, name="dnsmasq-leases", daemon=True
+        )
+
+    try:
+        os.makedirs(
+            os.path.dirname(config.dnsmasq_lease_file) or ".", exist_ok=True
+        )
+    except OSError:
+        pass
+    _watcher.start()
+
+
+def clients():
+    # Devices holding an address from the hotspot, from memory
+    now = time.time()
+    with _leases_lock:
+        current = [
+            client
+            for client in _leases["clients"].values()
+            if client["expires"] is None or client["expires"] > now
+        ]
+        updated_at = _leases["updated_at"]
+
+    with _lock:
+        interface = _state["interface"] if _state["wanted"] else None
+        restarts = _state["restarts"]
+
+    return {
+        "running": is_running(),
+        "interface": interface,
+        "restarts": restarts,
+        "clients": sorted(
+            current, key=lambda client: ipaddress.ip_address(client["ip"])
+        ),
+        "updated_at": updated_at,
+    }
@@ -26,6 +26,18 @@ logger.propagate = False
 
 
 # Error classes for Flask-Restful
+class JobNotCancellable(Exception):
+    pass
+
+
+class JobNotFound(Exception):
+    pass
+
+
+class SettingsNotSaved(Exception):
+    pass
+
+
 class WifiConnectionFailed(Exception):
     pass
 
@@ -48,6 +60,18 @@ class WifiNetworkManagerError(Exception):
 
 # Custom error messages for Flask-RESTful to return
 errors = {
+    "JobNotCancellable": {
+        "message": "Only queued jobs can be cancelled.",
+        "status": 409,
+    },
+    "JobNotFound": {
+        "message": "Job not found.",
+        "status": 404,
+    },
+    "SettingsNotSaved": {
+        "message": "Failed saving settings.",
+        "status": 500,
+    },
     "WifiConnectionFailed": {
         "message": "System error while establishing Wi-Fi connection.",
         "status": 500,
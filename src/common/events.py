@@ -0,0 +1,108 @@
+import asyncio
+import config
+import itertools
+import json
+from common import async_http
+from common.errors import logger
+
+# Server-Sent Events are served by an asyncio server in its own thread rather
+# than by waitress, whose fixed pool would need a thread per idle client.
+# Each client only costs a coroutine and a bounded queue.
+
+# Seconds between keepalive comments sent to idle clients
+KEEPALIVE_INTERVAL = 15
+
+# Events buffered per client. Clients that fall this far behind are dropped.
+CLIENT_QUEUE_SIZE = 100
+
+RESPONSE_HEADERS = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Content-Type: text/event-stream\r\n"
+    b"Cache-Control: no-cache\r\n"
+    b"Connection: keep-alive\r\n"
+    b"Access-Control-Allow-Origin: *\r\n"
+    b"\r\n"
+    b"retry: 3000\n\n"
+)
+NOT_FOUND = (
+    b"HTTP/1.1 404 Not Found\r\n"
+    b"Content-Length: 0\r\n"
+    b"Connection: close\r\n"
+    b"\r\n"
+)
+
+_loop = None
+_clients = set()
+_ids = itertools.count(1)
+
+
+def publish(event, data):
+    # Sends an event to every connected client. Safe to call from any thread,
+    # and does nothing until the server has started.
+    loop = _loop
+    if loop is None:
+        return
+
+    message = (
+        f"id: {next(_ids)}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+    ).encode()
+    loop.call_soon_threadsafe(_broadcast, message)
+
+
+def client_count():
+    return len(_clients)
+
+
+def _broadcast(message):
+    for queue in list(_clients):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            logger.debug("Dropping an event stream client that fell behind.")
+            _clients.discard(queue)
+
+
+async def _handle(reader, writer):
+    queue = asyncio.Queue(CLIENT_QUEUE_SIZE)
+
+    try:
+        method, path = await async_http.read_request(reader)
+        if method != "GET" or path != "/v1/events":
+            writer.write(NOT_FOUND)
+            await writer.drain()
+            return
+
+        _clients.add(queue)
+        writer.write(RESPONSE_HEADERS)
+        await writer.drain()
+
+        while queue in _clients or not queue.empty():
+            try:
+                message = await asyncio.wait_for(
+                    queue.get(), KEEPALIVE_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                message = b": keepalive\n\n"
+
+            writer.write(message)
+            await writer.drain()
+    except (asyncio.TimeoutError, OSError):
+        pass
+    finally:
+        _clients.discard(queue)
+        writer.close()
+
+
+def start():
+    global _loop
+
+    loop = async_http.start_loop("events")
+    try:
+        async_http.serve(loop, _handle, config.host, config.events_port)
+    except Exception:
+        logger.exception("Failed to start the event stream.")
+        loop.call_soon_threadsafe(loop.stop)
+        return
+
+    _loop = loop
+    logger.info(f"Streaming events on port {config.events_port}")
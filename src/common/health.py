@@ -0,0 +1,151 @@
+import config
+import threading
+import time
+from common import dnsmasq
+from common import metrics
+from common import readiness
+from common import scanner
+from common.errors import logger
+from common.nm import Pnm  # Python NetworkManager
+from common.wifi import get_device
+
+# The health of each part of the app is checked in the background and kept
+# as a snapshot, so the health check endpoint is a memory read however often
+# it is called and never waits on D-Bus.
+
+OK = "ok"
+DEGRADED = "degraded"
+ERROR = "error"
+STARTING = "starting"
+
+_snapshot = {
+    "status": STARTING,
+    "message": STARTING,
+    "checked_at": None,
+    "checks": {},
+}
+_wake = threading.Event()
+_started = False
+_lock = threading.Lock()
+
+
+def _timed(check):
+    # Runs a check, adding how long it took and turning failures into an
+    # error result.
+    started = time.perf_counter()
+    try:
+        result = check()
+    except Exception as e:
+        result = {"ok": False, "error": type(e).__name__}
+
+    result["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    return result
+
+
+def _check_startup():
+    state = readiness.get_state()
+    result = {"ok": state != readiness.FAILED, "state": state}
+    if not result["ok"]:
+        result["error"] = readiness.get_status()["error"]
+
+    return result
+
+
+def _check_networkmanager():
+    with metrics.dbus_call("NetworkManager.Version"):
+        version = Pnm.NetworkManager.Version
+
+    return {"ok": True, "version": str(version)}
+
+
+def _check_device():
+    get_device()
+
+    return {"ok": True, "interface": config.interface}
+
+
+def _check_dnsmasq():
+    # dnsmasq is only needed while the hotspot is up
+    needed = dnsmasq.is_wanted()
+    running = dnsmasq.is_running()
+
+    return {"ok": running or not needed, "needed": needed, "running": running}
+
+
+def _check_scan():
+    age = scanner.cache_age()
+
+    return {
+        "ok": True,
+        "age": None if age is None else round(age, 1),
+    }
+
+
+def check():
+    # Runs every check now and replaces the snapshot
+    global _snapshot
+
+    checks = {
+        "startup": _timed(_check_startup),
+        "networkmanager": _timed(_check_networkmanager),
+        "device": _timed(_check_device),
+        "dnsmasq": _timed(_check_dnsmasq),
+        "scan": _timed(_check_scan),
+    }
+
+    # The app cannot do anything without NetworkManager or once startup has
+    # failed. Without a device or dnsmasq it keeps running and can recover.
+    failing = [name for name, result in checks.items() if not result["ok"]]
+    if not checks["networkmanager"]["ok"] or not checks["startup"]["ok"]:
+        status = ERROR
+    elif failing:
+        status = DEGRADED
+    else:
+        status = OK
+
+    if failing:
+        message = f"Failing checks: {', '.join(failing)}."
+    else:
+        message = OK
+
+    if status != _snapshot["status"] and _snapshot["checked_at"]:
+        logger.info(f"Health changed from {_snapshot['status']} to {status}.")
+
+    _snapshot = {
+        "status": status,
+        "message": message,
+        "checked_at": time.time(),
+        "checks": checks,
+    }
+
+
+def get_status():
+    snapshot = dict(_snapshot)
+    if snapshot["checked_at"] is not None:
+        snapshot["age"] = round(time.time() - snapshot["checked_at"], 3)
+    else:
+        snapshot["age"] = None
+
+    return snapshot
+
+
+def _run():
+    while True:
+        try:
+            check()
+        except Exception:
+            logger.exception("Health check failed.")
+
+        _wake.wait(config.health_interval)
+        _wake.clear()
+
+
+def start():
+    global _started
+
+    with _lock:
+        if _started:
+            return
+        _started = True
+
+    threading.Thread(target=_run, name="health", daemon=True).start()
@@ -0,0 +1,207 @@
+import threading
+import time
+import uuid
+from collections import deque
+from common import tracing
+from common.errors import JobNotCancellable
+from common.errors import JobNotFound
+from common.errors import logger
+
+# Every change to NetworkManager requested through the API runs as a job on a
+# single worker, one at a time and in the order submitted.
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+# Finished jobs kept for the status endpoint
+HISTORY_SIZE = 50
+
+_jobs = {}
+_pending = deque()
+_finished = deque()
+_condition = threading.Condition()
+_worker = None
+_running = None
+
+
+def _status(job):
+    # The public view of a job. Arguments are left out as they may include
+    # passwords.
+    started = job["started_at"]
+    finished = job["finished_at"]
+
+    duration = None
+    if started and finished:
+        duration = round(finished - started, 3)
+
+    return {
+        "id": job["id"],
+        "kind": job["kind"],
+        "state": job["state"],
+        "submitted_at": job["submitted_at"],
+        "started_at": started,
+        "finished_at": finished,
+        "wait": round(
+            (started or finished or time.time()) - job["submitted_at"], 3
+        ),
+        "duration": duration,
+        "merged": job["merged"],
+        "superseded_by": job["superseded_by"],
+        "result": job["result"],
+        "error": job["error"],
+    }
+
+
+def _finish(job, state):
+    job["state"] = state
+    job["finished_at"] = time.time()
+
+    _finished.append(job["id"])
+    while len(_finished) > HISTORY_SIZE:
+        _jobs.pop(_finished.popleft(), None)
+
+
+def _yield_to(kind, new_id):
+    # Cancels queued jobs that give way to a job of another kind
+    for job_id in list(_pending):
+        job = _jobs[job_id]
+        if job["yields"] and job["kind"] != kind:
+            _pending.remove(job_id)
+            _finish(job, CANCELLED)
+            job["superseded_by"] = new_id
+            logger.info(f"Job {job_id} superseded by {new_id}.")
+
+
+def submit(kind, target, kwargs, supersede=False, delay=0, yields=False):
+    # Queues target(**kwargs) and returns the job's status. A request
+    # identical to one still queued is merged into it. With supersede, a
+    # queued job of the same kind with different arguments is cancelled in
+    # favour of the new one. The job does not start until delay seconds
+    # after it was submitted. With yields, the job is cancelled if a job of
+    # another kind is submitted before it starts, so automatic recovery
+    # never holds up or undoes a user's request.
+    global _worker
+
+    with _condition:
+        new_id = uuid.uuid4().hex
+
+        for job_id in list(_pending):
+            job = _jobs[job_id]
+            if job["kind"] != kind:
+                continue
+
+            if job["kwargs"] == kwargs:
+                job["merged"] += 1
+                logger.debug(f"Merged {kind} request into job {job_id}.")
+                _yield_to(kind, job_id)
+                return _status(job)
+
+            if not supersede:
+                continue
+
+            _pending.remove(job_id)
+            _finish(job, CANCELLED)
+            job["superseded_by"] = new_id
+            logger.info(f"Job {job_id} superseded by {new_id}.")
+            break
+
+        job = _jobs[new_id] = {
+            "id": new_id,
+            "kind": kind,
+            "target": target,
+            "kwargs": kwargs,
+            "state": QUEUED,
+            "submitted_at": time.time(),
+            "not_before": time.time() + delay,
+            "yields": yields,
+            "started_at": None,
+            "finished_at": None,
+            "merged": 0,
+            "superseded_by": None,
+            "result": None,
+            "error": None,
+        }
+        _yield_to(kind, new_id)
+        _pending.append(new_id)
+
+        if _worker is None:
+            _worker = threading.Thread(target=_run, name="jobs", daemon=True)
+            _worker.start()
+
+        _condition.notify()
+
+        return _status(job)
+
+
+def get(job_id):
+    with _condition:
+        if job_id not in _jobs:
+            raise JobNotFound
+
+        return _status(_jobs[job_id])
+
+
+def busy():
+    # Returns whether a job is running or waiting to run
+    with _condition:
+        return _running is not None or bool(_pending)
+
+
+def cancel(job_id):
+    # Cancels a job that has not started yet
+    with _condition:
+        if job_id not in _jobs:
+            raise JobNotFound
+
+        job = _jobs[job_id]
+        if job["state"] != QUEUED:
+            raise JobNotCancellable
+
+        _pending.remove(job_id)
+        _finish(job, CANCELLED)
+        logger.info(f"Job {job_id} cancelled.")
+
+        return _status(job)
+
+
+def _run():
+    global _running
+
+    while True:
+        with _condition:
+            while True:
+                if not _pending:
+                    _condition.wait()
+                    continue
+
+                delay = _jobs[_pending[0]]["not_before"] - time.time()
+                if delay <= 0:
+                    break
+                _condition.wait(delay)
+
+            job = _running = _jobs[_pending.popleft()]
+            job["state"] = RUNNING
+            job["started_at"] = time.time()
+
+        logger.debug(f"Running {job['kind']} job {job['id']}.")
+        try:
+            with tracing.span(f"job {job['kind']}", "job", id=job["id"]):
+                result = job["target"](**job["kwargs"])
+            # Targets such as connect return False when they did not manage
+            # what was asked, without raising.
+            state = FAILED if result is False else SUCCEEDED
+        except Exception as e:
+            logger.exception(f"Job {job['id']} failed.")
+            job["error"] = type(e).__name__
+            state = FAILED
+        else:
+            # Only keep results that can be returned as JSON
+            if isinstance(result, (bool, dict, int, str)):
+                job["result"] = result
+
+        with _condition:
+            _finish(job, state)
+            _running = None
@@ -0,0 +1,127 @@
+import json
+import threading
+import time
+from common import settings
+from common.errors import logger
+
+# Networks the device has connected to before and how reliably that has
+# worked. Kept in the db folder so it survives restarts. Each network has a
+# saved connection of its own in NetworkManager, which keeps its password, and
+# is recorded here by its uuid.
+PATH = "db/known_networks.json"
+
+_networks = None
+_lock = threading.Lock()
+
+
+def _load():
+    global _networks
+
+    if _networks is None:
+        try:
+            with open(PATH) as f:
+                _networks = json.load(f)
+        except FileNotFoundError:
+            _networks = {}
+        except (OSError, ValueError):
+            logger.exception("Failed reading known networks. Starting afresh.")
+            _networks = {}
+
+        # Earlier versions stored passwords here
+        removed = [
+            network.pop("password", None) for network in _networks.values()
+        ]
+        if any(password is not None for password in removed):
+            _save()
+
+    return _networks
+
+
+def _save():
+    # Written atomically so a power cut cannot leave the list half written
+    try:
+        settings.write_json(PATH, _networks)
+    except OSError:
+        logger.exception("Failed saving known networks.")
+
+
+def record_success(ssid, conn_type, username=None, uuid=None):
+    with _lock:
+        network = _load().setdefault(ssid, {"successes": 0, "failures": 0})
+        network.update(
+            conn_type=conn_type,
+            username=username,
+            uuid=uuid,
+            last_connected=time.time(),
+            successes=network["successes"] + 1,
+        )
+        _save()
+
+
+def record_failure(ssid):
+    # Only networks already known are recorded, so a mistyped password does
+    # not add a network.
+    with _lock:
+        network = _load().get(ssid)
+        if network is not None:
+            network["failures"] += 1
+            _save()
+
+
+def get(ssid):
+    # Returns a known network, or None
+    with _lock:
+        network = _load().get(ssid)
+        return None if network is None else dict(network, ssid=ssid)
+
+
+def most_recent():
+    # Returns the network connected to most recently, or None
+    with _lock:
+        networks = _load()
+        if not networks:
+            return None
+
+        ssid = max(networks, key=lambda ssid: networks[ssid]["last_connected"])
+        return dict(networks[ssid], ssid=ssid)
+
+
+def remove(ssid=None):
+    # Removes one network, or every network when no SSID is given
+    with _lock:
+        networks = _load()
+        if ssid is None:
+            networks.clear()
+        elif networks.pop(ssid, None) is None:
+            return
+        _save()
+
+
+def candidates(access_points):
+    # Returns the known networks among the access points, best first, using
+    # the security each access point advertises now. Signal strength is
+    # weighted by how often connecting has worked, counting one success and
+    # one failure up front so new networks are not written off.
+    ranked = []
+
+    with _lock:
+        networks = _load()
+        for ap in access_points:
+            network = networks.get(ap["ssid"])
+            if network is None:
+                continue
+
+            success_rate = (network["successes"] + 1) / (
+                network["successes"] + network["failures"] + 2
+            )
+            ranked.append(
+                (
+                    ap["strength"] * success_rate,
+                    network["last_connected"],
+                    dict(network, ssid=ap["ssid"], conn_type=ap["conn_type"]),
+                )
+            )
+
+    ranked.sort(key=lambda candidate: candidate[:2], reverse=True)
+
+    return [network for _, _, network in ranked]
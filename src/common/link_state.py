@@ -0,0 +1,127 @@
+import threading
+from common import connectivity
+from common import events
+from common import metrics
+from common import nm_signals
+from common.errors import logger
+from common.nm import Pnm  # Python NetworkManager
+
+# State of the watched Wi-Fi device, kept current by NetworkManager signals so
+# checking the link is a memory read.
+_device = {"path": None, "state": None, "mode": None}
+_matches = []
+_lock = threading.Lock()
+
+# Called with the reason when the device stops being connected to a router
+_link_lost_callbacks = []
+
+# Set if signals cannot be received, in which case callers fall back to iw.
+_unavailable = False
+
+
+def _on_properties_changed(interface, changed, invalidated):
+    if interface == nm_signals.NM_DEVICE and "State" in changed:
+        _device["state"] = int(changed["State"])
+    elif interface == nm_signals.NM_DEVICE_WIRELESS and "Mode" in changed:
+        _device["mode"] = int(changed["Mode"])
+
+
+def _on_state_changed(new_state, old_state, reason):
+    was_connected = is_connected()
+    _device["state"] = int(new_state)
+
+    connected = is_connected()
+
+    # The internet check may have backed off, so check again straight away
+    if connected != was_connected:
+        connectivity.refresh()
+
+    if was_connected and not connected:
+        for callback in _link_lost_callbacks:
+            try:
+                callback(int(reason))
+            except Exception:
+                logger.exception("Failed handling loss of the Wi-Fi link.")
+
+    events.publish(
+        "device_state",
+        {
+            "state": int(new_state),
+            "old_state": int(old_state),
+            "reason": int(reason),
+        },
+    )
+
+
+def is_connected():
+    # Returns whether the device is connected to a router as a client, or
+    # None if the device is not being watched.
+    if _device["path"] is None:
+        return None
+
+    return (
+        _device["state"] == Pnm.NM_DEVICE_STATE_ACTIVATED
+        and _device["mode"] == Pnm.NM_802_11_MODE_INFRA
+    )
+
+
+def is_available():
+    return not _unavailable
+
+
+def on_link_lost(callback):
+    # Startup registers again if it is retried
+    if callback not in _link_lost_callbacks:
+        _link_lost_callbacks.append(callback)
+
+
+def reset():
+    # Stop watching, for example when the interface is changed
+    with _lock:
+        for match in _matches:
+            match.remove()
+        _matches.clear()
+        _device.update(path=None, state=None, mode=None)
+
+
+def watch(device):
+    global _unavailable
+
+    path = str(device.object_path)
+    if _device["path"] == path or _unavailable:
+        return
+
+    reset()
+
+    with _lock:
+        # Subscribe before reading the properties so no change is missed
+        try:
+            _matches.append(
+                nm_signals.subscribe(
+                    _on_properties_changed,
+                    "PropertiesChanged",
+                    nm_signals.DBUS_PROPERTIES,
+                    path,
+                )
+            )
+            _matches.append(
+                nm_signals.subscribe(
+                    _on_state_changed,
+                    "StateChanged",
+                    nm_signals.NM_DEVICE,
+                    path,
+                )
+            )
+        except Exception:
+            logger.exception(
+                "NetworkManager signals unavailable. Using iw to check the "
+                "Wi-Fi link."
+            )
+            _unavailable = True
+            return
+
+        with metrics.dbus_call("Device.Get"):
+            _device.update(
+                path=path, state=int(device.State), mode=int(device.Mode)
+            )
+        logger.debug(f"Watching Wi-Fi link state of {path}.")
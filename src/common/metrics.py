@@ -0,0 +1,209 @@
+import threading
+import time
+from bisect import bisect_left
+from common import tracing
+from contextlib import contextmanager
+from flask import g
+from flask import request
+
+# Upper bounds, in seconds, of the histogram buckets
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+)
+
+_metrics = {}
+_lock = threading.Lock()
+
+
+def _define(name, kind, description, buckets=DEFAULT_BUCKETS):
+    _metrics[name] = {
+        "type": kind,
+        "help": description,
+        "buckets": buckets,
+        "series": {},
+    }
+
+
+_define(
+    "pwc_dbus_call_duration_seconds",
+    "histogram",
+    "NetworkManager D-Bus calls, by method.",
+)
+_define(
+    "pwc_scan_duration_seconds",
+    "histogram",
+    "Access point scans, by method and result.",
+)
+_define(
+    "pwc_scan_retries_total",
+    "counter",
+    "iw scans retried because the device was busy.",
+)
+_define(
+    "pwc_connect_phase_duration_seconds",
+    "histogram",
+    "Phases of connection attempts, by connection type and phase.",
+)
+_define(
+    "pwc_connect_total",
+    "counter",
+    "Connection attempts, by connection type, result and reason.",
+)
+_define(
+    "pwc_hotspot_starts_total",
+    "counter",
+    "Times the hotspot was started or restarted.",
+)
+_define(
+    "pwc_dnsmasq_restarts_total",
+    "counter",
+    "Times dnsmasq was restarted after exiting.",
+)
+_define(
+    "pwc_portal_requests_total",
+    "counter",
+    "Requests answered by the captive portal responder, by probe.",
+)
+_define(
+    "pwc_portal_response_duration_seconds",
+    "histogram",
+    "Time to answer captive portal requests, by probe.",
+)
+_define(
+    "pwc_http_request_duration_seconds",
+    "histogram",
+    "HTTP requests, by route, method and status.",
+)
+
+
+def inc(name, amount=1, **labels):
+    key = tuple(sorted(labels.items()))
+    series = _metrics[name]["series"]
+
+    with _lock:
+        series[key] = series.get(key, 0) + amount
+
+
+def observe(name, value, **labels):
+    metric = _metrics[name]
+    key = tuple(sorted(labels.items()))
+    bucket = bisect_left(metric["buckets"], value)
+
+    with _lock:
+        data = metric["series"].get(key)
+        if data is None:
+            data = metric["series"][key] = {
+                "buckets": [0] * (len(metric["buckets"]) + 1),
+                "sum": 0.0,
+                "count": 0,
+            }
+        data["buckets"][bucket] += 1
+        data["sum"] += value
+        data["count"] += 1
+
+
+@contextmanager
+def timer(name, **labels):
+    # Observes how long the block takes, including when it raises
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def dbus_call(method):
+    # Times a NetworkManager D-Bus call, and traces it when tracing is on
+    if tracing.enabled():
+        return _traced_dbus_call(method)
+
+    return timer("pwc_dbus_call_duration_seconds", method=method)
+
+
+@contextmanager
+def _traced_dbus_call(method):
+    with tracing.span(method, "dbus"):
+        with timer("pwc_dbus_call_duration_seconds", method=method):
+            yield
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+
+    escaped = [
+        '{}="{}"'.format(
+            name,
+            str(value)
+            .replace("\\", "\\\\")
+            .replace('"', '\\"')
+            .replace("\n", "\\n"),
+        )
+        for name, value in labels
+    ]
+
+    return "{" + ",".join(escaped) + "}"
+
+
+def render():
+    # Returns all metrics in the Prometheus text exposition format
+    lines = []
+
+    with _lock:
+        for name, metric in _metrics.items():
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+
+            for labels, data in metric["series"].items():
+                if metric["type"] == "counter":
+                    lines.append(f"{name}{_format_labels(labels)} {data}")
+                    continue
+
+                cumulative = 0
+                bounds = [str(b) for b in metric["buckets"]] + ["+Inf"]
+                for bound, count in zip(bounds, data["buckets"]):
+                    cumulative += count
+                    bucket_labels = _format_labels(labels + (("le", bound),))
+                    lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                lines.append(
+                    f"{name}_sum{_format_labels(labels)} {data['sum']}"
+                )
+                lines.append(
+                    f"{name}_count{_format_labels(labels)} {data['count']}"
+                )
+
+    return "\n".join(lines) + "\n"
+
+
+def instrument(app):
+    # Records the latency of every request handled by the Flask app
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        if "metrics_started" in g:
+            observe(
+                "pwc_http_request_duration_seconds",
+                time.perf_counter() - g.metrics_started,
+                route=request.url_rule.rule if request.url_rule else "none",
+                method=request.method,
+                status=response.status_code,
+            )
+
+        return response
@@ -0,0 +1,50 @@
+import dbus.mainloop.glib
+import functools
+import importlib
+import threading
+
+# python-networkmanager connects to the system bus as soon as it is imported.
+# Modules use Pnm from here instead, which only imports it the first time an
+# attribute is used, so the app can be built without NetworkManager running.
+
+# Once loaded, the default D-Bus main loop is set, which python-networkmanager
+# needs to follow NetworkManager restarts. The loop itself is run by
+# nm_signals. It is set after the import, as the private connection the import
+# uses would otherwise end the process when it is closed.
+
+
+class _LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    module = importlib.import_module(self._name)
+                    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+                    self._module = module
+
+        return self._module
+
+    def loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, attribute):
+        return getattr(self.load(), attribute)
+
+
+Pnm = _LazyModule("NetworkManager")
+
+
+@functools.lru_cache(maxsize=None)
+def names(prefix):
+    # Returns the names of the NetworkManager constants starting with prefix,
+    # by value and without the prefix, for example to report state reasons.
+    return {
+        value: name[len(prefix) :]
+        for name, value in vars(Pnm.load()).items()
+        if name.startswith(prefix)
+    }
@@ -4,7 +4,26 @@ from common.errors import logger
 from common.errors import WifiInvalidConnectionType
 
 
-def get_nm_dict(conn_type, ssid, username, password):
+def get_nm_dict(conn_type, ssid, username, password, bssid=None):
+    nm_dict = _get_nm_dict(conn_type, ssid, username, password)
+
+    # Lock a client connection to one access point of the network
+    if bssid and conn_type != config.type_hotspot:
+        nm_dict["802-11-wireless"]["bssid"] = bssid
+
+    # Keep a client connection off the radio reserved for the hotspot
+    if config.hotspot_interface and conn_type != config.type_hotspot:
+        nm_dict["connection"]["interface-name"] = config.interface
+
+    return nm_dict
+
+
+def client_id(ssid):
+    # Each network has a saved connection of its own, named after it
+    return f"{config.ap_name} {ssid}"
+
+
+def _get_nm_dict(conn_type, ssid, username, password):
     if conn_type == config.type_hotspot:
         # Hotspot for user to connect to device
         hs_dict = {
@@ -15,8 +34,8 @@ def get_nm_dict(conn_type, ssid, username, password):
             },
             "connection": {
                 "autoconnect": False,
-                "id": config.ap_name,
-                "interface-name": config.interface,
+                "id": config.hotspot_name,
+                "interface-name": config.hotspot_interface or config.interface,
                 "type": "802-11-wireless",
                 "uuid": str(uuid.uuid4()),
             },
@@ -45,7 +64,7 @@ def get_nm_dict(conn_type, ssid, username, password):
         return {
             "802-11-wireless": {"mode": "infrastructure", "ssid": ssid},
             "connection": {
-                "id": config.ap_name,
+                "id": client_id(ssid),
                 "type": "802-11-wireless",
                 "uuid": str(uuid.uuid4()),
             },
@@ -69,7 +88,7 @@ def get_nm_dict(conn_type, ssid, username, password):
                 "psk": password,
             },
             "connection": {
-                "id": config.ap_name,
+                "id": client_id(ssid),
                 "type": "802-11-wireless",
                 "uuid": str(uuid.uuid4()),
             },
@@ -95,7 +114,7 @@ def get_nm_dict(conn_type, ssid, username, password):
                 "phase2-auth": "mschapv2",
             },
             "connection": {
-                "id": config.ap_name,
+                "id": client_id(ssid),
                 "type": "802-11-wireless",
                 "uuid": str(uuid.uuid4()),
             },
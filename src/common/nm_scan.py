@@ -0,0 +1,109 @@
+import dbus
+import threading
+import time
+from common import metrics
+from common import nm_signals
+from common.errors import logger
+
+# Scans are requested from NetworkManager, which reports when it has results
+# by moving the device's LastScan on. Waiting for that rather than a fixed
+# time means a scan takes as long as the radio needs and no more.
+
+# Seconds between reads of LastScan where signals are unavailable
+POLL_INTERVAL = 0.2
+
+
+class ScanUnavailable(Exception):
+    # NetworkManager cannot scan on this device right now, for example while
+    # it is the hotspot, or is too old to report when a scan finished.
+    pass
+
+
+def _get_object(path):
+    return dbus.SystemBus().get_object(nm_signals.NM_SERVICE, path)
+
+
+def _last_scan(device):
+    with metrics.dbus_call("Device.LastScan"):
+        return int(
+            device.Get(
+                nm_signals.NM_DEVICE_WIRELESS,
+                "LastScan",
+                dbus_interface=nm_signals.DBUS_PROPERTIES,
+            )
+        )
+
+
+def scan(device_path, ssids=None, timeout=15):
+    # Asks NetworkManager to scan, probing for the given SSIDs so hidden
+    # networks answer, and waits until the results are in. Returns whether
+    # that happened within the timeout, and raises ScanUnavailable if
+    # NetworkManager cannot scan.
+    device = _get_object(str(device_path))
+
+    try:
+        before = _last_scan(device)
+    except dbus.exceptions.DBusException:
+        raise ScanUnavailable("LastScan not supported.")
+
+    finished = threading.Event()
+
+    def on_properties_changed(interface, changed, invalidated):
+        if int(changed.get("LastScan", before)) != before:
+            finished.set()
+
+    # Subscribe before requesting so the end of the scan cannot be missed
+    try:
+        match = nm_signals.subscribe(
+            on_properties_changed,
+            "PropertiesChanged",
+            nm_signals.DBUS_PROPERTIES,
+            str(device_path),
+            arg0=nm_signals.NM_DEVICE_WIRELESS,
+        )
+    except Exception:
+        match = None
+
+    try:
+        options = dbus.Dictionary({}, signature="sv")
+        if ssids:
+            options["ssids"] = dbus.Array(
+                [dbus.ByteArray(ssid.encode()) for ssid in ssids],
+                signature="ay",
+            )
+
+        try:
+            with metrics.dbus_call("RequestScan"):
+                device.RequestScan(
+                    options, dbus_interface=nm_signals.NM_DEVICE_WIRELESS
+                )
+        except dbus.exceptions.DBusException as e:
+            message = str(e).lower()
+            # A scan already under way still moves LastScan on when it ends
+            if "already scanning" in message:
+                logger.debug("Waiting on the scan already under way.")
+            # A scan requested right after the last one is turned down, and
+            # the results of that one are still current.
+            elif "previous scan" in message:
+                logger.debug("Using the results of the scan just finished.")
+                return True
+            else:
+                raise ScanUnavailable(e.get_dbus_message())
+
+        deadline = time.monotonic() + timeout
+        while not finished.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+
+            if match is not None:
+                finished.wait(remaining)
+            elif _last_scan(device) != before:
+                finished.set()
+            else:
+                time.sleep(min(POLL_INTERVAL, remaining))
+
+        return True
+    finally:
+        if match is not None:
+            match.remove()
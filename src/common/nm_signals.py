@@ -0,0 +1,55 @@
+import dbus
+import dbus.mainloop.glib
+import threading
+from common.errors import logger
+
+# NetworkManager D-Bus names used when subscribing to signals
+NM_SERVICE = "org.freedesktop.NetworkManager"
+NM_PATH = "/org/freedesktop/NetworkManager"
+NM_DEVICE = "org.freedesktop.NetworkManager.Device"
+NM_ACTIVE_CONNECTION = "org.freedesktop.NetworkManager.Connection.Active"
+NM_DEVICE_WIRELESS = "org.freedesktop.NetworkManager.Device.Wireless"
+NM_ACCESS_POINT = "org.freedesktop.NetworkManager.AccessPoint"
+DBUS_PROPERTIES = "org.freedesktop.DBus.Properties"
+
+_bus = None
+_lock = threading.Lock()
+
+
+def get_bus():
+    # Signals are received on a private system bus connection dispatched by a
+    # GLib main loop in its own thread, leaving the shared connection used by
+    # python-networkmanager untouched.
+    global _bus
+
+    with _lock:
+        if _bus is None:
+            # Imported here as loading GLib is slow and only needed once
+            # something subscribes.
+            from gi.repository import GLib
+
+            dbus.mainloop.glib.threads_init()
+            _bus = dbus.SystemBus(
+                private=True,
+                mainloop=dbus.mainloop.glib.DBusGMainLoop(),
+            )
+            threading.Thread(
+                target=GLib.MainLoop().run, name="nm-signals", daemon=True
+            ).start()
+            logger.debug("Listening for NetworkManager signals.")
+
+    return _bus
+
+
+def subscribe(handler, signal, interface, path=None, **kwargs):
+    # Returns a match object; call .remove() on it to unsubscribe. Extra
+    # keyword arguments are passed to add_signal_receiver, for example
+    # path_keyword="path" to receive the sending object's path.
+    return get_bus().add_signal_receiver(
+        handler,
+        signal_name=signal,
+        dbus_interface=interface,
+        bus_name=NM_SERVICE,
+        path=path,
+        **kwargs,
+    )
@@ -0,0 +1,125 @@
+import asyncio
+import config
+import html
+import threading
+import time
+from common import async_http
+from common import metrics
+from common.errors import logger
+
+# Phones and laptops joining a network fetch a known URL to check for a
+# captive portal. dnsmasq points every name at the hotspot, so while the
+# hotspot is up this small server answers those checks at once, telling the
+# device to show its sign-in sheet.
+
+# Paths fetched by each operating system's check
+PROBES = {
+    "/generate_204": "android",
+    "/gen_204": "android",
+    "/hotspot-detect.html": "apple",
+    "/library/test/success.html": "apple",
+    "/connecttest.txt": "windows",
+    "/ncsi.txt": "windows",
+    "/redirect": "windows",
+    "/success.txt": "firefox",
+    "/check_network_status.txt": "linux",
+    "/canonical.html": "linux",
+}
+
+PAGE = (
+    "<!DOCTYPE html><html><head><title>{ssid}</title>"
+    '<meta name="viewport" content="width=device-width">'
+    "</head><body><p>Connected to {ssid}. Open the app to set up Wi-Fi."
+    "</p></body></html>"
+)
+
+_state = {"loop": None, "server": None}
+_lock = threading.Lock()
+
+
+def _response(status, headers, body=b""):
+    lines = [f"HTTP/1.1 {status}"]
+    lines += [f"{name}: {value}" for name, value in headers]
+    lines += [
+        f"Content-Length: {len(body)}",
+        "Cache-Control: no-cache, no-store, must-revalidate",
+        "Connection: close",
+        "",
+        "",
+    ]
+
+    return "\r\n".join(lines).encode("latin-1") + body
+
+
+def respond():
+    # Returns the response to a request. Checks and any other page are sent
+    # to the portal when one is set, and otherwise get a page that is not
+    # the one the check expects, which makes the device show it.
+    if config.portal_url:
+        return _response("302 Found", [("Location", config.portal_url)])
+
+    body = PAGE.format(ssid=html.escape(config.hotspot_ssid)).encode()
+    return _response("200 OK", [("Content-Type", "text/html")], body)
+
+
+async def _handle(reader, writer):
+    started = time.perf_counter()
+
+    try:
+        _, path = await async_http.read_request(reader)
+
+        writer.write(respond())
+        await writer.drain()
+
+        probe = PROBES.get(path, "other")
+        metrics.inc("pwc_portal_requests_total", probe=probe)
+        metrics.observe(
+            "pwc_portal_response_duration_seconds",
+            time.perf_counter() - started,
+            probe=probe,
+        )
+    except (asyncio.TimeoutError, OSError):
+        pass
+    finally:
+        writer.close()
+
+
+def start():
+    # Answers captive portal checks until stopped. Safe to call while
+    # already running.
+    with _lock:
+        if _state["server"] is not None:
+            return
+
+        if _state["loop"] is None:
+            _state["loop"] = async_http.start_loop("portal")
+
+        try:
+            _state["server"] = async_http.serve(
+                _state["loop"], _handle, config.portal_host, config.portal_port
+            )
+        except Exception:
+            logger.exception(
+                "Failed to answer captive portal checks on "
+                f"{config.portal_host} port {config.portal_port}."
+            )
+            return
+
+    logger.info(
+        f"Answering captive portal checks on port {config.portal_port}"
+    )
+
+
+def stop():
+    with _lock:
+        server = _state["server"]
+        if server is None:
+            return
+        _state["server"] = None
+        _state["loop"].call_soon_threadsafe(server.close)
+
+    logger.info("Stopped answering captive portal checks.")
+
+
+def is_running():
+    return _state["server"] is not None
@@ -0,0 +1,115 @@
+import config
+import os
+import threading
+import time
+from common.errors import errors
+from common.errors import logger
+
+# Startup states reported by the readiness endpoint
+STARTING = "starting"
+READY = "ready"
+FAILED = "failed"
+
+
+def _process_age():
+    # Seconds since this process started, so time spent importing modules
+    # counts towards the time to ready.
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except Exception:
+        return 0
+
+
+_started = time.monotonic() - _process_age()
+_ready = threading.Event()
+_status = {
+    "state": STARTING,
+    "time_to_listening": None,
+    "time_to_ready": None,
+    "error": None,
+}
+_startup = {"function": None}
+_lock = threading.Lock()
+
+
+def _elapsed():
+    return round(time.monotonic() - _started, 3)
+
+
+def is_ready():
+    return _ready.is_set()
+
+
+def get_state():
+    return _status["state"]
+
+
+def get_status():
+    status = dict(_status)
+    status["boot_budget"] = config.boot_budget
+
+    if config.boot_budget is not None and status["time_to_ready"] is not None:
+        status["within_budget"] = status["time_to_ready"] <= config.boot_budget
+    else:
+        status["within_budget"] = None
+
+    return status
+
+
+def mark_failed(error):
+    # Keeps the reason, worded as the API would report the error
+    name = type(error).__name__
+    message = errors.get(name, {}).get("message") or str(error) or name
+    _status.update(state=FAILED, error=message)
+
+
+def _run():
+    try:
+        _startup["function"]()
+    except Exception as e:
+        logger.exception("Startup failed.")
+        mark_failed(e)
+
+
+def start(function):
+    # Runs startup in the background. It is expected to call mark_ready()
+    # when done, and is recorded as failed if it raises.
+    _startup["function"] = function
+    threading.Thread(target=_run, name="startup", daemon=True).start()
+
+
+def retry():
+    # Runs startup again if it failed, for example once a missing Wi-Fi
+    # device has been chosen. Returns whether it was started.
+    with _lock:
+        if _status["state"] != FAILED or _startup["function"] is None:
+            return False
+        _status.update(state=STARTING, error=None)
+
+    logger.info("Retrying startup.")
+    threading.Thread(target=_run, name="startup", daemon=True).start()
+    return True
+
+
+def mark_listening():
+    _status["time_to_listening"] = _elapsed()
+    logger.debug(f"Listening after {_status['time_to_listening']} seconds.")
+
+
+def mark_ready():
+    _status.update(state=READY, time_to_ready=_elapsed(), error=None)
+    _ready.set()
+
+    logger.info(f"Ready after {_status['time_to_ready']} seconds.")
+    if (
+        config.boot_budget is not None
+        and _status["time_to_ready"] > config.boot_budget
+    ):
+        logger.warning(
+            f"Startup exceeded the boot budget of {config.boot_budget} "
+            "seconds."
+        )
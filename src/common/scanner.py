@@ -0,0 +1,219 @@
+import config
+import threading
+import time
+from common import ap_properties
+from common import events
+from common import nm_signals
+from common.errors import logger
+from common.wifi import analyse_access_point
+from common.wifi import connecting
+from common.wifi import get_device
+from common.wifi import hotspot_running
+from common.wifi import list_access_points
+
+# Smallest change in signal strength reported as an event
+STRENGTH_CHANGE = 5
+
+# In-memory index of nearby access points, shared by every request.
+_cache = {"ssids": [], "iw_compatible": False, "scanned_at": None}
+_lock = threading.Lock()
+
+# The scan currently running, if any. Requests arriving while a scan is in
+# flight wait for its result instead of starting another one.
+_in_flight = None
+
+# Set to make the background scanner refresh the cache immediately.
+_wake = threading.Event()
+
+# Access points NetworkManager currently sees, by object path, so changes can
+# be reported as they are signalled. Entries are replaced rather than changed,
+# as they are handed to event subscribers.
+_visible = {}
+
+# Signal subscriptions for the watched device, removed when it changes
+_matches = []
+_watch_lock = threading.Lock()
+
+
+def cache_age():
+    # Seconds since the last completed scan, or None if there has not been one
+    if _cache["scanned_at"] is None:
+        return None
+
+    return time.time() - _cache["scanned_at"]
+
+
+def scanning_paused():
+    # Many chips cannot scan while running the hotspot, and falling back to
+    # iw can drop the devices joined to it. Unless the hotspot has a radio of
+    # its own, results are then only refreshed on request.
+    return not config.hotspot_interface and hotspot_running()
+
+
+def get_access_points(fresh=False):
+    # Serve from cache unless a fresh scan is requested or the cache expired.
+    # Scanning while NetworkManager activates a connection can break the
+    # association on some chips, so until it has finished only its last
+    # results are used, even when a fresh scan is requested.
+    age = cache_age()
+    if age is None:
+        return scan(
+            request_scan=not scanning_paused() and not connecting.is_set()
+        )
+    if connecting.is_set():
+        return dict(_cache)
+    if fresh:
+        return scan()
+    if age >= config.scan_ttl and not scanning_paused():
+        return scan()
+
+    return dict(_cache)
+
+
+def scan(request_scan=True):
+    global _in_flight
+
+    with _lock:
+        pending = _in_flight
+        if pending is None:
+            pending = _in_flight = {"done": threading.Event(), "error": None}
+            owner = True
+        else:
+            owner = False
+
+    # Share the result of the scan already running
+    if not owner:
+        logger.debug("Waiting on in-flight scan.")
+        pending["done"].wait()
+        if pending["error"]:
+            raise pending["error"]
+        return dict(_cache)
+
+    try:
+        ssids, iw_status = list_access_points(request_scan)
+        with _lock:
+            _cache.update(
+                ssids=ssids, iw_compatible=iw_status, scanned_at=time.time()
+            )
+        events.publish(
+            "scan", {"scanned_at": _cache["scanned_at"], "count": len(ssids)}
+        )
+    except Exception as e:
+        pending["error"] = e
+        raise
+    finally:
+        with _lock:
+            _in_flight = None
+        pending["done"].set()
+
+    return dict(_cache)
+
+
+def refresh():
+    # Ask the background scanner to rescan without waiting for the result
+    _wake.set()
+
+
+def _run():
+    while True:
+        age = cache_age()
+        if age is not None and age < config.scan_ttl:
+            _wake.wait(config.scan_ttl - age)
+
+        _wake.clear()
+
+        # Wait until NetworkManager has finished activating a connection, as
+        # with get_access_points().
+        if connecting.is_set():
+            time.sleep(1)
+            continue
+
+        # While scanning is paused, an empty cache is filled from
+        # NetworkManager's last results and otherwise left as it is.
+        paused = scanning_paused()
+        if paused and age is not None:
+            _wake.wait(config.scan_ttl)
+            continue
+
+        try:
+            scan(request_scan=not paused)
+        except Exception:
+            logger.exception("Background scan failed.")
+            _wake.wait(config.scan_ttl)
+
+
+def _on_access_point_added(path):
+    try:
+        entry = analyse_access_point(ap_properties.get(path))
+    except Exception:
+        # The access point may have gone again before it was read
+        return
+
+    _visible[str(path)] = entry
+    events.publish("ap_added", entry)
+
+
+def _on_access_point_removed(path):
+    entry = _visible.pop(str(path), None)
+    if entry is not None:
+        events.publish("ap_removed", entry)
+
+
+def _on_access_point_changed(interface, changed, invalidated, path=None):
+    entry = _visible.get(str(path))
+    if entry is None or "Strength" not in changed:
+        return
+
+    strength = int(changed["Strength"])
+    if abs(strength - entry["strength"]) >= STRENGTH_CHANGE:
+        entry = _visible[str(path)] = dict(entry, strength=strength)
+        events.publish("ap_strength", entry)
+
+
+def watch_access_points():
+    # Reports access points appearing, disappearing and changing strength as
+    # NetworkManager signals them. Called again when the interface changes,
+    # to watch the new device instead.
+    with _watch_lock:
+        for match in _matches:
+            match.remove()
+        _matches.clear()
+        _visible.clear()
+
+        try:
+            device = get_device()
+            _matches.append(
+                nm_signals.subscribe(
+                    _on_access_point_added,
+                    "AccessPointAdded",
+                    nm_signals.NM_DEVICE_WIRELESS,
+                    device.object_path,
+                )
+            )
+            _matches.append(
+                nm_signals.subscribe(
+                    _on_access_point_removed,
+                    "AccessPointRemoved",
+                    nm_signals.NM_DEVICE_WIRELESS,
+                    device.object_path,
+                )
+            )
+            _matches.append(
+                nm_signals.subscribe(
+                    _on_access_point_changed,
+                    "PropertiesChanged",
+                    nm_signals.DBUS_PROPERTIES,
+                    arg0=nm_signals.NM_ACCESS_POINT,
+                    path_keyword="path",
+                )
+            )
+
+            for ap in ap_properties.get_all(device.object_path):
+                _visible[ap.path] = analyse_access_point(ap)
+        except Exception:
+            logger.exception("Failed watching access points.")
+
+
+def start():
+    watch_access_points()
+    threading.Thread(target=_run, name="scanner", daemon=True).start()
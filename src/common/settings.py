@@ -0,0 +1,128 @@
+import json
+import logging
+import os
+import threading
+
+# Settings changed through the API, kept in the db folder so they survive
+# restarts and take precedence over the environment. They are read once and
+# then served from memory. Writes go to a temporary file that replaces the
+# old one, so a power cut leaves either the old or the new settings.
+
+PATH = "db/settings.json"
+
+# Written by earlier versions, as KEY=value lines
+LEGACY_PATH = "db/.db"
+LEGACY_KEYS = {
+    "PWC_HOTSPOT_SSID": "hotspot_ssid",
+    "PWC_HOTSPOT_PASSWORD": "hotspot_password",
+}
+
+# Settings that can be stored, and their types
+FIELDS = {
+    "hotspot_ssid": str,
+    "hotspot_password": str,
+}
+
+# The errors module reads config, which reads this module, so the logger is
+# looked up by name instead of imported.
+logger = logging.getLogger("syslog")
+
+_settings = None
+_lock = threading.Lock()
+
+
+def write_json(path, data):
+    # Writes data to path so that the file is either the old or the new
+    # version, even after a power cut. The folder is made on first write.
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    # The rename is only durable once the directory is written too
+    directory = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+def _read_legacy():
+    settings = {}
+    with open(LEGACY_PATH) as f:
+        for line in f:
+            key, _, value = line.strip().partition("=")
+            value = value.strip()
+            if len(value) > 1 and value[0] == value[-1] and value[0] in "'\"":
+                value = value[1:-1]
+            if key.strip() in LEGACY_KEYS:
+                settings[LEGACY_KEYS[key.strip()]] = value
+
+    return settings
+
+
+def _load():
+    global _settings
+
+    if _settings is not None:
+        return _settings
+
+    try:
+        with open(PATH) as f:
+            stored = json.load(f)
+    except FileNotFoundError:
+        stored = {}
+        try:
+            stored = _read_legacy()
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError):
+            logger.exception(f"Failed reading {LEGACY_PATH}.")
+        else:
+            if stored:
+                logger.info(f"Moving settings from {LEGACY_PATH} to {PATH}.")
+                write_json(PATH, stored)
+                os.remove(LEGACY_PATH)
+    except (OSError, ValueError):
+        logger.exception("Failed reading settings. Using defaults.")
+        stored = {}
+
+    # Drop anything that is not a known setting of the right type
+    _settings = {
+        key: value
+        for key, value in stored.items()
+        if key in FIELDS and isinstance(value, FIELDS[key])
+    }
+
+    return _settings
+
+
+def get(key, default=None):
+    with _lock:
+        return _load().get(key, default)
+
+
+def update(values):
+    # Stores several settings together: either all of them are saved or, if
+    # one is invalid or the write fails, none are. Nothing is written when
+    # the values are already stored.
+    for key, value in values.items():
+        if key not in FIELDS:
+            raise KeyError(key)
+        if not isinstance(value, FIELDS[key]):
+            raise TypeError(f"{key} must be {FIELDS[key].__name__}.")
+
+    with _lock:
+        current = _load()
+        updated = dict(current, **values)
+        if updated == current:
+            return False
+
+        write_json(PATH, updated)
+        current.update(values)
+
+    return True
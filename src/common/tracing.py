@@ -0,0 +1,127 @@
+import config
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextlib import nullcontext
+from flask import g
+from flask import request
+
+# Opt-in tracing of where time goes: D-Bus calls, subprocesses, sleeps, jobs
+# and API requests are recorded as spans in a ring buffer and exported in the
+# Chrome trace-event format, for viewers such as Perfetto or chrome://tracing.
+# Spans on the same thread nest by time. When tracing is off, span() returns
+# a shared no-op context, so the cost is one check.
+
+_NOOP = nullcontext()
+
+_state = {"enabled": config.tracing}
+_spans = deque(maxlen=config.trace_buffer_size)
+_threads = {}
+_lock = threading.Lock()
+
+
+def enabled():
+    return _state["enabled"]
+
+
+def set_enabled(value):
+    _state["enabled"] = bool(value)
+
+
+def _now():
+    # Microseconds, the unit of the trace-event format
+    return time.perf_counter_ns() // 1000
+
+
+def record(name, category, started, finished, args=None):
+    # Adds a span that has already finished, with times from _now()
+    thread = threading.current_thread()
+    event = {
+        "name": name,
+        "cat": category,
+        "ph": "X",
+        "ts": started,
+        "dur": finished - started,
+        "pid": os.getpid(),
+        "tid": thread.ident,
+    }
+    if args:
+        event["args"] = args
+
+    with _lock:
+        _spans.append(event)
+        _threads[thread.ident] = thread.name
+
+
+@contextmanager
+def _span(name, category, args):
+    started = _now()
+    try:
+        yield
+    finally:
+        record(name, category, started, _now(), args)
+
+
+def span(name, category="app", **args):
+    # Records how long the block takes, including when it raises
+    if not _state["enabled"]:
+        return _NOOP
+
+    return _span(name, category, args)
+
+
+def export():
+    # Returns the recorded spans as a Chrome trace
+    with _lock:
+        events = list(_spans)
+        threads = dict(_threads)
+
+    # Name each thread so the viewer shows which is which
+    pid = os.getpid()
+    metadata = [
+        {
+            "name": "thread_name",
+            "ph": "M",
+            "pid": pid,
+            "tid": tid,
+            "args": {"name": name},
+        }
+        for tid, name in threads.items()
+    ]
+
+    return {
+        "traceEvents": metadata + events,
+        "displayTimeUnit": "ms",
+        "otherData": {
+            "enabled": _state["enabled"],
+            "buffer_size": _spans.maxlen,
+        },
+    }
+
+
+def clear():
+    with _lock:
+        _spans.clear()
+        _threads.clear()
+
+
+def instrument(app):
+    # Records a span for every request handled by the Flask app
+    @app.before_request
+    def start_span():
+        if _state["enabled"]:
+            g.trace_started = _now()
+
+    @app.teardown_request
+    def finish_span(error=None):
+        if "trace_started" in g:
+            rule = request.url_rule.rule if request.url_rule else "none"
+            record(
+                f"{request.method} {rule}",
+                "http",
+                g.trace_started,
+                _now(),
+                {"path": request.full_path.rstrip("?")},
+            )
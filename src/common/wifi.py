@@ -1,50 +1,122 @@
 import config
-import NetworkManager as Pnm  # Python NetworkManager
-import os
-import socket
 import subprocess
-import sys
+import threading
 import time
+from common import ap_properties
+from common import connections
+from common import connectivity
+from common import dnsmasq
+from common import events
+from common import jobs
+from common import known_networks
+from common import link_state
+from common import metrics
+from common import nm
+from common import nm_scan
+from common import nm_signals
+from common import portal
+from common import tracing
 from common.errors import logger
 from common.errors import WifiConnectionFailed
 from common.errors import WifiDeviceNotFound
 from common.errors import WifiHotspotStartFailed
 from common.errors import WifiNetworkManagerError
+from common.nm import Pnm  # Python NetworkManager
+from common.nm_dicts import client_id
 from common.nm_dicts import get_nm_dict
 from common.system import led
+from concurrent.futures import ThreadPoolExecutor
 from time import sleep
 
+# Prefixes of the names of NetworkManager state reason codes, for reporting
+# why a connection attempt failed.
+DEVICE_STATE_REASON = "NM_DEVICE_STATE_REASON_"
+ACTIVE_CONNECTION_STATE_REASON = "NM_ACTIVE_CONNECTION_STATE_REASON_"
+
+# Device state reasons after which NetworkManager will not manage to activate
+# the connection, so there is no point waiting out the timeout. The FAILED and
+# NEED_AUTH device states end an attempt whatever the reason. Keep the README
+# in step.
+TERMINAL_DEVICE_STATE_REASONS = {
+    "NO_SECRETS",
+    "SUPPLICANT_CONFIG_FAILED",
+    "SUPPLICANT_FAILED",
+    "SUPPLICANT_TIMEOUT",
+    "SSID_NOT_FOUND",
+}
+
+# Settings holding secrets, which NetworkManager leaves out of GetSettings
+SECRETS = {
+    "802-11-wireless-security": ("psk",),
+    "802-1x": ("password",),
+}
+
+# Settings NetworkManager fills in or keeps up to date itself, which are left
+# out when comparing a saved connection with the settings wanted
+NM_MANAGED_SETTINGS = {
+    "connection": ("timestamp",),
+    "802-11-wireless": ("seen-bssids",),
+    "ipv6": ("addr-gen-mode",),
+}
+
+# Most recent attempt to connect to a network, see get_last_attempt()
+_last_attempt = None
+
+# The Wi-Fi device in use, see get_device()
+_device = {
+    "device": None,
+    "hotspot": None,
+    "watching": False,
+    "unavailable": False,
+}
+_device_lock = threading.RLock()
+
+# Set while a connection is being activated so background work touching the
+# radio, such as scans, can stand aside.
+connecting = threading.Event()
+
 
 def analyse_access_point(ap):
+    # Takes an ap_properties.AccessPoint, so no D-Bus calls are needed
     security = config.type_none
+    flags = ap.flags
+    wpa_flags = ap.wpa_flags
+    rsn_flags = ap.rsn_flags
 
     # Based on a subset of the AP_SEC flag settings
     # (https://developer.gnome.org/NetworkManager/1.2/nm-dbus-types.html#NM80211ApSecurityFlags)
     # to determine which type of security this AP uses.
     AP_SEC = Pnm.NM_802_11_AP_SEC_NONE
     if (
-        ap.Flags & Pnm.NM_802_11_AP_FLAGS_PRIVACY
-        and ap.WpaFlags == AP_SEC
-        and ap.RsnFlags == AP_SEC
+        flags & Pnm.NM_802_11_AP_FLAGS_PRIVACY
+        and wpa_flags == AP_SEC
+        and rsn_flags == AP_SEC
     ):
         security = config.type_wep
 
-    if ap.WpaFlags != AP_SEC:
+    if wpa_flags != AP_SEC:
         security = config.type_wpa
 
-    if ap.RsnFlags != AP_SEC:
+    if rsn_flags != AP_SEC:
         security = config.type_wpa2
 
     if (
-        ap.WpaFlags & Pnm.NM_802_11_AP_SEC_KEY_MGMT_802_1X
-        or ap.RsnFlags & Pnm.NM_802_11_AP_SEC_KEY_MGMT_802_1X
+        wpa_flags & Pnm.NM_802_11_AP_SEC_KEY_MGMT_802_1X
+        or rsn_flags & Pnm.NM_802_11_AP_SEC_KEY_MGMT_802_1X
     ):
         security = config.type_enterprise
 
     entry = {
-        "ssid": ap.Ssid,
+        "ssid": ap.ssid,
         "conn_type": security,
-        "strength": int(ap.Strength),
+        "strength": ap.strength,
+        "bssid": ap.bssid,
+        "frequency": ap.frequency,
+        "band": ap_properties.band(ap.frequency),
+        "channel": ap_properties.channel(ap.frequency),
+        "max_bitrate": ap.max_bitrate,
+        "mode": ap.mode,
+        "last_seen": ap.last_seen,
     }
 
     return entry
@@ -72,33 +144,50 @@ def auto_connect(ssid=None, username=None, password=None):
 
 # Returns True when a connection to a router is made, or the Hotspot is live
 def check_device_state():
-    if get_device().State == Pnm.NM_DEVICE_STATE_ACTIVATED:
+    device = get_device()
+    with metrics.dbus_call("Device.State"):
+        state = device.State
+
+    if state == Pnm.NM_DEVICE_STATE_ACTIVATED:
         return True
     else:
         return False
 
 
-# Ignores device and Wi-Fi status and checks for internet. Helpful for when
-# connected to Ethernet.
-def check_internet_status(host="8.8.8.8", port=53, timeout=5):
-    try:
-        socket.setdefaulttimeout(timeout)
-        socket.socket(socket.AF_INET, socket.SOCK_STREAM).connect((host, port))
-        # If there is a connection return True
-        return True
-    except socket.error:
-        # If there isn't a connection return False
-        return False
+# Returns True when the hotspot radio is activated
+def check_hotspot_state():
+    device = get_hotspot_device()
+    with metrics.dbus_call("Device.State"):
+        state = device.State
+
+    return state == Pnm.NM_DEVICE_STATE_ACTIVATED
 
 
 # Checks if there is an active connection to an external Wi-Fi router
 def check_wifi_status():
+    # Answered from the device state NetworkManager signals to us, falling
+    # back to asking iw when signals are unavailable.
+    if link_state.is_connected() is None and link_state.is_available():
+        try:
+            link_state.watch(get_device())
+        except Exception:
+            logger.exception("Failed watching the Wi-Fi link state.")
+
+    connected = link_state.is_connected()
+    if connected is not None:
+        return connected
+
+    return check_wifi_status_iw()
+
+
+def check_wifi_status_iw():
     try:
-        run = subprocess.run(
-            ["iw", "dev", config.interface, "link"],
-            capture_output=True,
-            text=True,
-        ).stdout.rstrip()
+        with tracing.span("iw link", "subprocess"):
+            run = subprocess.run(
+                ["iw", "dev", config.interface, "link"],
+                capture_output=True,
+                text=True,
+            ).stdout.rstrip()
     except Exception:
         logger.exception(
             "Failed checking connection. Returning False to"
@@ -113,50 +202,158 @@ def check_wifi_status():
 
 
 def connect(
-    conn_type=config.type_hotspot, ssid=None, username=None, password=None
+    conn_type=config.type_hotspot,
+    ssid=None,
+    username=None,
+    password=None,
+    bssid=None,
+    fallback=True,
 ):
-    # Remove any existing connection made by this app
-    forget()
+    # With a BSSID, only that access point of the network is used. With
+    # fallback, the hotspot is restarted if the connection fails.
+    return _attempt(
+        conn_type, ssid, username, password, bssid, fallback, False
+    )
+
+
+def connect_saved(conn_type, ssid, username=None):
+    # Activates the connection saved for a known network as it is, leaving
+    # its password to NetworkManager. The hotspot is not restarted if it
+    # fails.
+    return _attempt(conn_type, ssid, username, None, None, False, True)
 
-    # Get the correct config based on type requested
-    logger.info(f"Adding connection of type {conn_type}")
-    conn_dict = get_nm_dict(conn_type, ssid, username, password)
 
+def _attempt(conn_type, ssid, username, password, bssid, fallback, saved):
+    connecting.set()
     try:
-        Pnm.Settings.AddConnection(conn_dict)
+        with tracing.span("connect", "wifi", conn_type=conn_type, ssid=ssid):
+            return _connect(
+                conn_type, ssid, username, password, bssid, fallback, saved
+            )
+    finally:
+        connecting.clear()
+
 
-        # Connect
-        Pnm.NetworkManager.ActivateConnection(
-            get_connection_id(), get_device(), "/"
+def _connect(conn_type, ssid, username, password, bssid, fallback, saved):
+    # Time spent in each phase of the attempt, in seconds
+    phases = {}
+    phase_started = time.monotonic()
+
+    def end_phase(name):
+        nonlocal phase_started
+        now = time.monotonic()
+        phases[name] = round(now - phase_started, 3)
+        metrics.observe(
+            "pwc_connect_phase_duration_seconds",
+            now - phase_started,
+            conn_type=conn_type,
+            phase=name,
         )
+        phase_started = now
+
+    if conn_type == config.type_hotspot:
+        metrics.inc("pwc_hotspot_starts_total")
+
+    # The hotspot and each network have a saved connection of their own
+    if conn_type == config.type_hotspot:
+        device = get_hotspot_device()
+        existing = connections.get_by_id(config.hotspot_name)
+    else:
+        device = get_device()
+        existing = get_saved_connection(ssid)
+
+    # Get the correct config based on type requested, unless the saved
+    # connection is used as it is.
+    if saved:
+        conn_dict = None
+        uuid = None
+    else:
+        logger.info(f"Adding connection of type {conn_type}")
+        conn_dict = get_nm_dict(conn_type, ssid, username, password, bssid)
+        uuid = conn_dict["connection"]["uuid"]
+
+    try:
+        if saved and not existing:
+            raise LookupError(f"No saved connection for {ssid}.")
+
+        # Reuse the connection made by this app rather than deleting it and
+        # adding another, and leave it untouched if nothing has changed to
+        # save writing it to disk again.
+        if existing:
+            connection = existing["connection"]
+            uuid = existing["settings"]["connection"]["uuid"]
+
+            if conn_dict is not None:
+                conn_dict["connection"]["uuid"] = uuid
+                if not settings_unchanged(existing, conn_dict):
+                    with metrics.dbus_call("Update"):
+                        connection.Update(conn_dict)
+                    connections.add(connection, conn_dict)
+            end_phase("save")
+
+            def activate():
+                with metrics.dbus_call("ActivateConnection"):
+                    return Pnm.NetworkManager.ActivateConnection(
+                        connection, device, "/"
+                    )
+
+        # Otherwise add and activate it in a single call
+        else:
+
+            def activate():
+                with metrics.dbus_call("AddAndActivateConnection"):
+                    added = Pnm.NetworkManager.AddAndActivateConnection(
+                        conn_dict, device, "/"
+                    )
+                connections.add(added[0], conn_dict)
+                return added[1]
 
         # If not a hotspot, log the connection SSID being attempted
         if conn_type != config.type_hotspot:
             logger.info(f"Attempting connection to {ssid}")
 
-        # Wait for ADDRCONF(NETDEV_CHANGE): link becomes ready
-        loop_count = 0
-        while not check_device_state():
-            time.sleep(1)
-            loop_count += 1
-            if loop_count > 30:  # Only wait 30 seconds max
-                break
+        # Connect and wait for ADDRCONF(NETDEV_CHANGE): link becomes ready
+        with tracing.span("activate", "wifi"):
+            activated, reason = wait_for_activation(
+                device,
+                activate,
+                timeout=config.connect_timeouts.get(conn_type, 30),
+            )
+        end_phase("activate")
+        logger.debug(f"Connection phase durations: {phases}")
 
-        if check_device_state():
+        if activated:
             logger.info("Connection active.")
 
             # Activate the LED to indicate device is connected.
             if conn_type is not config.type_hotspot:
                 led(1)
+                set_last_attempt(conn_type, ssid, "activated", None, phases)
+                known_networks.record_success(ssid, conn_type, username, uuid)
+
+                # Only now the connection is up is the hotspot on the other
+                # radio stopped, so users are not left without either.
+                if config.hotspot_interface:
+                    stop_hotspot()
+                else:
+                    stop_hotspot_services()
             else:
                 led(0)
+                start_hotspot_services()
 
             return True
         # If the current attempt is not already a hotspot attempt
         elif conn_type != config.type_hotspot:
-            # Restart hotspot as connection failed
-            logger.warning("Connection attempt failed.")
-            connect()
+            logger.warning(f"Connection attempt failed: {reason}")
+            known_networks.record_failure(ssid)
+            if not existing:
+                discard_connection(ssid, uuid)
+            if fallback:
+                # Restart hotspot as connection failed
+                start_hotspot()
+                end_phase("hotspot")
+            set_last_attempt(conn_type, ssid, "failed", reason, phases)
+            return False
         else:
             raise WifiHotspotStartFailed
     except Exception:
@@ -165,36 +362,303 @@ def connect(
         if conn_type == config.type_hotspot:
             raise WifiHotspotStartFailed
         else:
-            connect()  # Restart hotspot as connection failed
+            known_networks.record_failure(ssid)
+            if not existing:
+                discard_connection(ssid, uuid)
+            if fallback:
+                start_hotspot()  # Restart hotspot as connection failed
+                end_phase("hotspot")
+            set_last_attempt(conn_type, ssid, "error", None, phases)
             raise WifiConnectionFailed
 
 
+def reconnect():
+    # Tries the known networks in range, best first, and returns whether one
+    # of them connected. Starting the hotspot otherwise is left to the caller.
+    try:
+        candidates = known_networks.candidates(get_access_points())
+    except WifiNetworkManagerError:
+        return False
+
+    for network in candidates[: config.reconnect_attempts]:
+        # Open networks can be joined again without a saved connection
+        has_saved = get_saved_connection(network["ssid"]) is not None
+        if not has_saved and network["conn_type"] != config.type_none:
+            logger.debug(f"No saved connection for {network['ssid']}.")
+            continue
+
+        logger.info(f"Trying known network {network['ssid']}...")
+        try:
+            if has_saved:
+                connected = connect_saved(
+                    network["conn_type"], network["ssid"], network["username"]
+                )
+            else:
+                connected = connect(
+                    conn_type=network["conn_type"],
+                    ssid=network["ssid"],
+                    fallback=False,
+                )
+        except WifiConnectionFailed:
+            continue
+
+        if connected:
+            return True
+
+    return False
+
+
+def get_saved_connection(ssid):
+    # Returns the connection saved for a network, or None. Earlier versions
+    # kept only the network connected to last, in a connection named PWC,
+    # which is used until it is saved again under the network's own name.
+    network = known_networks.get(ssid)
+    if network and network.get("uuid"):
+        entry = connections.get_by_uuid(network["uuid"])
+        if entry:
+            return entry
+
+    for name in (client_id(ssid), config.ap_name):
+        entry = connections.get_by_id(name)
+        if (
+            entry
+            and is_own(entry)
+            and entry["settings"]["802-11-wireless"].get("ssid") == ssid
+        ):
+            return entry
+
+    return None
+
+
+def is_own(entry):
+    # Returns whether a saved connection is one made by this app to join a
+    # network, rather than the hotspot or a connection made elsewhere.
+    settings = entry["settings"]
+    name = settings["connection"]["id"]
+
+    return settings.get("802-11-wireless", {}).get("mode") != "ap" and (
+        name == config.ap_name or name.startswith(config.ap_name + " ")
+    )
+
+
+def get_current_connection():
+    # Returns the saved connection of the network the device is on, when
+    # made by this app, and otherwise of the known network joined last.
+    try:
+        device = get_device()
+        with metrics.dbus_call("Device.ActiveConnection"):
+            active = device.ActiveConnection
+        if str(getattr(active, "object_path", "/")) != "/":
+            with metrics.dbus_call("ActiveConnection.Uuid"):
+                entry = connections.get_by_uuid(active.Uuid)
+            if entry and is_own(entry):
+                return entry
+    except WifiDeviceNotFound:
+        pass
+
+    network = known_networks.most_recent()
+    if network:
+        return get_saved_connection(network["ssid"])
+
+    # Left by an earlier version
+    entry = connections.get_by_id(config.ap_name)
+    return entry if entry and is_own(entry) else None
+
+
+def discard_connection(ssid, uuid):
+    # Deletes the connection just added for a network that has never been
+    # joined, for example with a mistyped password, so NetworkManager does
+    # not keep trying it.
+    if known_networks.get(ssid) is not None:
+        return
+
+    entry = connections.get_by_uuid(uuid)
+    if entry:
+        delete_connection(entry["connection"])
+
+
+def recover():
+    # Gets the device back online after the link was lost, or brings the
+    # hotspot up so a user can choose another network. Returns whether it
+    # is back online.
+    if check_device_state():
+        logger.info("Wi-Fi link restored by NetworkManager.")
+        return True
+
+    if reconnect():
+        return True
+
+    logger.info("No known network available. Starting hotspot...")
+    start_hotspot()
+    return False
+
+
+def start_hotspot():
+    # Starts the hotspot, unless it is already up
+    if hotspot_running():
+        return True
+
+    return connect()
+
+
+def stop_hotspot():
+    try:
+        if check_hotspot_state():
+            device = get_hotspot_device()
+            with metrics.dbus_call("Disconnect"):
+                device.Disconnect()
+            logger.info("Hotspot stopped.")
+        stop_hotspot_services()
+    except Exception:
+        logger.exception("Failed to stop the hotspot.")
+
+
+def hotspot_running():
+    # Returns whether the hotspot is up, for example to restart it with new
+    # details. Its saved connection is kept while it is down, so the radio is
+    # asked instead.
+    try:
+        device = get_hotspot_device()
+    except WifiDeviceNotFound:
+        return False
+
+    with metrics.dbus_call("Device.Get"):
+        return (
+            device.State == Pnm.NM_DEVICE_STATE_ACTIVATED
+            and device.Mode == Pnm.NM_802_11_MODE_AP
+        )
+
+
+def start_hotspot_services():
+    # Hands out addresses and answers captive portal checks on the hotspot
+    dnsmasq.start(config.hotspot_interface or config.interface)
+    portal.start()
+
+
+def stop_hotspot_services():
+    dnsmasq.stop()
+    portal.stop()
+
+
+def handle_link_lost(reason):
+    # Called from the signal thread when the device drops off its network.
+    # Changes this app is making itself are ignored.
+    if connecting.is_set() or jobs.busy():
+        return
+
+    logger.warning(
+        f"Wi-Fi link lost: {nm.names(DEVICE_STATE_REASON).get(reason, 'UNKNOWN')}. "
+        f"Reconnecting in {config.reconnect_delay} seconds unless "
+        "NetworkManager restores it."
+    )
+    jobs.submit(
+        "reconnect", recover, {}, delay=config.reconnect_delay, yields=True
+    )
+
+
+def settings_unchanged(entry, settings):
+    # Returns whether a saved connection already has the given settings.
+    # Secrets are not part of the cached settings, so they are only read from
+    # NetworkManager once everything else matches.
+    saved = entry["settings"]
+
+    for section, values in settings.items():
+        for key, value in values.items():
+            if key in SECRETS.get(section, ()):
+                continue
+            if saved.get(section, {}).get(key) != value:
+                return False
+
+    # A setting only the saved connection has, such as a BSSID it was pinned
+    # to, would be kept by reusing it. Empty values are NetworkManager's
+    # defaults.
+    for section, values in saved.items():
+        ignored = SECRETS.get(section, ()) + NM_MANAGED_SETTINGS.get(
+            section, ()
+        )
+        for key, value in values.items():
+            if key in ignored or key in settings.get(section, {}):
+                continue
+            if value not in (None, "", 0, False, [], {}):
+                return False
+
+    for section, keys in SECRETS.items():
+        if section not in settings:
+            # A secret that is no longer wanted, such as a removed hotspot
+            # password, still needs clearing.
+            if section in saved:
+                return False
+            continue
+
+        with metrics.dbus_call("GetSecrets"):
+            secrets = entry["connection"].GetSecrets(section)
+        for key in keys:
+            if secrets.get(section, {}).get(key) != settings[section].get(key):
+                return False
+
+    return True
+
+
+def get_last_attempt():
+    # Outcome of the most recent attempt to connect to a network, or None
+    return _last_attempt
+
+
+def set_last_attempt(conn_type, ssid, result, reason, phases):
+    global _last_attempt
+
+    metrics.inc(
+        "pwc_connect_total",
+        conn_type=conn_type,
+        result=result,
+        reason=reason or "",
+    )
+
+    _last_attempt = {
+        "ssid": ssid,
+        "conn_type": conn_type,
+        "result": result,
+        "reason": reason,
+        "phases": phases,
+        "finished_at": time.time(),
+    }
+
+    events.publish("connect", _last_attempt)
+
+    # Report internet access for the network just joined or left
+    connectivity.refresh()
+
+
 def forget(create_new_hotspot=False, all_networks=False):
-    # Find and delete the hotspot connection
+    # Deletes the saved connection of the network the device is on, or of
+    # every network
     try:
         if all_networks:
-            for connection in Pnm.Settings.ListConnections():
-                if (
-                    connection.GetSettings()["connection"]["type"]
-                    == "802-11-wireless"
-                ):
-                    # Delete the identified connection
-                    network_id = connection.GetSettings()["connection"]["id"]
-                    # Add short delay to ensure the endpoint has returned a
-                    # response before disconnecting the user.
-                    sleep(0.5)
-                    connection.Delete()
-                    logger.debug(f"Deleted connection: {network_id}")
+            result = forget_all()
+            known_networks.remove()
+            stop_hotspot_services()
         else:
-            connection_id = get_connection_id()
-            # connection_id returns false if it is missing. This can be ignored
-            # as this function is often called as a precautionary clean up
-            if connection_id:
+            result = True
+            entry = get_current_connection()
+            # The connection may be missing. This can be ignored as this
+            # function is often called as a precautionary clean up
+            if entry:
+                connection_id = entry["connection"]
+                name = entry["settings"]["connection"]["id"]
+
+                # Stop reconnecting to the network once it is forgotten
+                known_networks.remove(
+                    entry["settings"]["802-11-wireless"].get("ssid")
+                )
+
                 # Add short delay to ensure the endpoint has returned a
                 # response before disconnecting the user.
-                sleep(0.5)
-                connection_id.Delete()
-                logger.debug(f"Deleted connection: {config.ap_name}")
+                with tracing.span("sleep", "sleep", seconds=0.5):
+                    sleep(0.5)
+                with metrics.dbus_call("Delete"):
+                    connection_id.Delete()
+                connections.remove(connection_id)
+                logger.debug(f"Deleted connection: {name}")
 
         # Disable LED indicating Wi-Fi is not active.
         led(0)
@@ -202,97 +666,483 @@ def forget(create_new_hotspot=False, all_networks=False):
         # If requested, create new Hotspot
         if create_new_hotspot:
             refresh_networks()
-            connect()
+            start_hotspot()
 
     except Exception:
         logger.exception("Failed to delete network.")
         raise WifiNetworkManagerError
 
-    return True
+    return result
 
 
-def get_connection_id():
-    connection = dict(
-        [
-            (x.GetSettings()["connection"]["id"], x)
-            for x in Pnm.Settings.ListConnections()
-        ]
+def forget_all():
+
+    # Deletes every saved Wi-Fi connection in one batch using the cached
+    # settings, and returns how many were removed and how long it took.
+    started = time.monotonic()
+
+    wifi_connections = [
+        entry["connection"]
+        for entry in connections.get_all()
+        if entry["settings"]["connection"]["type"] == "802-11-wireless"
+    ]
+
+    removed = 0
+    if wifi_connections:
+        # Add short delay to ensure the endpoint has returned a
+        # response before disconnecting the user.
+        with tracing.span("sleep", "sleep", seconds=0.5):
+            sleep(0.5)
+
+        with ThreadPoolExecutor(
+            max_workers=min(len(wifi_connections), 8)
+        ) as pool:
+            removed = sum(pool.map(delete_connection, wifi_connections))
+
+    result = {
+        "removed": removed,
+        "failed": len(wifi_connections) - removed,
+        "duration": round(time.monotonic() - started, 3),
+    }
+    logger.info(
+        f"Removed {result['removed']} Wi-Fi connections in "
+        f"{result['duration']} seconds."
     )
 
-    if config.ap_name in connection:
-        return connection[config.ap_name]
-    else:
+    return result
+
+
+def delete_connection(connection):
+    # Returns whether the connection was deleted
+    try:
+        with metrics.dbus_call("Delete"):
+            connection.Delete()
+    except Exception:
+        logger.exception(f"Failed to delete {connection.object_path}.")
         return False
 
+    connections.remove(connection)
+    logger.debug(f"Deleted connection: {connection.object_path}")
+    return True
+
 
 def get_device():
-    # Configured interface variable takes precedent.
-    if "PWC_INTERFACE" in os.environ:
-        logger.debug(f"Interface {os.environ['PWC_INTERFACE']} selected.")
-        for device in Pnm.NetworkManager.GetDevices():
+    # Returns the Wi-Fi device to manage. It is looked up once and cached
+    # until NetworkManager adds or removes a device or the interface is
+    # changed. If signals are unavailable it is looked up on every call.
+    _watch_devices()
+
+    with _device_lock:
+        device = _device["device"]
+        if device is None:
+            device = _find_device()
+            if _device["watching"]:
+                _device["device"] = device
+
+    return device
+
+
+def _list_wifi_devices():
+    # Returns (interface, device) for each Wi-Fi device, except the one
+    # reserved for the hotspot.
+    with metrics.dbus_call("GetDevices"):
+        all_devices = Pnm.NetworkManager.GetDevices()
+
+    wifi_devices = []
+    for device in all_devices:
+        with metrics.dbus_call("Device.Get"):
             if device.DeviceType != Pnm.NM_DEVICE_TYPE_WIFI:
                 continue
-            # For each Wi-Fi network interface, check the interface name
-            # against the one configured in config.interface
-            if (
-                device.Udi[device.Udi.rfind("/") + 1 :].lower()
-                == os.environ["PWC_INTERFACE"]
-            ):
+            udi = device.Udi
+        interface = udi[udi.rfind("/") + 1 :].lower()
+        if interface != config.hotspot_interface:
+            wifi_devices.append((interface, device))
+
+    return wifi_devices
+
+
+def _find_device():
+    wifi_devices = _list_wifi_devices()
+
+    # Configured interface variable takes precedent.
+    if config.requested_interface:
+        logger.debug(f"Interface {config.requested_interface} selected.")
+        for interface, device in wifi_devices:
+            if interface == config.requested_interface:
+                config.interface = interface
                 return device
 
         # If device was not found during the loop
+        logger.error(
+            f"Wi-Fi interface {config.requested_interface} not found."
+        )
         raise WifiDeviceNotFound
 
     # Fetch last Wi-Fi interface found
-    devices = dict(
-        [(x.DeviceType, x) for x in Pnm.NetworkManager.GetDevices()]
-    )
-
-    if Pnm.NM_DEVICE_TYPE_WIFI in devices:
-        return devices[Pnm.NM_DEVICE_TYPE_WIFI]
+    if wifi_devices:
+        config.interface, device = wifi_devices[-1]
+        return device
     else:
-        logger.error("No suitable or available WiFi device found. Exiting.")
-        sys.exit(0)
+        logger.error("No suitable or available WiFi device found.")
+        raise WifiDeviceNotFound
+
+
+def get_hotspot_device():
+    # Returns the Wi-Fi device the hotspot runs on, which is the same as
+    # get_device() unless PWC_HOTSPOT_INTERFACE names another radio.
+    if not config.hotspot_interface:
+        return get_device()
+
+    _watch_devices()
+
+    with _device_lock:
+        device = _device["hotspot"]
+        if device is None:
+            with metrics.dbus_call("GetDevices"):
+                all_devices = Pnm.NetworkManager.GetDevices()
+            for candidate in all_devices:
+                with metrics.dbus_call("Device.Get"):
+                    udi = candidate.Udi
+                if (
+                    udi[udi.rfind("/") + 1 :].lower()
+                    == config.hotspot_interface
+                ):
+                    device = candidate
+                    break
+            else:
+                logger.error(
+                    f"Hotspot interface {config.hotspot_interface} not found."
+                )
+                raise WifiDeviceNotFound
+
+            if _device["watching"]:
+                _device["hotspot"] = device
+
+    return device
+
+
+def _on_devices_changed(path):
+    # A device was added or removed, so look the Wi-Fi devices up again
+    with _device_lock:
+        device = _device["device"]
+        _device.update(device=None, hotspot=None)
+
+    if device is not None and str(device.object_path) == str(path):
+        logger.info("Wi-Fi device removed.")
+        link_state.reset()
+
+
+def _watch_devices():
+    with _device_lock:
+        if _device["watching"] or _device["unavailable"]:
+            return
+
+        try:
+            for signal in ("DeviceAdded", "DeviceRemoved"):
+                nm_signals.subscribe(
+                    _on_devices_changed,
+                    signal,
+                    nm_signals.NM_SERVICE,
+                    nm_signals.NM_PATH,
+                )
+        except Exception:
+            logger.exception(
+                "NetworkManager signals unavailable. The Wi-Fi device will "
+                "be looked up every time it is used."
+            )
+            _device["unavailable"] = True
+            return
+
+        _device["watching"] = True
+
+
+def set_interface(interface):
+    # Switches to another Wi-Fi interface, raising WifiDeviceNotFound and
+    # keeping the current one if it does not exist.
+    if interface.lower() == config.hotspot_interface:
+        logger.error(f"Interface {interface} is reserved for the hotspot.")
+        raise WifiDeviceNotFound
+
+    previous = config.requested_interface, config.interface
+
+    with _device_lock:
+        config.requested_interface = interface.lower()
+        try:
+            device = _find_device()
+        except Exception:
+            config.requested_interface, config.interface = previous
+            raise
+
+        _device["device"] = device if _device["watching"] else None
+
+    link_state.reset()
+    logger.info(f"Interface changed to {config.interface}")
+
+    # The hotspot shares the interface unless it has a radio of its own
+    if not config.hotspot_interface:
+        dnsmasq.rebind(config.interface)
+
+
+def wait_for_networkmanager(timeout):
+    # Waits until NetworkManager has finished starting up and is not part way
+    # through activating the device, so a previously saved connection has the
+    # chance to come up. Returns as soon as that is the case, or after the
+    # timeout.
+    device = get_device()
+    settled = threading.Event()
+
+    def check(*args, **kwargs):
+        try:
+            with metrics.dbus_call("Device.State"):
+                state = device.State
+            with metrics.dbus_call("NetworkManager.Startup"):
+                starting = Pnm.NetworkManager.Startup
+            activating = (
+                Pnm.NM_DEVICE_STATE_PREPARE
+                <= state
+                < Pnm.NM_DEVICE_STATE_ACTIVATED
+            )
+            if state == Pnm.NM_DEVICE_STATE_ACTIVATED or (
+                not starting and not activating
+            ):
+                settled.set()
+        except Exception:
+            logger.exception("Failed reading NetworkManager state.")
+
+    matches = []
+    try:
+        matches.append(
+            nm_signals.subscribe(
+                check, "StateChanged", nm_signals.NM_DEVICE, device.object_path
+            )
+        )
+        matches.append(
+            nm_signals.subscribe(
+                check,
+                "PropertiesChanged",
+                nm_signals.DBUS_PROPERTIES,
+                nm_signals.NM_PATH,
+            )
+        )
+        check()
+        settled.wait(timeout)
+    except Exception:
+        logger.exception(
+            "NetworkManager signals unavailable. Polling its state."
+        )
+        deadline = time.monotonic() + timeout
+        check()
+        while not settled.is_set() and time.monotonic() < deadline:
+            time.sleep(1)
+            check()
+    finally:
+        for match in matches:
+            match.remove()
+
+    return settled.is_set()
+
+
+def wait_for_activation(device, activate, timeout):
+    # Calls activate() and blocks until NetworkManager signals that the device
+    # or the new active connection has activated or failed. Returns whether
+    # the connection came up, and the reason when it did not.
+    result = {}
+    done = threading.Event()
+
+    def finish(activated, reason=None):
+        result.setdefault("outcome", (activated, reason))
+        done.set()
+
+    def on_device_state(new_state, old_state, reason):
+        if new_state == Pnm.NM_DEVICE_STATE_ACTIVATED:
+            # Only once the new connection is known can the device be
+            # checked to be running it rather than the one before. Until
+            # then, its own state is read once subscribed to.
+            if "active_connection" in result and is_active(
+                device, result["active_connection"]
+            ):
+                finish(True)
+        elif (
+            new_state == Pnm.NM_DEVICE_STATE_FAILED
+            or new_state == Pnm.NM_DEVICE_STATE_NEED_AUTH
+            or nm.names(DEVICE_STATE_REASON).get(reason)
+            in TERMINAL_DEVICE_STATE_REASONS
+        ):
+            finish(False, nm.names(DEVICE_STATE_REASON).get(reason, "UNKNOWN"))
+
+    def on_active_connection_state(state, reason):
+        if state == Pnm.NM_ACTIVE_CONNECTION_STATE_ACTIVATED:
+            finish(True)
+        elif state == Pnm.NM_ACTIVE_CONNECTION_STATE_DEACTIVATED:
+            finish(
+                False,
+                nm.names(ACTIVE_CONNECTION_STATE_REASON).get(
+                    reason, "UNKNOWN"
+                ),
+            )
+
+    # Subscribe before activating so no state change can be missed
+    try:
+        matches = [
+            nm_signals.subscribe(
+                on_device_state,
+                "StateChanged",
+                nm_signals.NM_DEVICE,
+                device.object_path,
+            )
+        ]
+    except Exception:
+        logger.exception(
+            "NetworkManager signals unavailable. Polling device state."
+        )
+        return poll_activation(device, activate(), timeout)
+
+    try:
+        active_connection = result["active_connection"] = activate()
+        matches.append(
+            nm_signals.subscribe(
+                on_active_connection_state,
+                "StateChanged",
+                nm_signals.NM_ACTIVE_CONNECTION,
+                active_connection.object_path,
+            )
+        )
+
+        # The connection may have come up before the subscription was made
+        with metrics.dbus_call("ActiveConnection.State"):
+            state = active_connection.State
+        on_active_connection_state(state, None)
+
+        done.wait(timeout)
+    finally:
+        for match in matches:
+            match.remove()
 
+    return result.get("outcome", (False, "TIMEOUT"))
 
-def list_access_points():
-    # Run IW to reduce chance of empty SSID list. Storing result
-    # to return so that if IW does not work on this device the refresh
-    # button will be disabled.
-    iw_status = refresh_networks(retries=1)
 
+def is_active(device, active_connection):
+    # Returns whether the device has activated the given active connection,
+    # rather than still running the one before it, such as the hotspot being
+    # switched away from.
+    with metrics.dbus_call("Device.ActiveConnection"):
+        current = device.ActiveConnection
+    if str(getattr(current, "object_path", "/")) != str(
+        active_connection.object_path
+    ):
+        return False
+
+    with metrics.dbus_call("ActiveConnection.State"):
+        state = active_connection.State
+    return state == Pnm.NM_ACTIVE_CONNECTION_STATE_ACTIVATED
+
+
+def poll_activation(device, active_connection, timeout):
+    # Fallback for when signals cannot be received
+    loop_count = 0
+    while True:
+        try:
+            if is_active(device, active_connection):
+                break
+        except Exception:
+            # NetworkManager removes an active connection that failed
+            return False, "UNKNOWN"
+
+        time.sleep(1)
+        loop_count += 1
+        if loop_count > timeout:
+            return False, "TIMEOUT"
+
+    return True, None
+
+
+def list_access_points(request_scan=True):
+    # Scan to reduce chance of empty SSID list. Storing result
+    # to return so that if scanning does not work on this device the refresh
+    # button will be disabled. Without request_scan, the results of
+    # NetworkManager's last scan are returned.
+    iw_status = refresh_networks(retries=1) if request_scan else False
+
+    return get_access_points(), iw_status
+
+
+def get_access_points():
+    # Returns the access points NetworkManager found in its last scan
     logger.debug("Fetching Wi-Fi networks.")
 
     try:
         # For each wi-fi connection in range, identify it's details
+        device = get_device()
         compiled_ssids = [
-            analyse_access_point(ap) for ap in get_device().GetAccessPoints()
+            analyse_access_point(ap)
+            for ap in ap_properties.get_all(device.object_path)
         ]
+    except WifiDeviceNotFound:
+        raise
     except Exception:
         logger.exception("Failed listing access points.")
         raise WifiNetworkManagerError
 
-    # Sort SSIDs by signal strength
-    compiled_ssids = sorted(
-        compiled_ssids, key=lambda x: x["strength"], reverse=True
-    )
+    # Sort BSSIDs by signal strength
+    compiled_ssids.sort(key=lambda x: x["strength"], reverse=True)
 
-    # Remove duplicates and own hotspot from list.
-    tmp = []
-    ssids = []
+    # Group the BSSIDs of each SSID in one pass, leaving out the hotspot.
+    # The first BSSID seen for an SSID is its strongest, and represents it.
+    groups = {}
     for item in compiled_ssids:
-        if item["ssid"] not in tmp and item["ssid"] != config.hotspot_ssid:
-            ssids.append(item)
-        tmp.append(item["ssid"])
+        if item["ssid"] == config.hotspot_ssid:
+            continue
+
+        group = groups.get(item["ssid"])
+        if group is None:
+            group = groups[item["ssid"]] = dict(item, bssids=[])
+        group["bssids"].append(item)
 
     logger.debug("Finished fetching Wi-Fi networks.")
 
-    # Return a list of available SSIDs and their security type,
-    # or [] for none available.
-    return ssids, iw_status
+    # Return a list of available SSIDs, strongest first, with their security
+    # type and every BSSID, or [] for none available.
+    return list(groups.values())
+
+
+def refresh_networks(retries=5, ssids=None):
+    # Refreshes the networks list, returning whether it was refreshed.
+    # NetworkManager is asked to scan and reports when it has results, so
+    # this takes as long as the radio needs. iw is only used where
+    # NetworkManager cannot scan, for example on some devices while the
+    # hotspot is up.
+    started = time.perf_counter()
+
+    if ssids is None:
+        ssids = config.hidden_ssids
+
+    try:
+        device = get_device()
+        with tracing.span("scan", "wifi"):
+            refreshed = nm_scan.scan(
+                device.object_path, ssids, timeout=config.scan_timeout
+            )
+    except WifiDeviceNotFound:
+        return False
+    except nm_scan.ScanUnavailable as e:
+        logger.debug(f"NetworkManager cannot scan: {e}. Trying iw.")
+    except Exception:
+        logger.exception("Failed requesting a scan from NetworkManager.")
+    else:
+        if not refreshed:
+            logger.warning("Timed out waiting for scan results.")
+        metrics.observe(
+            "pwc_scan_duration_seconds",
+            time.perf_counter() - started,
+            method="networkmanager",
+            result="success" if refreshed else "timeout",
+        )
+        return refreshed
+
+    return refresh_networks_iw(retries)
 
 
-def refresh_networks(retries=5):
+def refresh_networks_iw(retries=5):
     # Refreshing networks list using IW which has proven
     # to be better at refreshing than nmcli. Some devices
     # do not support this feature while the AP is active
@@ -300,20 +1150,41 @@ def refresh_networks(retries=5):
 
     # After forget has run, NetworkManager takes a while to release
     # the Wi-Fi for iw to use it, hence the retries.
+    started = time.perf_counter()
     max_runs = retries
     run = 0
     while run < max_runs:
         try:
-            time.sleep(3)
-            subprocess.check_output(["iw", "dev", config.interface, "scan"])
+            # Only wait once iw has reported the device busy
+            if run:
+                with tracing.span("sleep", "sleep", seconds=3):
+                    time.sleep(3)
+            with tracing.span("iw scan", "subprocess", attempt=run + 1):
+                subprocess.check_output(
+                    ["iw", "dev", config.interface, "scan"]
+                )
         except subprocess.CalledProcessError:
             logger.warning("IW resource busy. Retrying...")
+            if run + 1 < max_runs:
+                metrics.inc("pwc_scan_retries_total")
             continue
         except Exception:
             logger.error("Unknown error calling IW.")
+            metrics.observe(
+                "pwc_scan_duration_seconds",
+                time.perf_counter() - started,
+                method="iw",
+                result="error",
+            )
             return False
         else:
             logger.debug("IW succeeded.")
+            metrics.observe(
+                "pwc_scan_duration_seconds",
+                time.perf_counter() - started,
+                method="iw",
+                result="success",
+            )
             return True
         finally:
             run += 1
@@ -322,4 +1193,10 @@ def refresh_networks(retries=5):
         "IW is unable to complete the request. This can happen on some devices "
         "and is usually nothing to worry about."
     )
+    metrics.observe(
+        "pwc_scan_duration_seconds",
+        time.perf_counter() - started,
+        method="iw",
+        result="busy",
+    )
     return False
@@ -1,5 +1,6 @@
+import logging
 import os
-from dotenv import dotenv_values
+from common import settings
 
 # Set dev env variables
 if (
@@ -10,24 +11,17 @@ if (
 else:
     dev_mode = True
 
-# Check db directory exists
-if not os.path.exists("db"):
-    os.makedirs("db")
-
-# Import database file
-env_file = dotenv_values("db/.db")
-
-# Set default Wi-Fi SSID.
-if "PWC_HOTSPOT_SSID" in env_file:
-    hotspot_ssid = env_file["PWC_HOTSPOT_SSID"]
+# Set default Wi-Fi SSID. Settings saved through the API take precedence.
+if settings.get("hotspot_ssid") is not None:
+    hotspot_ssid = settings.get("hotspot_ssid")
 elif "PWC_HOTSPOT_SSID" in os.environ:
     hotspot_ssid = os.environ["PWC_HOTSPOT_SSID"]
 else:
     hotspot_ssid = "Python Wi-Fi Connect"
 
 # Set default hotspot password.
-if "PWC_HOTSPOT_PASSWORD" in env_file:
-    hotspot_password = env_file["PWC_HOTSPOT_PASSWORD"]
+if settings.get("hotspot_password") is not None:
+    hotspot_password = settings.get("hotspot_password")
 elif "PWC_HOTSPOT_PASSWORD" in os.environ:
     hotspot_password = os.environ["PWC_HOTSPOT_PASSWORD"]
 else:
@@ -47,6 +41,47 @@ if "PWC_PORT" in os.environ:
 else:
     port = 9090
 
+# Wi-Fi interface to manage. When not set, the last Wi-Fi device found is
+# used. The interface in use is kept in interface once it has been found.
+if "PWC_INTERFACE" in os.environ:
+    requested_interface = os.environ["PWC_INTERFACE"].lower()
+else:
+    requested_interface = None
+
+interface = requested_interface
+
+# Wi-Fi interface for the hotspot, when the device has a second radio. The
+# hotspot then stays up on it while the other radio scans and connects, and
+# is only stopped once the new connection is up.
+if (
+    "PWC_HOTSPOT_INTERFACE" in os.environ
+    and os.environ["PWC_HOTSPOT_INTERFACE"].lower() != requested_interface
+):
+    hotspot_interface = os.environ["PWC_HOTSPOT_INTERFACE"].lower()
+else:
+    hotspot_interface = None
+
+# Set the port Server-Sent Events are streamed on. Requests for /v1/events on
+# the main port are redirected here.
+if "PWC_EVENTS_PORT" in os.environ:
+    events_port = int(os.environ["PWC_EVENTS_PORT"])
+else:
+    events_port = int(port) + 1
+
+# Maximum seconds to wait at startup for NetworkManager to bring up a
+# previously saved connection before deciding whether to start the hotspot.
+if "PWC_BOOT_TIMEOUT" in os.environ:
+    boot_timeout = float(os.environ["PWC_BOOT_TIMEOUT"])
+else:
+    boot_timeout = 10
+
+# Seconds from process start to ready that a release is expected to meet.
+# Exceeding it is logged and reported by the readiness endpoint.
+if "PWC_BOOT_BUDGET" in os.environ:
+    boot_budget = float(os.environ["PWC_BOOT_BUDGET"])
+else:
+    boot_budget = None
+
 # Compile kwargs for automatic connection
 if "PWC_AC_SSID" in os.environ:
     auto_connect_kargs = {"ssid": os.environ["PWC_AC_SSID"]}
@@ -58,14 +93,167 @@ if "PWC_AC_SSID" in os.environ:
 else:
     auto_connect_kargs = False
 
+# Seconds to wait after the Wi-Fi link is lost, giving NetworkManager the
+# chance to restore it, before trying other known networks.
+if "PWC_RECONNECT_DELAY" in os.environ:
+    reconnect_delay = float(os.environ["PWC_RECONNECT_DELAY"])
+else:
+    reconnect_delay = 15
+
+# Most known networks tried, strongest first, before starting the hotspot.
+if "PWC_RECONNECT_ATTEMPTS" in os.environ:
+    reconnect_attempts = int(os.environ["PWC_RECONNECT_ATTEMPTS"])
+else:
+    reconnect_attempts = 3
+
+# Seconds a scan of nearby access points is served from cache before the
+# background scanner refreshes it.
+if "PWC_SCAN_TTL" in os.environ:
+    scan_ttl = float(os.environ["PWC_SCAN_TTL"])
+else:
+    scan_ttl = 30
+
+# Record where time goes, to download from /v1/trace. Off by default, and can
+# also be switched on and off through the API.
+if "PWC_TRACING" in os.environ and os.environ["PWC_TRACING"].lower() == "on":
+    tracing = True
+else:
+    tracing = False
+
+# Most spans kept while tracing. The oldest are dropped first.
+if "PWC_TRACE_BUFFER" in os.environ:
+    trace_buffer_size = int(os.environ["PWC_TRACE_BUFFER"])
+else:
+    trace_buffer_size = 10000
+
+# Seconds between background health checks. /healthcheck returns the most
+# recent result.
+if "PWC_HEALTH_INTERVAL" in os.environ:
+    health_interval = float(os.environ["PWC_HEALTH_INTERVAL"])
+else:
+    health_interval = 10
+
+# Most seconds to wait for NetworkManager to finish a scan
+if "PWC_SCAN_TIMEOUT" in os.environ:
+    scan_timeout = float(os.environ["PWC_SCAN_TIMEOUT"])
+else:
+    scan_timeout = 15
+
+# Hidden networks to probe for when scanning, as a comma separated list of
+# SSIDs. They are not broadcast, so only show up when asked for by name.
+if "PWC_HIDDEN_SSIDS" in os.environ:
+    hidden_ssids = [
+        ssid.strip()
+        for ssid in os.environ["PWC_HIDDEN_SSIDS"].split(",")
+        if ssid.strip()
+    ]
+else:
+    hidden_ssids = []
+
+# Hosts probed in parallel to decide whether there is internet access, as a
+# comma separated list of host:port.
+DEFAULT_INTERNET_TARGETS = [("8.8.8.8", 53), ("1.1.1.1", 53)]
+
+
+def parse_internet_targets(value):
+    # Returns (host, port) for each valid entry. Blank entries are skipped
+    # and malformed ones logged and ignored, falling back to the defaults
+    # when none are left. The logger is looked up by name, as common.errors
+    # imports this module.
+    logger = logging.getLogger("syslog")
+    targets = []
+
+    for target in value.split(","):
+        target = target.strip()
+        if not target:
+            continue
+
+        host, _, port = target.rpartition(":")
+        host = host.strip("[]")
+        try:
+            port = int(port)
+        except ValueError:
+            port = None
+        if not host or port is None or not 0 < port < 65536:
+            logger.warning(f"Ignoring internet target {target}.")
+            continue
+
+        targets.append((host, port))
+
+    if not targets:
+        logger.warning("No valid internet targets. Using the defaults.")
+        return list(DEFAULT_INTERNET_TARGETS)
+
+    return targets
+
+
+if "PWC_INTERNET_TARGETS" in os.environ:
+    internet_targets = parse_internet_targets(
+        os.environ["PWC_INTERNET_TARGETS"]
+    )
+else:
+    internet_targets = list(DEFAULT_INTERNET_TARGETS)
+
+# Seconds between internet checks. Checks start at the minimum interval and
+# back off towards the maximum while the result stays the same.
+if "PWC_INTERNET_INTERVAL" in os.environ:
+    internet_interval = float(os.environ["PWC_INTERNET_INTERVAL"])
+else:
+    internet_interval = 5
+
+if "PWC_INTERNET_MAX_INTERVAL" in os.environ:
+    internet_max_interval = float(os.environ["PWC_INTERNET_MAX_INTERVAL"])
+else:
+    internet_max_interval = 60
+
+# Use NetworkManager's own connectivity check when it has one configured,
+# instead of probing the targets above.
+if (
+    "PWC_INTERNET_SOURCE" in os.environ
+    and os.environ["PWC_INTERNET_SOURCE"].lower() == "networkmanager"
+):
+    internet_source_nm = True
+else:
+    internet_source_nm = False
+
 # Default access point name. No need to change these under usual operation as
 # they are for use inside the app only. PWC is acronym for 'Python Wi-Fi Connect'.
 ap_name = "PWC"
 
+# Name of the hotspot connection. It is kept apart from the connection to a
+# network, so switching between the two leaves both unchanged.
+hotspot_name = ap_name + "-hotspot"
+
 # dnsmasq variables
 DEFAULT_GATEWAY = "192.168.42.1"
 DEFAULT_DHCP_RANGE = "192.168.42.2,192.168.42.254"
 
+# Address and port captive portal checks are answered on while the hotspot
+# is up. dnsmasq sends every name to the hotspot's address, so phones send
+# their checks here.
+if "PWC_PORTAL_HOST" in os.environ:
+    portal_host = os.environ["PWC_PORTAL_HOST"]
+else:
+    portal_host = DEFAULT_GATEWAY
+
+if "PWC_PORTAL_PORT" in os.environ:
+    portal_port = int(os.environ["PWC_PORTAL_PORT"])
+else:
+    portal_port = 80
+
+# Page devices are sent to by the captive portal responder, for example a
+# user interface. Without it, they are shown a short page of their own.
+if "PWC_PORTAL_URL" in os.environ:
+    portal_url = os.environ["PWC_PORTAL_URL"]
+else:
+    portal_url = None
+
+# File dnsmasq keeps its leases in, read to list the devices on the hotspot
+if "PWC_DNSMASQ_LEASE_FILE" in os.environ:
+    dnsmasq_lease_file = os.environ["PWC_DNSMASQ_LEASE_FILE"]
+else:
+    dnsmasq_lease_file = "/var/lib/misc/dnsmasq.leases"
+
 # Wi-Fi modes. No need to rename these, they are used only as labels.
 type_hotspot = "HOTSPOT"
 type_none = "NONE"
@@ -73,3 +261,20 @@ type_wep = "WEP"
 type_wpa = "WPA"
 type_wpa2 = "WPA2"
 type_enterprise = "ENTERPRISE"
+
+# Seconds to wait for each connection type to activate before falling back to
+# the hotspot. Terminal failures such as a wrong password end the wait early.
+connect_timeouts = {
+    type_hotspot: 15,
+    type_none: 20,
+    type_wep: 20,
+    type_wpa: 30,
+    type_wpa2: 30,
+    type_enterprise: 45,
+}
+
+for conn_type in connect_timeouts:
+    if f"PWC_CONNECT_TIMEOUT_{conn_type}" in os.environ:
+        connect_timeouts[conn_type] = float(
+            os.environ[f"PWC_CONNECT_TIMEOUT_{conn_type}"]
+        )
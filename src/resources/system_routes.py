@@ -1,19 +1,68 @@
+import config
+from common import health
+from common import metrics
+from common import readiness
+from common import tracing
+from flask import redirect
+from flask import request
+from flask import Response
 from flask_restful import Resource
-from werkzeug import serving
+from urllib.parse import urlsplit
 
-# Import logging controller for log_request function
-parent_log_request = serving.WSGIRequestHandler.log_request
 
+class system_health_check(Resource):
+    def get(self):
+        # Served from the last background check, so this never waits on
+        # NetworkManager.
+        status = health.get_status()
 
-# Function for disabling logging on '/'
-def log_request(self, *args, **kwargs):
-    if self.path == "/healthcheck":
-        return
+        return status, 503 if status["status"] == health.ERROR else 200
 
-    parent_log_request(self, *args, **kwargs)
 
+class system_readiness(Resource):
+    def get(self):
+        return readiness.get_status()
 
-class system_health_check(Resource):
+
+class system_metrics(Resource):
     def get(self):
-        serving.WSGIRequestHandler.log_request = log_request
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+class system_events(Resource):
+    def get(self):
+        # The stream is served on its own port, see common/events.py
+        hostname = urlsplit(request.host_url).hostname
+        if ":" in hostname:
+            hostname = f"[{hostname}]"
+
+        return redirect(
+            f"{request.scheme}://{hostname}:{config.events_port}/v1/events",
+            code=307,
+        )
+
+
+class system_trace(Resource):
+    def get(self):
+        # Spans recorded while tracing was on, in the Chrome trace-event
+        # format. Pass ?clear=1 to start afresh once downloaded.
+        trace = tracing.export()
+        if request.args.get("clear") in ("1", "true"):
+            tracing.clear()
+
+        return trace
+
+    def post(self):
+        content = request.get_json()
+
+        if not content or not isinstance(content.get("enabled"), bool):
+            return {"message": "enabled must be true or false."}, 400
+
+        tracing.set_enabled(content["enabled"])
+
+        return {"message": "ok", "enabled": tracing.enabled()}
+
+    def delete(self):
+        tracing.clear()
+
         return {"message": "ok"}
@@ -1,17 +1,24 @@
 import config
-import dotenv
-import threading
+import re
+from common import connectivity
+from common import dnsmasq
+from common import jobs
+from common import readiness
+from common import scanner
+from common import settings
+from common.errors import SettingsNotSaved
 from common.errors import logger
-from common.wifi import check_internet_status
 from common.wifi import check_wifi_status
 from common.wifi import connect
 from common.wifi import forget
-from common.wifi import get_connection_id
-from common.wifi import list_access_points
-from dotenv import dotenv_values
+from common.wifi import get_last_attempt
+from common.wifi import hotspot_running
+from common.wifi import set_interface
 from flask import request
 from flask_restful import Resource
 
+BSSID = re.compile(r"^([0-9A-Fa-f]{2}:){5}[0-9A-Fa-f]{2}$")
+
 
 class wifi_connect(Resource):
     def post(self):
@@ -25,6 +32,9 @@ class wifi_connect(Resource):
         if "conn_type" not in content or "ssid" not in content:
             return {"message": "Type or SSID not specified"}, 400
 
+        if content.get("bssid") and not BSSID.match(content["bssid"]):
+            return {"message": "BSSID must be a MAC address."}, 400
+
         # NetworkManager only supports passwords with minimum 8 character
         # https://gitlab.freedesktop.org/NetworkManager/NetworkManager/-/issues/768
         if "password" in content and len(content["password"]) < 8:
@@ -32,20 +42,26 @@ class wifi_connect(Resource):
                 "message": "Passwords must be 8 characters or longer."
             }, 400
 
-        # Use threading so the response can be returned before the user is
-        # disconnected.
-        wifi_connect_thread = threading.Thread(target=connect, kwargs=content)
-
-        wifi_connect_thread.start()
+        # Queue the connection, holding it briefly so the response is
+        # returned before the user is disconnected. A newer request replaces
+        # one still waiting.
+        job = jobs.submit(
+            "connect", connect, content, supersede=True, delay=0.5
+        )
 
-        return {"message": "accepted"}, 202
+        return {"message": "accepted", "job": job["id"]}, 202
 
 
 class wifi_connection_status(Resource):
     def get(self):
+        internet = connectivity.get_status()
+
         return {
             "wifi": check_wifi_status(),
-            "internet": check_internet_status(),
+            "internet": internet["internet"],
+            "internet_age": internet["age"],
+            "internet_latency": internet["latency"],
+            "last_attempt": get_last_attempt(),
         }
 
 
@@ -61,24 +77,56 @@ class wifi_forget(Resource):
         else:
             forget_mode = request.get_json()["all_networks"]
 
-        # Use threading so the response can be returned before the user is
-        # disconnected.
-        wifi_forget_thread = threading.Thread(
-            target=forget,
-            kwargs={"create_new_hotspot": True, "all_networks": forget_mode},
+        # Queue the removal so the response can be returned before the user
+        # is disconnected.
+        logger.info("Removing connetion...")
+        job = jobs.submit(
+            "forget",
+            forget,
+            {"create_new_hotspot": True, "all_networks": forget_mode},
         )
 
-        logger.info("Removing connetion...")
-        wifi_forget_thread.start()
+        return {"message": "accepted", "job": job["id"]}, 202
 
-        return {"message": "accepted"}, 202
+
+class wifi_hotspot_clients(Resource):
+    def get(self):
+        return dnsmasq.clients()
+
+
+class wifi_job(Resource):
+    def get(self, job_id):
+        return jobs.get(job_id)
+
+    def delete(self, job_id):
+        return jobs.cancel(job_id)
 
 
 class wifi_list_access_points(Resource):
     def get(self):
-        ssids, iw_status = list_access_points()
+        # Pass ?fresh=1 to scan now instead of reading the cached results
+        fresh = request.args.get("fresh", "").lower() in ("1", "true")
 
-        return {"ssids": ssids, "iw_compatible": iw_status}
+        # Pass ?all_bssids=1 to include every access point of each network
+        all_bssids = request.args.get("all_bssids", "").lower() in (
+            "1",
+            "true",
+        )
+
+        access_points = scanner.get_access_points(fresh=fresh)
+
+        ssids = access_points["ssids"]
+        if not all_bssids:
+            ssids = [
+                {key: value for key, value in ssid.items() if key != "bssids"}
+                for ssid in ssids
+            ]
+
+        return {
+            "ssids": ssids,
+            "iw_compatible": access_points["iw_compatible"],
+            "scanned_at": access_points["scanned_at"],
+        }
 
 
 class wifi_set_hotspot_password(Resource):
@@ -90,62 +138,47 @@ class wifi_set_hotspot_password(Resource):
                 "message": "Passwords must be 8 characters or longer."
             }, 400
 
-        if not dotenv_values("db/.db"):
-            with open("db/.db", "w") as db:
-                db.write("PWC_HOTSPOT_PASSWORD=" + content["password"])
-        else:
-            dotenv.set_key(
-                "db/.db", "PWC_HOTSPOT_PASSWORD", content["password"]
-            )
+        return save_hotspot_settings({"hotspot_password": content["password"]})
 
-        # Set the new SSID to the global var
-        config.hotspot_password = content["password"]
 
-        # Fetch ID of any current connection
-        connection = get_connection_id()
+class wifi_set_hotspot_ssid(Resource):
+    def post(self):
+        content = request.get_json()
 
-        # If there is a running hotspot, recreate it with the new details
-        if (
-            connection
-            and connection.GetSettings()["802-11-wireless"]["mode"] == "ap"
-        ):
-            wifi_forget_thread = threading.Thread(
-                target=forget,
-                kwargs={"create_new_hotspot": True},
-            )
-            wifi_forget_thread.start()
+        if not content or not content.get("ssid"):
+            return {"message": "SSID not provided."}, 400
 
-        return {"message": "ok"}, 200
+        values = {"hotspot_ssid": content["ssid"]}
 
+        # The password can be changed in the same request, so the hotspot is
+        # never saved with one new and one old detail.
+        if "password" in content:
+            if len(content["password"]) < 8:
+                return {
+                    "message": "Passwords must be 8 characters or longer."
+                }, 400
+            values["hotspot_password"] = content["password"]
 
-class wifi_set_hotspot_ssid(Resource):
-    def post(self):
-        content = request.get_json()
+        return save_hotspot_settings(values)
 
-        if not dotenv_values("db/.db"):
-            with open("db/.db", "w") as db:
-                db.write("PWC_HOTSPOT_SSID=" + content["ssid"])
-        else:
-            dotenv.set_key("db/.db", "PWC_HOTSPOT_SSID", content["ssid"])
 
-        # Set the new SSID to the global var
-        config.hotspot_ssid = content["ssid"]
+def save_hotspot_settings(values):
+    try:
+        changed = settings.update(values)
+    except OSError:
+        logger.exception("Failed saving hotspot settings.")
+        raise SettingsNotSaved
 
-        # Fetch ID of any current connection
-        connection = get_connection_id()
+    # Set the new details to the global vars
+    for key, value in values.items():
+        setattr(config, key, value)
 
-        # If there is a running hotspot, recreate it with the new details
-        if (
-            connection
-            and connection.GetSettings()["802-11-wireless"]["mode"] == "ap"
-        ):
-            wifi_forget_thread = threading.Thread(
-                target=forget,
-                kwargs={"create_new_hotspot": True},
-            )
-            wifi_forget_thread.start()
+    # If there is a running hotspot, restart it with the new details
+    if changed and hotspot_running():
+        job = jobs.submit("hotspot", connect, {})
+        return {"message": "ok", "job": job["id"]}, 200
 
-        return {"message": "ok"}, 200
+    return {"message": "ok", "job": None}, 200
 
 
 class wifi_set_interface(Resource):
@@ -154,6 +187,13 @@ class wifi_set_interface(Resource):
         if not request.get_json() or "interface" not in request.get_json():
             return {"message": "Interface value not provided."}, 500
         else:
-            config.interface = request.get_json()["interface"]
-            logger.info(f"Interface changed to {config.interface}")
+            set_interface(request.get_json()["interface"])
+
+            # Report access points seen by the new device, and scan with it
+            scanner.watch_access_points()
+            scanner.refresh()
+
+            # Finish starting up now there is a device to start up on
+            readiness.retry()
+
             return {"message": "ok"}, 200
@@ -1,83 +1,169 @@
 import config
-import os
-import time
+from common import connectivity
+from common import events
+from common import health
+from common import link_state
+from common import metrics
+from common import readiness
+from common import tracing
+from common import scanner
 from common.errors import errors
 from common.errors import logger
-from common.system import dnsmasq
+from common.errors import WifiDeviceNotFound
 from common.system import led
 from common.wifi import auto_connect
 from common.wifi import check_device_state
 from common.wifi import check_wifi_status
 from common.wifi import connect
 from common.wifi import get_device
-from common.wifi import refresh_networks
+from common.wifi import handle_link_lost
+from common.wifi import hotspot_running
+from common.wifi import reconnect
+from common.wifi import start_hotspot_services
+from common.wifi import wait_for_networkmanager
 from config import host
 from config import port
 from flask import Flask
+from flask import request
 from flask_cors import CORS
 from flask_restful import Api
+from resources.system_routes import system_events
 from resources.system_routes import system_health_check
+from resources.system_routes import system_metrics
+from resources.system_routes import system_readiness
+from resources.system_routes import system_trace
 from resources.wifi_routes import wifi_connect
 from resources.wifi_routes import wifi_connection_status
 from resources.wifi_routes import wifi_forget
+from resources.wifi_routes import wifi_hotspot_clients
+from resources.wifi_routes import wifi_job
 from resources.wifi_routes import wifi_list_access_points
 from resources.wifi_routes import wifi_set_hotspot_password
 from resources.wifi_routes import wifi_set_hotspot_ssid
 from resources.wifi_routes import wifi_set_interface
-from waitress import serve
+from waitress import create_server
 
-# Set default interface
-device = get_device()
-config.interface = device.Udi[device.Udi.rfind("/") + 1 :].lower()
 
-# Create Flask app instance
-app = Flask(__name__)
+def startup():
+    # Begin loading program
+    logger.info("Checking for previously configured Wi-Fi connections...")
 
-# Allow CORS
-CORS(app)
+    # Allow time for an existing saved Wi-Fi connection to connect, moving on
+    # as soon as NetworkManager has settled.
+    wait_for_networkmanager(config.boot_timeout)
 
-# Load Flask-Restful API
-api = Api(app, errors=errors)
+    # Log interface status
+    if config.requested_interface:
+        logger.info(f"Interface set to {config.requested_interface}")
 
-# Begin loading program
-logger.info("Checking for previously configured Wi-Fi connections...")
+    # If the Wi-Fi connection or device is already active, do nothing
+    if check_wifi_status() or check_device_state():
+        led(1)
+        logger.info("A Wi-Fi connection or hotspot is already active.")
 
-# Start dnsmasq service for assigning IPs to connected devices
-dnsmasq()
+        # Serve devices joining a hotspot left running. Otherwise this is
+        # started along with the hotspot.
+        if hotspot_running():
+            start_hotspot_services()
+    # If the Wi-Fi connection and device are not active, try the networks
+    # connected to before and otherwise start a hotspot. NetworkManager scans
+    # when the device becomes available, so there is no need to refresh the
+    # networks list first.
+    else:
+        led(0)
+        logger.info("Trying known networks...")
+        if reconnect():
+            logger.info("Connected to a known network.")
+        elif config.auto_connect_kargs:
+            logger.info("Attempting auto-connect...")
+            auto_connect(**config.auto_connect_kargs)
+        else:
+            connect()
+
+    # Reconnect or start the hotspot if the Wi-Fi link drops later on
+    link_state.on_link_lost(handle_link_lost)
 
-# Allow time for an exsiting saved Wi-Fi connection to connect.
-time.sleep(10)
+    # Keep the list of nearby access points fresh in the background
+    scanner.start()
 
-# Log interface status
-if "PWC_INTERFACE" in os.environ:
-    logger.info(f"Interface set to {os.environ['PWC_INTERFACE']}")
+    # Check for internet access in the background
+    connectivity.start()
 
-# If the Wi-Fi connection or device is already active, do nothing
-if check_wifi_status() or check_device_state():
-    led(1)
-    logger.info("A Wi-Fi connection or hotspot is already active.")
+    readiness.mark_ready()
     logger.info("Ready...")
-# If the Wi-Fi connection and device are not active, start a hotspot
-else:
-    led(0)
-    refresh_networks(retries=1)
-    if config.auto_connect_kargs:
-        logger.info("Attempting auto-connect...")
-        auto_connect(**config.auto_connect_kargs)
-    else:
-        connect()
-
-# Health check routes
-api.add_resource(system_health_check, "/healthcheck")
-
-# Wi-Fi routes
-api.add_resource(wifi_connect, "/v1/connect")
-api.add_resource(wifi_connection_status, "/v1/connection_status")
-api.add_resource(wifi_forget, "/v1/forget")
-api.add_resource(wifi_list_access_points, "/v1/list_access_points")
-api.add_resource(wifi_set_hotspot_password, "/v1/set_hotspot_password")
-api.add_resource(wifi_set_hotspot_ssid, "/v1/set_hotspot_ssid")
-api.add_resource(wifi_set_interface, "/v1/set_interface")
-
-logger.info(f"Listening on {host} port {port}")
-serve(app, host=host, port=port)
+
+
+def create_app():
+    # Builds the app without talking to NetworkManager or starting anything,
+    # so it is cheap to make, for example in tests and benchmarks.
+    app = Flask(__name__)
+
+    # Allow CORS
+    CORS(app)
+
+    # Load Flask-Restful API
+    api = Api(app, errors=errors)
+
+    # Record request latency for the metrics endpoint
+    metrics.instrument(app)
+
+    # Trace requests when tracing is on
+    tracing.instrument(app)
+
+    # Hold back changes to the Wi-Fi connection while startup is running. If
+    # it failed they are let through, so an interface can be chosen.
+    @app.before_request
+    def wait_until_ready():
+        if (
+            request.method == "POST"
+            and readiness.get_state() == readiness.STARTING
+        ):
+            return {"message": readiness.STARTING}, 503
+
+    # Health check routes
+    api.add_resource(system_health_check, "/healthcheck")
+    api.add_resource(system_readiness, "/v1/readiness")
+    api.add_resource(system_metrics, "/v1/metrics")
+    api.add_resource(system_events, "/v1/events")
+    api.add_resource(system_trace, "/v1/trace")
+
+    # Wi-Fi routes
+    api.add_resource(wifi_connect, "/v1/connect")
+    api.add_resource(wifi_connection_status, "/v1/connection_status")
+    api.add_resource(wifi_forget, "/v1/forget")
+    api.add_resource(wifi_hotspot_clients, "/v1/hotspot/clients")
+    api.add_resource(wifi_job, "/v1/jobs/<job_id>")
+    api.add_resource(wifi_list_access_points, "/v1/list_access_points")
+    api.add_resource(wifi_set_hotspot_password, "/v1/set_hotspot_password")
+    api.add_resource(wifi_set_hotspot_ssid, "/v1/set_hotspot_ssid")
+    api.add_resource(wifi_set_interface, "/v1/set_interface")
+
+    return app
+
+
+def main():
+    # Set default interface. Without a Wi-Fi device the API still starts, and
+    # reports the device as missing rather than exiting.
+    try:
+        get_device()
+    except WifiDeviceNotFound:
+        logger.error("Starting without a Wi-Fi device.")
+
+    # Listen straight away so the API can report progress while starting up
+    server = create_server(create_app(), host=host, port=port)
+    readiness.mark_listening()
+    logger.info(f"Listening on {host} port {port}")
+
+    # Stream state changes to clients that subscribe to /v1/events
+    events.start()
+
+    # Check the health of each part in the background for /healthcheck
+    health.start()
+
+    readiness.start(startup)
+
+    server.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The app is run from src, so its modules are imported as top-level ones
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
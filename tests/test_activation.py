@@ -0,0 +1,195 @@
+import pytest
+import threading
+import types
+from common import nm
+from common import nm_signals
+from common import wifi
+from concurrent.futures import ThreadPoolExecutor
+
+# The NetworkManager constants used, with NetworkManager's values
+FAKE_PNM = types.SimpleNamespace(
+    NM_DEVICE_STATE_DISCONNECTED=30,
+    NM_DEVICE_STATE_PREPARE=40,
+    NM_DEVICE_STATE_CONFIG=50,
+    NM_DEVICE_STATE_NEED_AUTH=60,
+    NM_DEVICE_STATE_ACTIVATED=100,
+    NM_DEVICE_STATE_FAILED=120,
+    NM_DEVICE_STATE_REASON_NONE=0,
+    NM_DEVICE_STATE_REASON_NO_SECRETS=7,
+    NM_DEVICE_STATE_REASON_SUPPLICANT_DISCONNECT=8,
+    NM_ACTIVE_CONNECTION_STATE_ACTIVATING=1,
+    NM_ACTIVE_CONNECTION_STATE_ACTIVATED=2,
+    NM_ACTIVE_CONNECTION_STATE_DEACTIVATED=4,
+    NM_ACTIVE_CONNECTION_STATE_REASON_NO_SECRETS=9,
+)
+
+
+class FakeActiveConnection:
+    def __init__(self, path, state):
+        self.object_path = path
+        self.State = state
+
+
+class FakeDevice:
+    object_path = "/org/freedesktop/NetworkManager/Devices/1"
+
+    def __init__(self, active_connection):
+        self.ActiveConnection = active_connection
+
+
+class FakeMatch:
+    def __init__(self, handlers, interface):
+        self.handlers = handlers
+        self.interface = interface
+
+    def remove(self):
+        del self.handlers[self.interface]
+
+
+@pytest.fixture
+def signals(monkeypatch):
+    # Handlers subscribed to, by interface. Set once activate() has been
+    # called and the active connection subscribed to.
+    handlers = {}
+    subscribed = threading.Event()
+
+    def subscribe(handler, signal, interface, path=None, **kwargs):
+        handlers[interface] = handler
+        if interface == nm_signals.NM_ACTIVE_CONNECTION:
+            subscribed.set()
+        return FakeMatch(handlers, interface)
+
+    def names(prefix):
+        return {
+            value: name[len(prefix) :]
+            for name, value in vars(FAKE_PNM).items()
+            if name.startswith(prefix)
+        }
+
+    monkeypatch.setattr(wifi, "Pnm", FAKE_PNM)
+    monkeypatch.setattr(nm, "names", names)
+    monkeypatch.setattr(nm_signals, "subscribe", subscribe)
+
+    handlers["subscribed"] = subscribed
+    return handlers
+
+
+@pytest.fixture
+def hotspot():
+    # The device is still running the hotspot being switched away from
+    return FakeActiveConnection(
+        "/org/freedesktop/NetworkManager/ActiveConnection/1",
+        FAKE_PNM.NM_ACTIVE_CONNECTION_STATE_ACTIVATED,
+    )
+
+
+@pytest.fixture
+def new_connection():
+    return FakeActiveConnection(
+        "/org/freedesktop/NetworkManager/ActiveConnection/2",
+        FAKE_PNM.NM_ACTIVE_CONNECTION_STATE_ACTIVATING,
+    )
+
+
+def start(signals, device, active_connection, timeout=5):
+    # Runs wait_for_activation() in the background, returning once it is
+    # subscribed to the new active connection.
+    pool = ThreadPoolExecutor(max_workers=1)
+    future = pool.submit(
+        wifi.wait_for_activation, device, lambda: active_connection, timeout
+    )
+    pool.shutdown(wait=False)
+    assert signals["subscribed"].wait(5)
+    return future
+
+
+def device_state(signals, state, reason=0):
+    signals[nm_signals.NM_DEVICE](
+        state, FAKE_PNM.NM_DEVICE_STATE_CONFIG, reason
+    )
+
+
+def test_old_connection_still_activated(signals, hotspot, new_connection):
+    device = FakeDevice(hotspot)
+    future = start(signals, device, new_connection, timeout=0.5)
+
+    device_state(signals, FAKE_PNM.NM_DEVICE_STATE_ACTIVATED)
+
+    assert future.result(5) == (False, "TIMEOUT")
+
+
+def test_new_connection_activated(signals, hotspot, new_connection):
+    device = FakeDevice(hotspot)
+    future = start(signals, device, new_connection)
+
+    device_state(signals, FAKE_PNM.NM_DEVICE_STATE_ACTIVATED)
+    assert not future.done()
+
+    new_connection.State = FAKE_PNM.NM_ACTIVE_CONNECTION_STATE_ACTIVATED
+    device.ActiveConnection = new_connection
+    device_state(signals, FAKE_PNM.NM_DEVICE_STATE_ACTIVATED)
+
+    assert future.result(5) == (True, None)
+
+
+def test_active_connection_activated(signals, hotspot, new_connection):
+    future = start(signals, FakeDevice(hotspot), new_connection)
+
+    signals[nm_signals.NM_ACTIVE_CONNECTION](
+        FAKE_PNM.NM_ACTIVE_CONNECTION_STATE_ACTIVATED, 0
+    )
+
+    assert future.result(5) == (True, None)
+
+
+def test_terminal_device_reason(signals, hotspot, new_connection):
+    future = start(signals, FakeDevice(hotspot), new_connection)
+
+    device_state(
+        signals,
+        FAKE_PNM.NM_DEVICE_STATE_DISCONNECTED,
+        FAKE_PNM.NM_DEVICE_STATE_REASON_NO_SECRETS,
+    )
+
+    assert future.result(5) == (False, "NO_SECRETS")
+
+
+def test_active_connection_deactivated(signals, hotspot, new_connection):
+    future = start(signals, FakeDevice(hotspot), new_connection)
+
+    signals[nm_signals.NM_ACTIVE_CONNECTION](
+        FAKE_PNM.NM_ACTIVE_CONNECTION_STATE_DEACTIVATED,
+        FAKE_PNM.NM_ACTIVE_CONNECTION_STATE_REASON_NO_SECRETS,
+    )
+
+    assert future.result(5) == (False, "NO_SECRETS")
+
+
+def test_timeout(signals, hotspot, new_connection):
+    future = start(signals, FakeDevice(hotspot), new_connection, timeout=0.2)
+
+    assert future.result(5) == (False, "TIMEOUT")
+    assert set(signals) == {"subscribed"}
+
+
+def test_poll_old_connection(monkeypatch, hotspot, new_connection):
+    monkeypatch.setattr(wifi, "Pnm", FAKE_PNM)
+    monkeypatch.setattr(wifi.time, "sleep", lambda seconds: None)
+
+    assert wifi.poll_activation(FakeDevice(hotspot), new_connection, 3) == (
+        False,
+        "TIMEOUT",
+    )
+
+
+def test_poll_new_connection(monkeypatch, new_connection):
+    monkeypatch.setattr(wifi, "Pnm", FAKE_PNM)
+    device = FakeDevice(None)
+
+    def sleep(seconds):
+        new_connection.State = FAKE_PNM.NM_ACTIVE_CONNECTION_STATE_ACTIVATED
+        device.ActiveConnection = new_connection
+
+    monkeypatch.setattr(wifi.time, "sleep", sleep)
+
+    assert wifi.poll_activation(device, new_connection, 3) == (True, None)
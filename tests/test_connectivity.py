@@ -0,0 +1,64 @@
+import pytest
+import socket
+from common import connectivity
+
+
+@pytest.fixture
+def listening():
+    # A local stand-in for an internet target
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        s.listen()
+        yield ("127.0.0.1", s.getsockname()[1])
+
+
+@pytest.fixture
+def closed():
+    # A port nothing listens on, so connections are refused
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    return ("127.0.0.1", port)
+
+
+def test_probe(listening):
+    latency = connectivity.probe(*listening, timeout=1)
+
+    assert latency is not None
+    assert 0 <= latency < 1
+
+
+def test_probe_closed(closed):
+    assert connectivity.probe(*closed, timeout=1) is None
+
+
+def test_probe_targets(listening):
+    assert connectivity.probe_targets([listening], timeout=1) is not None
+
+
+def test_probe_targets_closed(closed):
+    assert connectivity.probe_targets([closed, closed], timeout=1) is None
+
+
+def test_probe_targets_mixed(listening, closed):
+    assert (
+        connectivity.probe_targets([closed, listening, closed], timeout=1)
+        is not None
+    )
+
+
+def test_probe_no_targets():
+    assert connectivity.probe_targets([]) is None
+
+
+def test_check(monkeypatch, listening, closed):
+    monkeypatch.setattr(connectivity.config, "internet_source_nm", False)
+    monkeypatch.setattr(
+        connectivity.config, "internet_targets", [closed, listening]
+    )
+    assert connectivity.check() is True
+
+    monkeypatch.setattr(connectivity.config, "internet_targets", [closed])
+    assert connectivity.check() is False
+    assert connectivity.get_status()["latency"] is None
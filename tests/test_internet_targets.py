@@ -0,0 +1,33 @@
+import config
+
+
+def test_targets():
+    assert config.parse_internet_targets("1.1.1.1:53, example.com:443") == [
+        ("1.1.1.1", 53),
+        ("example.com", 443),
+    ]
+
+
+def test_ipv6_target():
+    assert config.parse_internet_targets("[2606:4700::1111]:53") == [
+        ("2606:4700::1111", 53)
+    ]
+
+
+def test_blank_entries():
+    assert config.parse_internet_targets(",1.1.1.1:53,, ") == [("1.1.1.1", 53)]
+
+
+def test_malformed_entries():
+    assert config.parse_internet_targets(
+        "1.1.1.1, :53, 1.1.1.1:http, 1.1.1.1:0, 1.1.1.1:65536, 8.8.8.8:53"
+    ) == [("8.8.8.8", 53)]
+
+
+def test_defaults():
+    assert config.parse_internet_targets("") == list(
+        config.DEFAULT_INTERNET_TARGETS
+    )
+    assert config.parse_internet_targets("nonsense") == list(
+        config.DEFAULT_INTERNET_TARGETS
+    )
@@ -0,0 +1,35 @@
+import pytest
+from common import jobs
+
+
+def wait(job_id):
+    # Jobs run on the worker thread, so wait for the job to finish
+    for _ in range(500):
+        job = jobs.get(job_id)
+        if job["finished_at"] is not None:
+            return job
+        jobs.time.sleep(0.01)
+
+    pytest.fail(f"Job {job_id} did not finish.")
+
+
+def fail():
+    raise ValueError
+
+
+@pytest.mark.parametrize(
+    "target, state, result, error",
+    [
+        (lambda: True, jobs.SUCCEEDED, True, None),
+        (lambda: {"removed": 2}, jobs.SUCCEEDED, {"removed": 2}, None),
+        (lambda: None, jobs.SUCCEEDED, None, None),
+        (lambda: False, jobs.FAILED, False, None),
+        (fail, jobs.FAILED, None, "ValueError"),
+    ],
+)
+def test_outcome(target, state, result, error):
+    job = wait(jobs.submit("test", target, {})["id"])
+
+    assert job["state"] == state
+    assert job["result"] == result
+    assert job["error"] == error
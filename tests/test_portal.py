@@ -0,0 +1,90 @@
+import config
+import pytest
+import socket
+from common import metrics
+from common import portal
+
+
+@pytest.fixture
+def server(monkeypatch):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    monkeypatch.setattr(config, "portal_host", "127.0.0.1")
+    monkeypatch.setattr(config, "portal_port", port)
+    portal.start()
+    yield port
+    portal.stop()
+
+
+def fetch(port, path):
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as s:
+        s.sendall(f"GET {path} HTTP/1.1\r\nHost: probe\r\n\r\n".encode())
+        response = b""
+        while chunk := s.recv(4096):
+            response += chunk
+
+    head, _, body = response.partition(b"\r\n\r\n")
+    status, *headers = head.decode("latin-1").split("\r\n")
+    return status, dict(h.split(": ", 1) for h in headers), body
+
+
+def test_page(monkeypatch):
+    monkeypatch.setattr(config, "portal_url", None)
+    monkeypatch.setattr(config, "hotspot_ssid", "<Setup>")
+
+    head, _, body = portal.respond().partition(b"\r\n\r\n")
+
+    assert head.startswith(b"HTTP/1.1 200 OK")
+    assert b"Content-Length: %d" % len(body) in head
+    assert b"&lt;Setup&gt;" in body
+
+
+def test_redirect(monkeypatch):
+    monkeypatch.setattr(config, "portal_url", "http://192.168.42.1/")
+
+    head = portal.respond().partition(b"\r\n\r\n")[0]
+
+    assert head.startswith(b"HTTP/1.1 302 Found")
+    assert b"Location: http://192.168.42.1/" in head
+
+
+def answered(probe):
+    # Returns how many of the probe's checks the metrics have counted
+    prefix = f'pwc_portal_requests_total{{probe="{probe}"}} '
+    for line in metrics.render().splitlines():
+        if line.startswith(prefix):
+            return float(line[len(prefix) :])
+
+    return 0
+
+
+@pytest.mark.parametrize(
+    "path, probe",
+    [
+        ("/generate_204", "android"),
+        ("/hotspot-detect.html", "apple"),
+        ("/connecttest.txt", "windows"),
+        ("http://connectivitycheck.gstatic.com/generate_204", "android"),
+        ("/?utm=1", "other"),
+    ],
+)
+def test_probes(server, monkeypatch, path, probe):
+    monkeypatch.setattr(config, "portal_url", None)
+    before = answered(probe)
+
+    status, headers, body = fetch(server, path)
+
+    # Anything but the response each check expects shows the sign-in sheet
+    assert status == "HTTP/1.1 200 OK"
+    assert headers["Content-Type"] == "text/html"
+    assert headers["Connection"] == "close"
+    assert int(headers["Content-Length"]) == len(body)
+
+    # Counted once the connection is closed, which fetch() waits for
+    assert answered(probe) == before + 1
+    assert (
+        f'pwc_portal_response_duration_seconds_count{{probe="{probe}"}}'
+        in metrics.render()
+    )
@@ -0,0 +1,68 @@
+import pytest
+from common import connections
+from common import known_networks
+from common import wifi
+
+
+def entry(name, ssid, uuid, mode="infrastructure"):
+    return {
+        "connection": object(),
+        "settings": {
+            "connection": {"id": name, "uuid": uuid},
+            "802-11-wireless": {"ssid": ssid, "mode": mode},
+        },
+    }
+
+
+@pytest.fixture
+def saved(monkeypatch):
+    # Saved connections and known networks, set by each test
+    state = {"connections": [], "networks": {}}
+
+    def get_by(key):
+        def lookup(value):
+            for item in state["connections"]:
+                if item["settings"]["connection"][key] == value:
+                    return item
+            return None
+
+        return lookup
+
+    monkeypatch.setattr(connections, "get_by_id", get_by("id"))
+    monkeypatch.setattr(connections, "get_by_uuid", get_by("uuid"))
+    monkeypatch.setattr(known_networks, "get", state["networks"].get)
+    return state
+
+
+def test_by_uuid(saved):
+    home = entry("Home Wi-Fi", "home", "1")
+    saved["connections"].append(home)
+    saved["networks"]["home"] = {"uuid": "1"}
+
+    assert wifi.get_saved_connection("home") is home
+
+
+def test_by_name(saved):
+    home = entry("PWC home", "home", "1")
+    saved["connections"] += [entry("PWC work", "work", "2"), home]
+
+    assert wifi.get_saved_connection("home") is home
+    assert wifi.get_saved_connection("cafe") is None
+
+
+def test_earlier_version(saved):
+    home = entry("PWC", "home", "1")
+    saved["connections"].append(home)
+
+    assert wifi.get_saved_connection("home") is home
+    assert wifi.get_saved_connection("work") is None
+
+
+def test_not_hotspot_or_other(saved):
+    saved["connections"] += [
+        entry("PWC", "home", "1", mode="ap"),
+        entry("Someone else's", "work", "2"),
+    ]
+
+    assert wifi.get_saved_connection("home") is None
+    assert wifi.get_saved_connection("work") is None
@@ -0,0 +1,98 @@
+from common import wifi
+
+
+class FakeConnection:
+    def __init__(self, secrets):
+        self.secrets = secrets
+
+    def GetSecrets(self, section):
+        return {section: self.secrets.get(section, {})}
+
+
+def entry(settings, secrets=None):
+    return {
+        "settings": settings,
+        "connection": FakeConnection(secrets or {}),
+    }
+
+
+def wanted(psk="secret"):
+    return {
+        "connection": {"id": "home", "type": "802-11-wireless"},
+        "802-11-wireless": {"ssid": "home", "mode": "infrastructure"},
+        "802-11-wireless-security": {"key-mgmt": "wpa-psk", "psk": psk},
+        "ipv4": {"method": "auto"},
+        "ipv6": {"method": "auto"},
+    }
+
+
+def saved(extra=None):
+    settings = {
+        "connection": {
+            "id": "home",
+            "type": "802-11-wireless",
+            "timestamp": 1700000000,
+        },
+        "802-11-wireless": {
+            "ssid": "home",
+            "mode": "infrastructure",
+            "seen-bssids": ["00:11:22:33:44:55"],
+        },
+        "802-11-wireless-security": {"key-mgmt": "wpa-psk"},
+        "ipv4": {"method": "auto"},
+        "ipv6": {"method": "auto", "addr-gen-mode": 1},
+    }
+    for section, values in (extra or {}).items():
+        settings[section].update(values)
+
+    return settings
+
+
+def test_matching_settings():
+    psk = {"802-11-wireless-security": {"psk": "secret"}}
+
+    assert wifi.settings_unchanged(entry(saved(), psk), wanted())
+
+
+def test_changed_password():
+    psk = {"802-11-wireless-security": {"psk": "old"}}
+
+    assert not wifi.settings_unchanged(entry(saved(), psk), wanted())
+
+
+def test_changed_setting():
+    psk = {"802-11-wireless-security": {"psk": "secret"}}
+    settings = wanted()
+    settings["802-11-wireless"]["hidden"] = True
+
+    assert not wifi.settings_unchanged(entry(saved(), psk), settings)
+
+
+def test_pinned_bssid():
+    psk = {"802-11-wireless-security": {"psk": "secret"}}
+    settings = saved({"802-11-wireless": {"bssid": "00:11:22:33:44:55"}})
+
+    assert not wifi.settings_unchanged(entry(settings, psk), wanted())
+
+
+def test_stale_interface_name():
+    psk = {"802-11-wireless-security": {"psk": "secret"}}
+    settings = saved({"connection": {"interface-name": "wlan1"}})
+
+    assert not wifi.settings_unchanged(entry(settings, psk), wanted())
+
+
+def test_empty_defaults():
+    psk = {"802-11-wireless-security": {"psk": "secret"}}
+    settings = saved(
+        {"connection": {"interface-name": ""}, "ipv4": {"addresses": []}}
+    )
+
+    assert wifi.settings_unchanged(entry(settings, psk), wanted())
+
+
+def test_removed_password():
+    settings = wanted()
+    del settings["802-11-wireless-security"]
+
+    assert not wifi.settings_unchanged(entry(saved()), settings)